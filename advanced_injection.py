@@ -6,47 +6,80 @@ Advanced injection of enhanced CRM functionality using binary patterns
 import sys
 import os
 
-def find_crm_engine_class(dll_data):
-    """Find the CrmLinkEngine class location in the assembly"""
-    patterns = [
-        b"CrmLinkEngine",
-        b"ProcessIncomingEmailForCrm", 
-        b"get_CrmLinkEngine",
-        b"_crmLinkEngine"
-    ]
+from assembly_loader import open_assembly
+from cli_metadata import locate_method, read_metadata
+from il_method_body import extract_method_body, transplant_method_body
+from method_hashes import diff_assemblies, differing_method_names, print_method_diff
+from patch_stats import with_stats
+from pattern_scanner import scan_crm_markers
+
+# Markers of the CrmLinkEngine class
+CRM_ENGINE_PATTERNS = [
+    b"CrmLinkEngine",
+    b"ProcessIncomingEmailForCrm", 
+    b"get_CrmLinkEngine",
+    b"_crmLinkEngine"
+]
+
+# Unique strings from our enhanced code
+ENHANCED_MARKERS = [
+    b"LinkChainToCrmEnhanced",
+    b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
+    b"Enhanced automatic linking",
+    b"CRM conditions met"
+]
+
+# Simple method patterns that we can replace
+CRM_METHOD_PATTERNS = [
+    b"ProcessIncomingEmailForCrm",
+    b"AutoLinkToCrm"
+]
+
+def find_crm_engine_class(dll_data, hits=None, chunk_size=None):
+    """Find the CrmLinkEngine class location in the assembly
+
+    chunk_size forces a bounded-memory chunked scan (see pattern_scanner).
+    """
+    if hits is None:
+        hits = scan_crm_markers(dll_data, chunk_size, CRM_ENGINE_PATTERNS, first_only=True)
     
     positions = {}
-    for pattern in patterns:
-        pos = dll_data.find(pattern)
+    for pattern in CRM_ENGINE_PATTERNS:
+        pos = hits.first(pattern)
         if pos != -1:
             positions[pattern] = pos
             
     return positions
 
-def extract_enhanced_crm_code(enhanced_dll):
+def extract_enhanced_crm_code(enhanced, hits=None, metadata=None, chunk_size=None):
     """Extract the enhanced CRM code regions from our DLL"""
-    with open(enhanced_dll, 'rb') as f:
-        data = f.read()
+    if hits is None:
+        hits = scan_crm_markers(enhanced, chunk_size, ENHANCED_MARKERS, first_only=True)
+    if metadata is None:
+        metadata = read_metadata(enhanced)
     
     # Find our enhanced methods
     enhanced_regions = {}
     
-    # Look for unique strings from our enhanced code
-    enhanced_markers = [
-        b"LinkChainToCrmEnhanced",
-        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
-        b"Enhanced automatic linking",
-        b"CRM conditions met"
-    ]
-    
-    for marker in enhanced_markers:
-        pos = data.find(marker)
+    for marker in ENHANCED_MARKERS:
+        # Method names resolve to exactly their IL body; other markers are plain strings
+        method = locate_method(metadata, marker.decode('utf-8'))
+        if method is not None:
+            region, _ = extract_method_body(enhanced, method)
+            enhanced_regions[marker] = {
+                'data': region,
+                'offset': method.offset,
+                'marker_pos': 0
+            }
+            print(f"Found enhanced method body for: {marker.decode('utf-8')}")
+            continue
+        
+        pos = hits.first(marker)
         if pos != -1:
-            # Extract surrounding code region
-            start = max(0, pos - 1024)
-            end = min(len(data), pos + 2048)
+            # Extract surrounding code region (a view, not a copy)
+            region, start = enhanced.window(pos, 1024, 2048)
             enhanced_regions[marker] = {
-                'data': data[start:end],
+                'data': region,
                 'offset': start,
                 'marker_pos': pos - start
             }
@@ -54,30 +87,89 @@ def extract_enhanced_crm_code(enhanced_dll):
     
     return enhanced_regions
 
-def smart_inject(original_dll, enhanced_dll, output_dll):
-    """Smart injection using pattern matching and code replacement"""
+def smart_inject(original_dll, enhanced_dll, output_dll, diff_only=False):
+    """Smart injection using pattern matching and code replacement
+
+    With diff_only, CrmLinkEngine methods whose bodies are identical in both
+    DLLs are skipped, and None is returned (without writing output_dll) when
+    nothing differs.
+    """
     
     print("🔍 Analyzing assemblies...")
     
-    # Load both DLLs
-    with open(original_dll, 'rb') as f:
-        original_data = bytearray(f.read())
+    # Map both DLLs; the original is copy-on-write so only patched pages are copied
+    with open_assembly(original_dll, copy_on_write=True) as original, \
+            open_assembly(enhanced_dll) as enhanced:
+        plan = plan_smart_inject(original, enhanced, diff_only)
+        if plan is None or plan is False:
+            return plan
+        
+        # Write hybrid assembly
+        plan.write(original, output_dll)
+    
+    print(f"✅ Created hybrid assembly: {output_dll}")
+    return True
+
+def plan_smart_inject(original, enhanced, diff_only=False, original_hits=None, enhanced_hits=None,
+                      original_metadata=None, enhanced_metadata=None):
+    """Patch method stubs in original and plan the appended enhanced code
+
+    Returns the PatchPlan to write original through, None when diff_only
+    finds nothing to inject, or False when the enhanced DLL has no regions.
+    """
+    # One pass per assembly answers every marker lookup below
+    if original_metadata is None:
+        original_metadata = read_metadata(original)
+    if enhanced_metadata is None:
+        enhanced_metadata = read_metadata(enhanced)
+    
+    # Method names to leave alone because their bodies are identical
+    unchanged_methods = set()
+    if diff_only:
+        # Only the injected type's bodies decide whether there is anything to do
+        diff = diff_assemblies(original, enhanced, original_metadata, enhanced_metadata, "CrmLinkEngine")
+        if diff is None:
+            print("⚠️ --diff needs CLI metadata in both DLLs, injecting everything")
+        else:
+            print_method_diff(diff)
+            differing = differing_method_names(diff)
+            if not differing:
+                print("✅ CrmLinkEngine is identical in both DLLs - nothing to inject")
+                return None
+            unchanged_methods = {
+                method.name
+                for type_row in enhanced_metadata.find_types("CrmLinkEngine")
+                for method in enhanced_metadata.methods_of(type_row)
+                if method.name not in differing
+            }
+    
+    if original_hits is None:
+        original_hits = scan_crm_markers(original, patterns=CRM_ENGINE_PATTERNS + CRM_METHOD_PATTERNS,
+                                         first_only=True)
+    if enhanced_hits is None:
+        enhanced_hits = scan_crm_markers(enhanced, patterns=ENHANCED_MARKERS, first_only=True)
     
     # Extract enhanced regions
-    enhanced_regions = extract_enhanced_crm_code(enhanced_dll)
+    enhanced_regions = extract_enhanced_crm_code(enhanced, enhanced_hits, enhanced_metadata)
+    for marker in list(enhanced_regions):
+        if marker.decode('utf-8') in unchanged_methods:
+            print(f"  ⏭️ {marker.decode('utf-8')} unchanged, skipping")
+            del enhanced_regions[marker]
     
     if not enhanced_regions:
         print("❌ No enhanced regions found!")
         return False
     
-    print(f"📊 Original assembly: {len(original_data):,} bytes")
+    print(f"📊 Original assembly: {len(original):,} bytes")
     print(f"📊 Found {len(enhanced_regions)} enhanced regions")
     
     # Find CRM engine locations in original
-    original_crm_positions = find_crm_engine_class(original_data)
+    original_crm_positions = find_crm_engine_class(original, original_hits)
     print(f"📊 Found {len(original_crm_positions)} CRM patterns in original")
     
     injection_count = 0
+    appended = []
+    final_size = len(original)
     
     # Strategy 1: Append enhanced methods to end of assembly
     print("\n🔧 Strategy 1: Appending enhanced code...")
@@ -86,8 +178,9 @@ def smart_inject(original_dll, enhanced_dll, output_dll):
         enhanced_code = region['data']
         
         # Append to end of original assembly  
-        append_pos = len(original_data)
-        original_data.extend(enhanced_code)
+        append_pos = final_size
+        appended.append(enhanced_code)
+        final_size += len(enhanced_code)
         injection_count += 1
         
         print(f"  ✅ Appended {len(enhanced_code)} bytes at position {append_pos}")
@@ -95,55 +188,69 @@ def smart_inject(original_dll, enhanced_dll, output_dll):
     # Strategy 2: Try to replace existing CRM method stubs
     print("\n🔧 Strategy 2: Replacing method stubs...")
     
-    # Look for simple method patterns that we can replace
-    crm_method_patterns = [
-        b"ProcessIncomingEmailForCrm",
-        b"AutoLinkToCrm"
-    ]
-    
-    for pattern in crm_method_patterns:
-        original_pos = original_data.find(pattern)
+    for pattern in CRM_METHOD_PATTERNS:
+        if pattern.decode('utf-8') in unchanged_methods:
+            continue
+        # Real method stubs are replaced body for body
+        original_method = locate_method(original_metadata, pattern.decode('utf-8'))
+        enhanced_method = locate_method(enhanced_metadata, pattern.decode('utf-8'))
+        if original_method is not None and enhanced_method is not None:
+            print(f"  Found method body at {original_method.offset}: {pattern.decode('utf-8')}")
+            copied, new_size, old_size = transplant_method_body(original, original_method,
+                                                                enhanced, enhanced_method)
+            if copied:
+                injection_count += 1
+                print(f"    ✅ Replaced {new_size} bytes")
+            else:
+                print(f"    ⚠️ Enhanced body ({new_size} bytes) does not fit the original ({old_size} bytes)")
+            continue
+        
+        original_pos = original_hits.first(pattern)
         if original_pos != -1:
             print(f"  Found method pattern at {original_pos}: {pattern.decode('utf-8')}")
             
             # Find enhanced version
             for marker, region in enhanced_regions.items():
-                if pattern in region['data']:
+                region_end = region['offset'] + len(region['data'])
+                # The enhanced image is never patched, so a bounded find is exact
+                if enhanced.find(pattern, region['offset'], region_end) != -1:
                     print(f"    Replacing with enhanced version...")
                     
                     # Replace a reasonable chunk around the method
                     replacement_size = min(512, len(region['data']))
-                    end_pos = min(len(original_data), original_pos + replacement_size)
-                    
-                    original_data[original_pos:end_pos] = region['data'][:replacement_size]
+                    replaced = original.overwrite(original_pos, region['data'][:replacement_size])
                     injection_count += 1
-                    print(f"    ✅ Replaced {replacement_size} bytes")
+                    print(f"    ✅ Replaced {replaced} bytes")
                     break
     
     print(f"\n📊 Final Summary:")
     print(f"  Total injections: {injection_count}")
-    print(f"  Final size: {len(original_data):,} bytes")
-    print(f"  Size increase: {len(original_data) - 1544704:,} bytes")
+    print(f"  Final size: {final_size:,} bytes")
+    print(f"  Size increase: {final_size - len(original):,} bytes")
     
-    # Write hybrid assembly
-    with open(output_dll, 'wb') as f:
-        f.write(original_data)
-    
-    print(f"✅ Created hybrid assembly: {output_dll}")
-    return True
+    plan = original.plan()
+    for chunk in appended:
+        plan.append(chunk)
+    return plan
 
+@with_stats
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: advanced_injection.py <original_core.dll> <enhanced_mail.dll> <output.dll>")
+    args = [arg for arg in sys.argv[1:] if arg != "--diff"]
+    if len(args) != 3:
+        print("Usage: advanced_injection.py [--diff] [--stats] <original_core.dll> <enhanced_mail.dll> <output.dll>")
+        print("  --diff  skip CrmLinkEngine methods whose bodies are unchanged")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
         return
     
-    original_dll = sys.argv[1]
-    enhanced_dll = sys.argv[2] 
-    output_dll = sys.argv[3]
+    original_dll = args[0]
+    enhanced_dll = args[1] 
+    output_dll = args[2]
     
-    success = smart_inject(original_dll, enhanced_dll, output_dll)
+    success = smart_inject(original_dll, enhanced_dll, output_dll, diff_only="--diff" in sys.argv[1:])
     
-    if success:
+    if success is None:
+        print("✅ Output not written - original already has the enhanced CRM methods")
+    elif success:
         print("🎉 Advanced injection completed successfully!")
         print("⚠️  Note: This hybrid may need assembly validation")
     else:
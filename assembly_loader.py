@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped, zero-copy assembly loader shared by the patch scripts
+"""
+
+import mmap
+import os
+
+import patch_stats
+from patch_plan import PatchPlan
+
+
+class AssemblyImage:
+    """Read-only (or copy-on-write) view of an assembly file backed by mmap"""
+
+    def __init__(self, path, copy_on_write=False):
+        self.path = path
+        self.copy_on_write = copy_on_write
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._dirty = []
+
+        if self.size:
+            access = mmap.ACCESS_COPY if copy_on_write else mmap.ACCESS_READ
+            self._map = mmap.mmap(self._file.fileno(), 0, access=access)
+            self.view = memoryview(self._map)
+        else:
+            # mmap refuses empty files; an empty buffer behaves the same for scanning
+            self._map = None
+            self.view = memoryview(bytearray() if copy_on_write else b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, pattern):
+        return self.find(pattern) != -1
+
+    def close(self):
+        """Release the memoryview, the mapping and the file handle"""
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A caller still holds a region view; the mapping is freed with it
+                pass
+            self._map = None
+        self._file.close()
+
+    def find(self, pattern, start=0, end=None):
+        """Find the first occurrence of pattern without copying the image"""
+        if self._map is None:
+            return -1
+        if end is None:
+            end = self.size
+        return self._map.find(pattern, start, end)
+
+    def find_all(self, pattern, start=0, end=None):
+        """Return every (possibly overlapping) offset of pattern"""
+        positions = []
+        pos = self.find(pattern, start, end)
+        while pos != -1:
+            positions.append(pos)
+            pos = self.find(pattern, pos + 1, end)
+        return positions
+
+    def region(self, start, end):
+        """Return a zero-copy memoryview of [start, end) clamped to the image"""
+        start = max(0, start)
+        end = min(self.size, end)
+        return self.view[start:max(start, end)]
+
+    def window(self, pos, before, after):
+        """Return (view, offset) for the region before/after bytes around pos"""
+        start = max(0, pos - before)
+        return self.region(start, pos + after), start
+
+    def overwrite(self, offset, data):
+        """Overwrite bytes in place; only the touched pages get private copies"""
+        if not self.copy_on_write:
+            raise ValueError(f"{self.path} was not opened copy-on-write")
+        end = min(self.size, offset + len(data))
+        with patch_stats.phase("patch"):
+            self.view[offset:end] = data[:end - offset]
+        if end > offset:
+            self._dirty.append((offset, end))
+            patch_stats.count("bytes_patched", end - offset)
+        return end - offset
+
+    def dirty_ranges(self):
+        """Merged, sorted (start, end) ranges changed through overwrite()"""
+        merged = []
+        for start, end in sorted(self._dirty):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def fileno(self):
+        """Descriptor of the underlying file, for in-kernel copies"""
+        return self._file.fileno()
+
+    def plan(self):
+        """Empty PatchPlan for this image"""
+        return PatchPlan(self.size)
+
+    def save(self, output_path, inserts=(), tail=()):
+        """Write the (possibly modified) image with inserted and appended chunks
+
+        inserts is an iterable of (offset, data) pairs relative to the image;
+        the image itself is streamed through a PatchPlan, never copied.
+        """
+        plan = self.plan()
+        for offset, data in inserts:
+            plan.insert(min(max(offset, 0), self.size), data)
+        for chunk in tail:
+            plan.append(chunk)
+        return plan.write(self, output_path)
+
+class BufferImage(AssemblyImage):
+    """Writable in-memory image with the AssemblyImage interface, for
+    assemblies that only exist between the steps of a pipeline"""
+
+    # No file behind it, so scans never fall back to reading one in chunks
+    path = None
+
+    def __init__(self, buffer, name="<memory>"):
+        self.name = name
+        self.copy_on_write = True
+        self.size = len(buffer)
+        self._dirty = []
+        self._map = buffer
+        self.view = memoryview(buffer)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        self._map = None
+
+    def fileno(self):
+        return None
+
+
+def open_assembly(path, copy_on_write=False):
+    """Open an assembly for zero-copy scanning"""
+    with patch_stats.phase("load"):
+        image = AssemblyImage(path, copy_on_write=copy_on_write)
+    patch_stats.count("bytes_mapped", image.size)
+    return image
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Load-test the CRM linking strategies on a synthetic_crm_data.py dataset:
+new mail arrives in batches and each mode links it, reporting links/sec,
+poll latency percentiles and DB round trips per mode as JSON
+"""
+
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+from bench_patchers import source_version
+from crm_chain_contacts import ChainContacts
+from crm_checkpoint import Checkpoint
+from crm_contact_index import ContactIndex
+from crm_db import connect_sqlite, load_config
+from crm_linked_filter import LinkedMailFilter
+from crm_linker import ENTITY_TYPE_MAIL, LINKED_CATEGORY, NO_MATCH_CATEGORY, link_new, monitored_folders
+from crm_linker_async import DEFAULT_CONCURRENCY, AsyncConnectionPool, TenantBackoff, run_cycle
+
+BENCH_RESULTS_FILE = "linker_bench.json"
+DEFAULT_POLLS = 20
+DEFAULT_POLL_SIZE = 500
+# A mode stops polling once its polls took this long in total
+DEFAULT_TIME_LIMIT = 120
+
+MAIL_COLUMNS = ("id, id_mailbox, id_user, tenant, address, from_text, to_text, cc, subject, "
+                "date_received, folder, is_removed, chain_id")
+
+# runtime-crm-monitor.sh, one poll: count, link by CROSS JOIN + LIKE, mark the rest
+SHELL_COUNT_SQL = """
+    SELECT COUNT(*) FROM mail_mail m
+    WHERE m.date_received > ? AND m.folder IN ({folders})
+      AND NOT EXISTS (SELECT 1 FROM crm_relationship_event cre WHERE cre.entity_type = 0 AND cre.entity_id = m.id)
+"""
+SHELL_LINK_SQL = """
+    INSERT INTO crm_relationship_event (contact_id, entity_type, entity_id, content, create_on, create_by,
+                                        tenant_id, category_id, have_files)
+    SELECT DISTINCT c.id, 0, m.id, 'SHELL_AUTO_LINKED via ' || ci.data, datetime('now'), 'crm-monitor',
+                    m.tenant, -3, 0
+    FROM mail_mail m
+    CROSS JOIN crm_contact c
+    INNER JOIN crm_contact_info ci ON c.id = ci.contact_id
+    WHERE ci.type = 1
+      AND m.date_received > ? AND m.folder IN ({folders})
+      AND (LOWER(m.from_text) LIKE '%' || LOWER(ci.data) || '%'
+           OR LOWER(m.to_text) LIKE '%' || LOWER(ci.data) || '%'
+           OR LOWER(m.cc) LIKE '%' || LOWER(ci.data) || '%')
+      AND NOT EXISTS (SELECT 1 FROM crm_relationship_event cre
+                      WHERE cre.entity_type = 0 AND cre.entity_id = m.id AND cre.contact_id = c.id)
+"""
+SHELL_NO_MATCH_SQL = """
+    INSERT INTO crm_relationship_event (contact_id, entity_type, entity_id, content, create_on, create_by,
+                                        tenant_id, category_id, have_files)
+    SELECT DISTINCT 0, 0, m.id, 'NO_CRM_MATCH', datetime('now'), 'crm-monitor', m.tenant, -99, 0
+    FROM mail_mail m
+    WHERE m.date_received > ? AND m.folder IN ({folders})
+      AND NOT EXISTS (SELECT 1 FROM crm_relationship_event cre WHERE cre.entity_type = 0 AND cre.entity_id = m.id)
+"""
+
+# create_crm_trigger.sql for SQLite: exact match on the From address, inbox only.
+# SUBSTRING_INDEX(SUBSTRING_INDEX(x, '<', -1), '>', 1) becomes instr/substr, and
+# NOCASE stands in for MySQL's case-insensitive default collation.
+TRIGGER_SQL = """
+    CREATE TRIGGER IF NOT EXISTS auto_crm_link_emails
+    AFTER INSERT ON mail_mail
+    FOR EACH ROW WHEN NEW.folder = 2
+    BEGIN
+        INSERT INTO crm_relationship_event (tenant_id, contact_id, content, create_on, create_by, entity_type,
+                                            entity_id, category_id, last_modifed_on, last_modifed_by, have_files)
+        SELECT NEW.tenant, MIN(c.id), 'TRIGGER_AUTO_LINKED', NEW.date_received, NEW.id_user, 0, NEW.id, -3,
+               NEW.date_received, NEW.id_user, 0
+        FROM crm_contact c
+        JOIN crm_contact_info ci ON c.id = ci.contact_id
+        WHERE ci.data = TRIM(CASE WHEN instr(NEW.from_text, '<') > 0
+                                  THEN substr(NEW.from_text, instr(NEW.from_text, '<') + 1,
+                                              instr(NEW.from_text, '>') - instr(NEW.from_text, '<') - 1)
+                                  ELSE NEW.from_text END) COLLATE NOCASE
+          AND c.tenant_id = NEW.tenant
+          AND ci.type = 1
+        HAVING COUNT(*) > 0;
+    END
+"""
+
+MODES = ("shell", "trigger", "python", "python-guard", "async")
+
+
+class BenchDatabase:
+    """Working copy of the dataset with the last polls * poll_size messages
+    held back, to be fed in again one poll at a time"""
+
+    def __init__(self, dataset, path, arriving):
+        shutil.copyfile(dataset, path)
+        self.db = connect_sqlite(path)
+        self.path = path
+        high = self.db.query("SELECT MAX(id) FROM mail_mail")[0][0] or 0
+        self.cut = max(0, high - arriving)
+        self.pending = self.db.query(f"SELECT {MAIL_COLUMNS} FROM mail_mail WHERE id > ? ORDER BY id", (self.cut,))
+        self.db.execute("DELETE FROM crm_relationship_event WHERE entity_type = ? AND entity_id > ?",
+                        (ENTITY_TYPE_MAIL, self.cut)).close()
+        self.db.execute("DELETE FROM mail_mail WHERE id > ?", (self.cut,)).close()
+        self.db.commit()
+        self.last_received = self.db.query("SELECT MAX(date_received) FROM mail_mail")[0][0] or ""
+
+    def arrive(self, count, one_by_one=False):
+        """Insert the next count held-back messages; returns how many came in"""
+        rows, self.pending = self.pending[:count], self.pending[count:]
+        sql = f"INSERT INTO mail_mail ({MAIL_COLUMNS}) VALUES ({', '.join('?' * 13)})"
+        if one_by_one:
+            # As the mail service stores them, one INSERT per message
+            for row in rows:
+                self.db.execute(sql, row).close()
+        elif rows:
+            self.db.executemany(sql, rows).close()
+        self.db.commit()
+        return len(rows)
+
+    def outcome(self):
+        """(messages that arrived, links, no-match markers written for them)"""
+        arrived = self.db.query("SELECT COUNT(*) FROM mail_mail WHERE id > ?", (self.cut,))[0][0]
+        counts = dict(self.db.query("""
+            SELECT category_id, COUNT(*) FROM crm_relationship_event
+            WHERE entity_type = ? AND entity_id > ? GROUP BY category_id
+        """, (ENTITY_TYPE_MAIL, self.cut)))
+        return arrived, counts.get(LINKED_CATEGORY, 0), counts.get(NO_MATCH_CATEGORY, 0)
+
+    def unlinked(self, folders):
+        return self.db.query(f"""
+            SELECT COUNT(*) FROM mail_mail m
+            WHERE m.id > ? AND m.folder IN ({", ".join("?" * len(folders))})
+              AND NOT EXISTS (SELECT 1 FROM crm_relationship_event cre
+                              WHERE cre.entity_type = ? AND cre.entity_id = m.id)
+        """, [self.cut] + list(folders) + [ENTITY_TYPE_MAIL])[0][0]
+
+    def close(self):
+        self.db.close()
+
+
+def shell_poll(bench, folders):
+    """One runtime-crm-monitor.sh cycle since the last mail it saw"""
+    db = bench.db
+    marks = ", ".join("?" * len(folders))
+    since = bench.last_received
+    if db.query(SHELL_COUNT_SQL.format(folders=marks), [since] + folders)[0][0]:
+        db.execute(SHELL_LINK_SQL.format(folders=marks), [since] + folders).close()
+        db.execute(SHELL_NO_MATCH_SQL.format(folders=marks), [since] + folders).close()
+        db.commit()
+    bench.last_received = db.query("SELECT MAX(date_received) FROM mail_mail")[0][0]
+
+
+def run_mode(mode, bench, config, polls, poll_size, time_limit, concurrency):
+    """Feed polls batches through one mode; returns its poll timings and round trips"""
+    folders = monitored_folders(config)
+    db = bench.db
+    checkpoint = Checkpoint(bench.path + ".checkpoint.json", floor=bench.cut)
+    started = time.perf_counter()
+    index = linked = chains = None
+    if mode in ("python", "python-guard"):
+        index = ContactIndex.load(db)
+    if mode == "python":
+        linked = LinkedMailFilter.load(db, ENTITY_TYPE_MAIL)
+        chains = ChainContacts()
+    if mode == "trigger":
+        db.execute(TRIGGER_SQL).close()
+    setup_seconds = time.perf_counter() - started
+
+    timings, round_trips = [], 0
+    if mode == "async":
+        setup_seconds, round_trips = asyncio.run(_run_async(bench, config, checkpoint, polls, poll_size,
+                                                            time_limit, concurrency, timings))
+    for _ in range(polls if mode != "async" else 0):
+        if mode == "trigger":
+            # The trigger links inside the INSERTs, so the inserts are the poll
+            before = db.round_trips
+            started = time.perf_counter()
+            arrived = bench.arrive(poll_size, one_by_one=True)
+        else:
+            arrived = bench.arrive(poll_size)
+            before = db.round_trips
+            started = time.perf_counter()
+            if mode == "shell":
+                shell_poll(bench, folders)
+            else:
+                index.refresh(db)
+                link_new(db, index, config, checkpoint, linked, chains)
+        timings.append(time.perf_counter() - started)
+        round_trips += db.round_trips - before
+        if not arrived or sum(timings) > time_limit:
+            break
+    return setup_seconds, timings, round_trips
+
+
+async def _run_async(bench, config, checkpoint, polls, poll_size, time_limit, concurrency, timings):
+    pool = AsyncConnectionPool(lambda: connect_sqlite(bench.path), concurrency + 1)
+    try:
+        started = time.perf_counter()
+        index = await pool.run(ContactIndex.load)
+        linked = await pool.run(LinkedMailFilter.load, ENTITY_TYPE_MAIL)
+        setup_seconds = time.perf_counter() - started
+        backoff = TenantBackoff()
+        chains = ChainContacts()
+        round_trips = 0
+        for _ in range(polls):
+            arrived = bench.arrive(poll_size)
+            before = pool.round_trips
+            started = time.perf_counter()
+            await pool.run(index.refresh)
+            await run_cycle(pool, index, config, checkpoint, backoff, concurrency, linked=linked, chains=chains)
+            timings.append(time.perf_counter() - started)
+            round_trips += pool.round_trips - before
+            if not arrived or sum(timings) > time_limit:
+                break
+        return setup_seconds, round_trips
+    finally:
+        pool.close()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def bench_mode(mode, dataset, workdir, config, polls, poll_size, time_limit, concurrency):
+    bench = BenchDatabase(dataset, os.path.join(workdir, f"{mode}.sqlite"), polls * poll_size)
+    try:
+        setup_seconds, timings, round_trips = run_mode(mode, bench, config, polls, poll_size, time_limit,
+                                                       concurrency)
+        arrived, links, no_match = bench.outcome()
+        unlinked = bench.unlinked(monitored_folders(config))
+    finally:
+        bench.close()
+    total = sum(timings)
+    return {
+        "mode": mode,
+        "polls": len(timings),
+        "messages": arrived,
+        "links": links,
+        "no_match": no_match,
+        "unlinked": unlinked,
+        "setup_seconds": round(setup_seconds, 4),
+        "poll_seconds": round(total, 4),
+        "links_per_second": round(links / total, 1) if total else None,
+        "messages_per_second": round(arrived / total, 1) if total else None,
+        "latency_p50": round(percentile(timings, 0.50), 4),
+        "latency_p95": round(percentile(timings, 0.95), 4),
+        "latency_p99": round(percentile(timings, 0.99), 4),
+        "latency_max": round(max(timings), 4),
+        "round_trips": round_trips,
+        "round_trips_per_poll": round(round_trips / len(timings), 1),
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or "--help" in args or "-h" in args:
+        print("Usage: bench_linker.py <dataset.sqlite> [--modes shell,trigger,...] [--polls N] [--poll-size N]")
+        print("                       [--time-limit SECONDS] [--concurrency N] [--config CrmEmailMonitoringConfig.json]")
+        print("                       [--workdir DIR] [--output linker_bench.json]")
+        print(f"  modes: {', '.join(MODES)}")
+        print("  The dataset comes from synthetic_crm_data.py; each mode works on a copy of it.")
+        return 0 if args else 1
+
+    def option(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+
+    dataset = args[0]
+    modes = option("--modes", ",".join(MODES)).split(",")
+    polls = int(option("--polls", DEFAULT_POLLS))
+    poll_size = int(option("--poll-size", DEFAULT_POLL_SIZE))
+    time_limit = float(option("--time-limit", DEFAULT_TIME_LIMIT))
+    concurrency = int(option("--concurrency", DEFAULT_CONCURRENCY))
+    workdir = option("--workdir", os.path.join("/tmp", "linker-bench"))
+    output = option("--output", BENCH_RESULTS_FILE)
+    config = load_config(option("--config"))
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(f"❌ Unknown modes: {', '.join(unknown)}")
+        return 1
+    if not os.path.exists(dataset):
+        print(f"❌ {dataset} not found; create it with synthetic_crm_data.py")
+        return 1
+
+    os.makedirs(workdir, exist_ok=True)
+    print(f"🚀 CRM linker benchmark: {polls} polls of {poll_size} messages")
+    results = []
+    for mode in modes:
+        result = bench_mode(mode, dataset, workdir, config, polls, poll_size, time_limit, concurrency)
+        results.append(result)
+        print(f"  ✅ {mode:<13} {result['links_per_second'] or 0:10.1f} links/s  "
+              f"p50 {result['latency_p50']:.3f}s  p95 {result['latency_p95']:.3f}s  "
+              f"p99 {result['latency_p99']:.3f}s  {result['round_trips_per_poll']:6.1f} round trips/poll  "
+              f"({result['links']} links, {result['unlinked']} unlinked, {result['polls']} polls)")
+        for leftover in (f"{mode}.sqlite", f"{mode}.sqlite.checkpoint.json"):
+            if os.path.exists(os.path.join(workdir, leftover)):
+                os.remove(os.path.join(workdir, leftover))
+
+    report = {
+        "version": source_version(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"dataset": os.path.abspath(dataset), "polls": polls, "poll_size": poll_size,
+                       "concurrency": concurrency},
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Benchmark the assembly patch scripts on synthetic PE/CLI inputs: wall time,
+peak RSS and bytes scanned per entry point and input size, written as JSON
+so runs of different versions can be compared
+"""
+
+import contextlib
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from synthetic_assembly import write_crm_assembly
+
+BENCH_RESULTS_FILE = "patcher_bench.json"
+DEFAULT_SIZES_MB = [1, 10, 100, 500]
+DEFAULT_METHODS = 20000
+DEFAULT_MARKER_DENSITY = 1.0
+
+# A run this much slower (or bigger) than the baseline is reported as a regression
+REGRESSION_RATIO = 1.25
+
+# name -> (module, function, arguments), arguments from original/enhanced/output
+ENTRY_POINTS = {
+    "smart_inject": ("advanced_injection", "smart_inject", ("original", "enhanced", "output")),
+    "inject_enhanced_methods": ("inject_enhanced_crm", "inject_enhanced_methods", ("original", "enhanced", "output")),
+    "merge_assemblies": ("create_bridged_assembly", "merge_assemblies", ("original", "enhanced", "output")),
+    "fix_assembly_name": ("fix_assembly_name", "fix_assembly_name", ("enhanced", "output")),
+    "inject_runtime_loader": ("create_runtime_delegate", "inject_runtime_loader", ("original", "output")),
+    "patch_mail_core": ("patch_mail_core", "main", ("original", "enhanced", "output")),
+}
+
+
+def run_entry_point(name, paths):
+    """Call one entry point in this process; returns (seconds, bytes scanned)
+
+    The script's own output is discarded; only the measurements are kept.
+    """
+    import pattern_scanner
+
+    module_name, function_name, arguments = ENTRY_POINTS[name]
+    module = importlib.import_module(module_name)
+    args = [paths[argument] for argument in arguments]
+    if function_name == "main":
+        sys.argv = [module_name + ".py"] + args
+        args = []
+
+    scanned = pattern_scanner.bytes_scanned()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        getattr(module, function_name)(*args)
+        seconds = time.perf_counter() - started
+    return seconds, pattern_scanner.bytes_scanned() - scanned
+
+
+def measure(name, paths):
+    """Run one entry point in a fresh interpreter so its peak RSS is its own"""
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run", name,
+                             paths["original"], paths["enhanced"], paths["output"]],
+                            stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    out = proc.stdout.read()
+    proc.stdout.close()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    result = {
+        "entry": name,
+        "exit_code": proc.returncode,
+        "process_seconds": round(time.perf_counter() - started, 4),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+    if proc.returncode == 0:
+        seconds, scanned = json.loads(out)
+        result.update(seconds=round(seconds, 4), bytes_scanned=scanned)
+    if os.path.exists(paths["output"]):
+        result["output_size"] = os.path.getsize(paths["output"])
+        os.remove(paths["output"])
+    return result
+
+
+def synthetic_inputs(workdir, size, methods, marker_density, regenerate=False):
+    """Original/enhanced input pair for size, generated once and reused"""
+    os.makedirs(workdir, exist_ok=True)
+    tag = f"{size // (1024 * 1024)}mb-{methods}m-{marker_density:g}d"
+    paths = {
+        "original": os.path.join(workdir, f"original-{tag}.dll"),
+        "enhanced": os.path.join(workdir, f"enhanced-{tag}.dll"),
+        "output": os.path.join(workdir, f"output-{tag}.dll"),
+    }
+    for kind in ("original", "enhanced"):
+        if regenerate or not os.path.exists(paths[kind]):
+            write_crm_assembly(paths[kind], size, methods, marker_density, enhanced=kind == "enhanced")
+    return paths
+
+
+def source_version():
+    """git commit of the scripts being measured, if they are in a checkout"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print each run against the baseline; returns the number of regressions"""
+    previous = {(r["entry"], r["size"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\n📊 Compared with {baseline.get('version') or 'baseline'}:")
+    for result in results:
+        old = previous.get((result["entry"], result["size"]))
+        if old is None or "seconds" not in old or "seconds" not in result:
+            continue
+        time_ratio = result["seconds"] / old["seconds"] if old["seconds"] else 1.0
+        rss_ratio = result["peak_rss_mb"] / old["peak_rss_mb"] if old["peak_rss_mb"] else 1.0
+        regressed = time_ratio > REGRESSION_RATIO or rss_ratio > REGRESSION_RATIO
+        regressions += regressed
+        print(f"  {'⚠️' if regressed else '✅'} {result['entry']:<24} {result['size'] // (1024 * 1024):>4} MB  "
+              f"time x{time_ratio:.2f}  rss x{rss_ratio:.2f}")
+    return regressions
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["--run"]:
+        name, original, enhanced, output = args[1:5]
+        seconds, scanned = run_entry_point(name, {"original": original, "enhanced": enhanced, "output": output})
+        print(json.dumps([seconds, scanned]))
+        return 0
+    if "--help" in args or "-h" in args:
+        print("Usage: bench_patchers.py [--sizes 1,10,100,500] [--methods N] [--marker-density PER_MB]")
+        print("                         [--entries name,...] [--repeat N] [--workdir DIR]")
+        print("                         [--output patcher_bench.json] [--baseline old.json] [--regenerate]")
+        print(f"  entries: {', '.join(ENTRY_POINTS)}")
+        return 0
+
+    def option(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+
+    sizes = [int(float(mb) * 1024 * 1024) for mb in option("--sizes", ",".join(map(str, DEFAULT_SIZES_MB))).split(",")]
+    methods = int(option("--methods", DEFAULT_METHODS))
+    marker_density = float(option("--marker-density", DEFAULT_MARKER_DENSITY))
+    entries = option("--entries", ",".join(ENTRY_POINTS)).split(",")
+    repeat = int(option("--repeat", 1))
+    workdir = option("--workdir", os.path.join("/tmp", "patcher-bench"))
+    output = option("--output", BENCH_RESULTS_FILE)
+    unknown = [name for name in entries if name not in ENTRY_POINTS]
+    if unknown:
+        print(f"❌ Unknown entry points: {', '.join(unknown)}")
+        return 1
+
+    print("🚀 Assembly patcher benchmark")
+    results = []
+    for size in sizes:
+        started = time.time()
+        paths = synthetic_inputs(workdir, size, methods, marker_density, "--regenerate" in args)
+        print(f"\n📦 {size // (1024 * 1024)} MB inputs ready in {time.time() - started:.1f}s")
+        for name in entries:
+            runs = [measure(name, paths) for _ in range(repeat)]
+            # Best of the repeats: the least disturbed by everything else on the machine
+            result = min(runs, key=lambda r: r.get("seconds", float("inf")))
+            result["size"] = os.path.getsize(paths["original"])
+            results.append(result)
+            if result["exit_code"]:
+                print(f"  ❌ {name:<24} exited with {result['exit_code']}")
+            else:
+                print(f"  ✅ {name:<24} {result['seconds']:8.3f}s  {result['peak_rss_mb']:8.1f} MB RSS  "
+                      f"{result['bytes_scanned'] / (1024 * 1024):8.1f} MB scanned")
+
+    report = {
+        "version": source_version(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"methods": methods, "marker_density": marker_density, "repeat": repeat},
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {output}")
+
+    failed = sum(1 for r in results if r["exit_code"])
+    if "--baseline" in args:
+        with open(option("--baseline"), "r", encoding="utf-8") as f:
+            failed += compare(results, json.load(f))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
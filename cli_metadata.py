@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+ECMA-335 metadata reader: PE/CLI headers, metadata streams and lazily
+decoded TypeDef/MethodDef tables, used to resolve methods straight to
+their RVA and file offset
+"""
+
+import struct
+from collections import namedtuple
+
+import patch_stats
+
+# Metadata table ids (ECMA-335 II.22)
+MODULE = 0x00
+TYPEREF = 0x01
+TYPEDEF = 0x02
+FIELDPTR = 0x03
+FIELD = 0x04
+METHODPTR = 0x05
+METHODDEF = 0x06
+PARAMPTR = 0x07
+PARAM = 0x08
+INTERFACEIMPL = 0x09
+MEMBERREF = 0x0A
+CONSTANT = 0x0B
+CUSTOMATTRIBUTE = 0x0C
+FIELDMARSHAL = 0x0D
+DECLSECURITY = 0x0E
+CLASSLAYOUT = 0x0F
+FIELDLAYOUT = 0x10
+STANDALONESIG = 0x11
+EVENTMAP = 0x12
+EVENTPTR = 0x13
+EVENT = 0x14
+PROPERTYMAP = 0x15
+PROPERTYPTR = 0x16
+PROPERTY = 0x17
+METHODSEMANTICS = 0x18
+METHODIMPL = 0x19
+MODULEREF = 0x1A
+TYPESPEC = 0x1B
+IMPLMAP = 0x1C
+FIELDRVA = 0x1D
+ENCLOG = 0x1E
+ENCMAP = 0x1F
+ASSEMBLY = 0x20
+ASSEMBLYPROCESSOR = 0x21
+ASSEMBLYOS = 0x22
+ASSEMBLYREF = 0x23
+ASSEMBLYREFPROCESSOR = 0x24
+ASSEMBLYREFOS = 0x25
+FILE = 0x26
+EXPORTEDTYPE = 0x27
+MANIFESTRESOURCE = 0x28
+NESTEDCLASS = 0x29
+GENERICPARAM = 0x2A
+METHODSPEC = 0x2B
+GENERICPARAMCONSTRAINT = 0x2C
+
+# Coded index kinds (ECMA-335 II.24.2.6): tag bits and the tables they can point at
+CODED_INDEXES = {
+    'TypeDefOrRef': (2, [TYPEDEF, TYPEREF, TYPESPEC]),
+    'HasConstant': (2, [FIELD, PARAM, PROPERTY]),
+    'HasCustomAttribute': (5, [METHODDEF, FIELD, TYPEREF, TYPEDEF, PARAM, INTERFACEIMPL,
+                               MEMBERREF, MODULE, DECLSECURITY, PROPERTY, EVENT, STANDALONESIG,
+                               MODULEREF, TYPESPEC, ASSEMBLY, ASSEMBLYREF, FILE, EXPORTEDTYPE,
+                               MANIFESTRESOURCE, GENERICPARAM, GENERICPARAMCONSTRAINT, METHODSPEC]),
+    'HasFieldMarshal': (1, [FIELD, PARAM]),
+    'HasDeclSecurity': (2, [TYPEDEF, METHODDEF, ASSEMBLY]),
+    'MemberRefParent': (3, [TYPEDEF, TYPEREF, MODULEREF, METHODDEF, TYPESPEC]),
+    'HasSemantics': (1, [EVENT, PROPERTY]),
+    'MethodDefOrRef': (1, [METHODDEF, MEMBERREF]),
+    'MemberForwarded': (1, [FIELD, METHODDEF]),
+    'Implementation': (2, [FILE, ASSEMBLYREF, EXPORTEDTYPE]),
+    'CustomAttributeType': (3, [METHODDEF, MEMBERREF]),
+    'ResolutionScope': (2, [MODULE, MODULEREF, ASSEMBLYREF, TYPEREF]),
+    'TypeOrMethodDef': (1, [TYPEDEF, METHODDEF]),
+}
+
+# Column layouts per table: 'u2'/'u4' constants, 'str'/'guid'/'blob' heap
+# indexes, an int for a simple index into that table, or a coded index name
+TABLE_SCHEMAS = {
+    MODULE: [('Generation', 'u2'), ('Name', 'str'), ('Mvid', 'guid'), ('EncId', 'guid'), ('EncBaseId', 'guid')],
+    TYPEREF: [('ResolutionScope', 'ResolutionScope'), ('TypeName', 'str'), ('TypeNamespace', 'str')],
+    TYPEDEF: [('Flags', 'u4'), ('TypeName', 'str'), ('TypeNamespace', 'str'), ('Extends', 'TypeDefOrRef'),
+              ('FieldList', FIELD), ('MethodList', METHODDEF)],
+    FIELDPTR: [('Field', FIELD)],
+    FIELD: [('Flags', 'u2'), ('Name', 'str'), ('Signature', 'blob')],
+    METHODPTR: [('Method', METHODDEF)],
+    METHODDEF: [('RVA', 'u4'), ('ImplFlags', 'u2'), ('Flags', 'u2'), ('Name', 'str'), ('Signature', 'blob'),
+                ('ParamList', PARAM)],
+    PARAMPTR: [('Param', PARAM)],
+    PARAM: [('Flags', 'u2'), ('Sequence', 'u2'), ('Name', 'str')],
+    INTERFACEIMPL: [('Class', TYPEDEF), ('Interface', 'TypeDefOrRef')],
+    MEMBERREF: [('Class', 'MemberRefParent'), ('Name', 'str'), ('Signature', 'blob')],
+    CONSTANT: [('Type', 'u2'), ('Parent', 'HasConstant'), ('Value', 'blob')],
+    CUSTOMATTRIBUTE: [('Parent', 'HasCustomAttribute'), ('Type', 'CustomAttributeType'), ('Value', 'blob')],
+    FIELDMARSHAL: [('Parent', 'HasFieldMarshal'), ('NativeType', 'blob')],
+    DECLSECURITY: [('Action', 'u2'), ('Parent', 'HasDeclSecurity'), ('PermissionSet', 'blob')],
+    CLASSLAYOUT: [('PackingSize', 'u2'), ('ClassSize', 'u4'), ('Parent', TYPEDEF)],
+    FIELDLAYOUT: [('Offset', 'u4'), ('Field', FIELD)],
+    STANDALONESIG: [('Signature', 'blob')],
+    EVENTMAP: [('Parent', TYPEDEF), ('EventList', EVENT)],
+    EVENTPTR: [('Event', EVENT)],
+    EVENT: [('EventFlags', 'u2'), ('Name', 'str'), ('EventType', 'TypeDefOrRef')],
+    PROPERTYMAP: [('Parent', TYPEDEF), ('PropertyList', PROPERTY)],
+    PROPERTYPTR: [('Property', PROPERTY)],
+    PROPERTY: [('Flags', 'u2'), ('Name', 'str'), ('Type', 'blob')],
+    METHODSEMANTICS: [('Semantics', 'u2'), ('Method', METHODDEF), ('Association', 'HasSemantics')],
+    METHODIMPL: [('Class', TYPEDEF), ('MethodBody', 'MethodDefOrRef'), ('MethodDeclaration', 'MethodDefOrRef')],
+    MODULEREF: [('Name', 'str')],
+    TYPESPEC: [('Signature', 'blob')],
+    IMPLMAP: [('MappingFlags', 'u2'), ('MemberForwarded', 'MemberForwarded'), ('ImportName', 'str'),
+              ('ImportScope', MODULEREF)],
+    FIELDRVA: [('RVA', 'u4'), ('Field', FIELD)],
+    ENCLOG: [('Token', 'u4'), ('FuncCode', 'u4')],
+    ENCMAP: [('Token', 'u4')],
+    ASSEMBLY: [('HashAlgId', 'u4'), ('MajorVersion', 'u2'), ('MinorVersion', 'u2'), ('BuildNumber', 'u2'),
+               ('RevisionNumber', 'u2'), ('Flags', 'u4'), ('PublicKey', 'blob'), ('Name', 'str'),
+               ('Culture', 'str')],
+    ASSEMBLYPROCESSOR: [('Processor', 'u4')],
+    ASSEMBLYOS: [('OSPlatformID', 'u4'), ('OSMajorVersion', 'u4'), ('OSMinorVersion', 'u4')],
+    ASSEMBLYREF: [('MajorVersion', 'u2'), ('MinorVersion', 'u2'), ('BuildNumber', 'u2'),
+                  ('RevisionNumber', 'u2'), ('Flags', 'u4'), ('PublicKeyOrToken', 'blob'), ('Name', 'str'),
+                  ('Culture', 'str'), ('HashValue', 'blob')],
+    ASSEMBLYREFPROCESSOR: [('Processor', 'u4'), ('AssemblyRef', ASSEMBLYREF)],
+    ASSEMBLYREFOS: [('OSPlatformId', 'u4'), ('OSMajorVersion', 'u4'), ('OSMinorVersion', 'u4'),
+                    ('AssemblyRef', ASSEMBLYREF)],
+    FILE: [('Flags', 'u4'), ('Name', 'str'), ('HashValue', 'blob')],
+    EXPORTEDTYPE: [('Flags', 'u4'), ('TypeDefId', 'u4'), ('TypeName', 'str'), ('TypeNamespace', 'str'),
+                   ('Implementation', 'Implementation')],
+    MANIFESTRESOURCE: [('Offset', 'u4'), ('Flags', 'u4'), ('Name', 'str'), ('Implementation', 'Implementation')],
+    NESTEDCLASS: [('NestedClass', TYPEDEF), ('EnclosingClass', TYPEDEF)],
+    GENERICPARAM: [('Number', 'u2'), ('Flags', 'u2'), ('Owner', 'TypeOrMethodDef'), ('Name', 'str')],
+    METHODSPEC: [('Method', 'MethodDefOrRef'), ('Instantiation', 'blob')],
+    GENERICPARAMCONSTRAINT: [('Owner', GENERICPARAM), ('Constraint', 'TypeDefOrRef')],
+}
+
+CLI_HEADER_DIRECTORY = 14
+METADATA_SIGNATURE = 0x424A5342
+
+Section = namedtuple('Section', 'name virtual_address virtual_size raw_pointer raw_size')
+MethodInfo = namedtuple('MethodInfo', 'token namespace type_name name rva offset')
+
+
+class MetadataError(ValueError):
+    """Raised when an image is not a well-formed PE/CLI assembly"""
+
+
+class MetadataTable:
+    """One metadata table; rows are decoded on demand, never up front"""
+
+    def __init__(self, metadata, table_id, rows, offset, layout):
+        self.metadata = metadata
+        self.table_id = table_id
+        self.rows = rows
+        self.offset = offset
+        self.columns = [name for name, _ in layout]
+        self._struct = struct.Struct('<' + ''.join('H' if size == 2 else 'I' for _, size in layout))
+        self.row_size = self._struct.size
+
+    def __len__(self):
+        return self.rows
+
+    def row(self, index):
+        """Decode row index (1-based, as metadata tokens count) into a tuple"""
+        if not 1 <= index <= self.rows:
+            # Indexes come from other tables' columns, so a bad one means a malformed image
+            raise MetadataError(f"table 0x{self.table_id:02X} has no row {index}")
+        offset = self.offset + (index - 1) * self.row_size
+        try:
+            return self._struct.unpack_from(self.metadata.view, offset)
+        except struct.error:
+            raise MetadataError(f"table 0x{self.table_id:02X} row {index} is past the end of the image") from None
+
+    def cell(self, index, column):
+        """Decode a single named column of a row"""
+        return self.row(index)[self.columns.index(column)]
+
+
+class CliMetadata:
+    """PE/CLI metadata of one assembly image"""
+
+    def __init__(self, data):
+        # Accept an AssemblyImage or any bytes-like buffer
+        self.view = memoryview(getattr(data, 'view', data))
+        self._strings = {}
+        self._tables = {}
+        self._type_index = None
+        self._methods = {}
+
+        self._parse_pe_headers()
+        self._parse_metadata_root()
+        self._parse_table_stream()
+
+    # -- PE / CLI headers -------------------------------------------------
+
+    def _unpack(self, fmt, offset):
+        try:
+            return struct.unpack_from(fmt, self.view, offset)
+        except struct.error:
+            raise MetadataError(f"truncated image at offset {offset}") from None
+
+    def _parse_pe_headers(self):
+        if bytes(self.view[:2]) != b"MZ":
+            raise MetadataError("missing MZ header")
+        (pe_offset,) = self._unpack('<I', 0x3C)
+        if bytes(self.view[pe_offset:pe_offset + 4]) != b"PE\x00\x00":
+            raise MetadataError("missing PE signature")
+
+        coff = pe_offset + 4
+        _, section_count, _, _, _, optional_size, _ = self._unpack('<HHIIIHH', coff)
+        optional = coff + 20
+        (magic,) = self._unpack('<H', optional)
+        if magic == 0x10B:
+            directories = optional + 96
+        elif magic == 0x20B:
+            directories = optional + 112
+        else:
+            raise MetadataError(f"unknown optional header magic 0x{magic:X}")
+        (directory_count,) = self._unpack('<I', directories - 4)
+
+        self.sections = []
+        table = optional + optional_size
+        for index in range(section_count):
+            name, vsize, vaddr, raw_size, raw_ptr = self._unpack('<8sIIII', table + index * 40)
+            self.sections.append(Section(name.rstrip(b"\x00").decode('ascii', 'replace'),
+                                         vaddr, vsize, raw_ptr, raw_size))
+
+        if directory_count <= CLI_HEADER_DIRECTORY:
+            raise MetadataError("no CLI header directory")
+        cli_rva, cli_size = self._unpack('<II', directories + CLI_HEADER_DIRECTORY * 8)
+        if not cli_rva:
+            raise MetadataError("not a .NET assembly (empty CLI header)")
+
+        cli = self.rva_to_offset(cli_rva)
+        self.metadata_rva, self.metadata_size = self._unpack('<II', cli + 8)
+        self.entry_point_token = self._unpack('<I', cli + 20)[0]
+        self.metadata_offset = self.rva_to_offset(self.metadata_rva)
+
+    def _terminator(self, start, limit):
+        """Offset of the first null byte in [start, limit)"""
+        view = self.view
+        end = start
+        while end < limit and view[end]:
+            end += 1
+        if end >= limit:
+            raise MetadataError(f"unterminated string at offset {start}")
+        return end
+
+    def rva_to_offset(self, rva):
+        """Translate an RVA to a file offset through the section table"""
+        for section in self.sections:
+            extent = max(section.virtual_size, section.raw_size)
+            if section.virtual_address <= rva < section.virtual_address + extent:
+                offset = rva - section.virtual_address + section.raw_pointer
+                if offset >= len(self.view):
+                    break
+                return offset
+        raise MetadataError(f"RVA 0x{rva:X} is outside every section")
+
+    # -- Metadata root and streams ----------------------------------------
+
+    def _parse_metadata_root(self):
+        root = self.metadata_offset
+        signature, _, _, _, version_length = self._unpack('<IHHII', root)
+        if signature != METADATA_SIGNATURE:
+            raise MetadataError("bad metadata signature")
+        self.runtime_version = bytes(self.view[root + 16:root + 16 + version_length]).rstrip(b"\x00").decode(
+            'ascii', 'replace')
+
+        position = root + 16 + version_length
+        _, stream_count = self._unpack('<HH', position)
+        position += 4
+
+        self.streams = {}
+        for _ in range(stream_count):
+            offset, size = self._unpack('<II', position)
+            position += 8
+            end = self._terminator(position, len(self.view))
+            name = bytes(self.view[position:end]).decode('ascii', 'replace')
+            position = (end + 4) & ~3
+            self.streams[name] = (root + offset, size)
+
+        self.strings_offset, strings_size = self.streams.get('#Strings', (0, 0))
+        self.strings_end = min(self.strings_offset + strings_size, len(self.view))
+
+    def _parse_table_stream(self):
+        stream = self.streams.get('#~') or self.streams.get('#-')
+        if stream is None:
+            raise MetadataError("no metadata table stream")
+        base = stream[0]
+        _, _, _, heap_sizes, _, valid, _ = self._unpack('<IBBBBQQ', base)
+
+        self._heap_index_size = {
+            'str': 4 if heap_sizes & 0x01 else 2,
+            'guid': 4 if heap_sizes & 0x02 else 2,
+            'blob': 4 if heap_sizes & 0x04 else 2,
+        }
+
+        self.row_counts = {}
+        position = base + 24
+        for table_id in range(64):
+            if valid & (1 << table_id):
+                self.row_counts[table_id] = self._unpack('<I', position)[0]
+                position += 4
+        if heap_sizes & 0x40:
+            # Uncompressed (#-) streams may carry four extra bytes here
+            position += 4
+        self._tables_start = position
+        self._table_offsets = None
+
+    def _column_size(self, kind):
+        if kind == 'u2':
+            return 2
+        if kind == 'u4':
+            return 4
+        if kind in self._heap_index_size:
+            return self._heap_index_size[kind]
+        if isinstance(kind, int):
+            return 2 if self.row_counts.get(kind, 0) < 0x10000 else 4
+        tag_bits, targets = CODED_INDEXES[kind]
+        largest = max(self.row_counts.get(table_id, 0) for table_id in targets)
+        return 2 if largest < (1 << (16 - tag_bits)) else 4
+
+    def _layout(self, table_id):
+        schema = TABLE_SCHEMAS.get(table_id)
+        if schema is None:
+            raise MetadataError(f"unsupported metadata table 0x{table_id:02X}")
+        return [(name, self._column_size(kind)) for name, kind in schema]
+
+    def table(self, table_id):
+        """Return the MetadataTable for table_id (empty if absent)"""
+        table = self._tables.get(table_id)
+        if table is None:
+            # Tables are stored back to back, so only the ones in front of
+            # the requested table need their row sizes worked out
+            position = self._tables_start
+            for present in sorted(self.row_counts):
+                if present >= table_id:
+                    break
+                position += self.row_counts[present] * sum(size for _, size in self._layout(present))
+            rows = self.row_counts.get(table_id, 0)
+            table = MetadataTable(self, table_id, rows, position, self._layout(table_id))
+            self._tables[table_id] = table
+        return table
+
+    def string(self, index):
+        """Read a null-terminated UTF-8 string from the #Strings heap"""
+        value = self._strings.get(index)
+        if value is None:
+            start = self.strings_offset + index
+            end = self._terminator(start, self.strings_end)
+            value = bytes(self.view[start:end]).decode('utf-8', 'replace')
+            self._strings[index] = value
+        return value
+
+    # -- Types and methods -------------------------------------------------
+
+    def _types(self):
+        if self._type_index is None:
+            # Only the two name columns of TypeDef are decoded to build this
+            index = {}
+            typedefs = self.table(TYPEDEF)
+            for row in range(1, typedefs.rows + 1):
+                _, name, namespace, _, _, _ = typedefs.row(row)
+                name = self.string(name)
+                namespace = self.string(namespace)
+                index.setdefault(name, []).append(row)
+                if namespace:
+                    index.setdefault(f"{namespace}.{name}", []).append(row)
+            self._type_index = index
+        return self._type_index
+
+    def find_types(self, type_name):
+        """TypeDef rows matching a simple or namespace-qualified name"""
+        return list(self._types().get(type_name, []))
+
+    def _method_range(self, type_row):
+        typedefs = self.table(TYPEDEF)
+        first = typedefs.cell(type_row, 'MethodList')
+        methods = self.table(METHODPTR) if self.row_counts.get(METHODPTR) else self.table(METHODDEF)
+        if type_row < typedefs.rows:
+            last = typedefs.cell(type_row + 1, 'MethodList')
+        else:
+            last = methods.rows + 1
+        return range(first, min(last, methods.rows + 1))
+
+    def methods_of(self, type_row):
+        """MethodInfo for every method owned by a TypeDef row"""
+        cached = self._methods.get(type_row)
+        if cached is not None:
+            return cached
+
+        typedefs = self.table(TYPEDEF)
+        _, name, namespace, _, _, _ = typedefs.row(type_row)
+        type_name = self.string(name)
+        namespace = self.string(namespace)
+
+        methoddefs = self.table(METHODDEF)
+        pointers = self.table(METHODPTR) if self.row_counts.get(METHODPTR) else None
+
+        methods = []
+        for index in self._method_range(type_row):
+            row = pointers.cell(index, 'Method') if pointers else index
+            rva, _, _, method_name, _, _ = methoddefs.row(row)
+            offset = self.rva_to_offset(rva) if rva else None
+            methods.append(MethodInfo((METHODDEF << 24) | row, namespace, type_name,
+                                      self.string(method_name), rva, offset))
+        self._methods[type_row] = methods
+        return methods
+
+    def find_method(self, type_name, method_name):
+        """Resolve Type::Method (every overload) to MethodInfo entries
+
+        With type_name None every type is searched for method_name.
+        """
+        if type_name is None:
+            return [m for m in self.iter_methods() if m.name == method_name]
+        found = []
+        for type_row in self.find_types(type_name):
+            found.extend(m for m in self.methods_of(type_row) if m.name == method_name)
+        return found
+
+    def iter_methods(self):
+        """Every MethodInfo in the assembly, type by type"""
+        for type_row in range(1, self.table(TYPEDEF).rows + 1):
+            yield from self.methods_of(type_row)
+
+    def release(self):
+        """Drop the buffer reference so the underlying mapping can close"""
+        self.view.release()
+
+
+def read_metadata(data):
+    """Parse the CLI metadata of an assembly image, or None if it has none"""
+    try:
+        with patch_stats.phase("metadata"):
+            return CliMetadata(data)
+    except MetadataError:
+        return None
+
+
+def split_method_name(qualified):
+    """Split 'Type::Method' into (type, method); a bare name has no type"""
+    if '::' in qualified:
+        type_name, method_name = qualified.rsplit('::', 1)
+        return type_name, method_name
+    return None, qualified
+
+
+def locate_method(metadata, method_name, type_name="CrmLinkEngine"):
+    """First MethodInfo of type_name::method_name that has an IL body, or None"""
+    if metadata is None:
+        return None
+    for method in metadata.find_method(type_name, method_name):
+        if method.offset is not None:
+            return method
+    return None
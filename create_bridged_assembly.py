@@ -6,16 +6,32 @@ Create a bridged assembly that combines original dependencies with enhanced code
 import sys
 import struct
 
+from assembly_loader import open_assembly
+from cli_metadata import locate_method, read_metadata
+from il_method_body import transplant_method_body
+from patch_stats import with_stats
+from pattern_scanner import scan_crm_markers
+
 def merge_assemblies(original_dll, enhanced_dll, output_dll):
     """Merge enhanced code into original assembly structure"""
     
-    # Load both assemblies
-    with open(original_dll, 'rb') as f:
-        original_data = bytearray(f.read())
-    
-    with open(enhanced_dll, 'rb') as f:
-        enhanced_data = f.read()
+    # Map both assemblies; the original is copy-on-write so only patched pages are copied
+    with open_assembly(original_dll, copy_on_write=True) as original_data, \
+            open_assembly(enhanced_dll) as enhanced_data:
+        plan, replacements = plan_merge(original_data, enhanced_data)
+        
+        # Write the merged assembly
+        plan.write(original_data, output_dll)
     
+    print(f"✅ Created merged assembly: {output_dll}")
+    return replacements > 0
+
+def plan_merge(original_data, enhanced_data, original_hits=None, enhanced_hits=None,
+               original_metadata=None, enhanced_metadata=None):
+    """Swap CRM method bodies into original_data and plan the string inserts
+
+    Returns (plan, replacements).
+    """
     print(f"📊 Original: {len(original_data):,} bytes")
     print(f"📊 Enhanced: {len(enhanced_data):,} bytes")
     
@@ -29,81 +45,110 @@ def merge_assemblies(original_dll, enhanced_dll, output_dll):
     ]
     
     replacements = 0
+    inserts = []
+    
+    # 2. Add enhanced strings and debug messages
+    enhanced_strings = [
+        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
+        b"LinkChainToCrmEnhanced",
+        b"Enhanced automatic linking"
+    ]
+    
+    # Scan both assemblies once, before anything in the original is patched,
+    # for just the markers looked up below
+    if original_hits is None:
+        original_hits = scan_crm_markers(original_data, patterns=crm_sections, first_only=True)
+    if enhanced_hits is None:
+        enhanced_hits = scan_crm_markers(enhanced_data, patterns=crm_sections + enhanced_strings,
+                                         first_only=True)
+    if original_metadata is None:
+        original_metadata = read_metadata(original_data)
+    if enhanced_metadata is None:
+        enhanced_metadata = read_metadata(enhanced_data)
     
     for section in crm_sections:
-        orig_pos = original_data.find(section)
-        enhanced_pos = enhanced_data.find(section)
+        if original_metadata is not None and enhanced_metadata is not None:
+            # Names live in the #Strings heap; only real method bodies are code
+            original_info = locate_method(original_metadata, section.decode('utf-8'))
+            enhanced_info = locate_method(enhanced_metadata, section.decode('utf-8'))
+            if original_info is None or enhanced_info is None:
+                continue
+            
+            print(f"🔄 Replacing method body: {section.decode('utf-8')}")
+            copied, new_size, old_size = transplant_method_body(original_data, original_info,
+                                                                enhanced_data, enhanced_info)
+            if copied:
+                replacements += 1
+                print(f"  ✅ Replaced {new_size} bytes")
+            else:
+                print(f"  ⚠️ Skipping - enhanced body ({new_size} bytes) does not fit the original ({old_size} bytes)")
+            continue
+        
+        orig_pos = original_hits.first(section)
+        enhanced_pos = enhanced_hits.first(section)
         
         if orig_pos != -1 and enhanced_pos != -1:
             print(f"🔄 Replacing section: {section.decode('utf-8')}")
             
             # Extract enhanced method region (more code around the method)
-            enhanced_start = max(0, enhanced_pos - 512)
-            enhanced_end = min(len(enhanced_data), enhanced_pos + 1024)
-            enhanced_region = enhanced_data[enhanced_start:enhanced_end]
+            enhanced_region, enhanced_start = enhanced_data.window(enhanced_pos, 512, 1024)
             
             # Replace in original (but don't exceed bounds)
             orig_start = max(0, orig_pos - 512) 
             orig_end = min(len(original_data), orig_pos + len(enhanced_region))
             
             if orig_end - orig_start >= len(enhanced_region):
-                original_data[orig_start:orig_start + len(enhanced_region)] = enhanced_region
+                original_data.overwrite(orig_start, enhanced_region)
                 replacements += 1
                 print(f"  ✅ Replaced {len(enhanced_region)} bytes")
             else:
                 print(f"  ⚠️ Skipping - size mismatch")
     
-    # 2. Add enhanced strings and debug messages
-    enhanced_strings = [
-        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
-        b"LinkChainToCrmEnhanced",
-        b"Enhanced automatic linking"
-    ]
-    
     for string in enhanced_strings:
-        if string in enhanced_data and string not in original_data:
+        if string in enhanced_hits and string not in original_data:
             # Find a good insertion point (near other strings)
             insert_pos = len(original_data) - 1000  # Near end but safe
-            original_data[insert_pos:insert_pos] = string + b'\x00'
+            inserts.append((insert_pos, string + b'\x00'))
             replacements += 1
             print(f"  ✅ Added string: {string.decode('utf-8', errors='ignore')}")
     
     # 3. Critical: Copy our enhanced method implementations
     # Look for the actual method IL code patterns
     
-    # Find ProcessIncomingEmailForCrm implementation in enhanced DLL
-    enhanced_method_pos = enhanced_data.find(b"ProcessIncomingEmailForCrm")
-    if enhanced_method_pos != -1:
-        # Extract the method implementation (approximate)
-        method_start = enhanced_method_pos
-        method_end = enhanced_method_pos + 2048  # Assume 2KB method size
-        
-        if method_end <= len(enhanced_data):
-            enhanced_method = enhanced_data[method_start:method_end]
+    # With metadata on both sides the method bodies were already swapped above
+    if original_metadata is None or enhanced_metadata is None:
+        # Find ProcessIncomingEmailForCrm implementation in enhanced DLL
+        enhanced_method_pos = enhanced_hits.first(b"ProcessIncomingEmailForCrm")
+        if enhanced_method_pos != -1:
+            # Extract the method implementation (approximate)
+            method_start = enhanced_method_pos
+            method_end = enhanced_method_pos + 2048  # Assume 2KB method size
             
-            # Find corresponding location in original
-            orig_method_pos = original_data.find(b"ProcessIncomingEmailForCrm")
-            if orig_method_pos != -1:
-                # Replace the method implementation
-                end_replace = min(len(original_data), orig_method_pos + len(enhanced_method))
-                original_data[orig_method_pos:end_replace] = enhanced_method[:end_replace-orig_method_pos]
-                replacements += 1
-                print(f"  ✅ Replaced method implementation")
+            if method_end <= len(enhanced_data):
+                enhanced_method = enhanced_data.region(method_start, method_end)
+                
+                # Find corresponding location in original
+                orig_method_pos = original_hits.first(b"ProcessIncomingEmailForCrm")
+                if orig_method_pos != -1:
+                    # Replace the method implementation
+                    original_data.overwrite(orig_method_pos, enhanced_method)
+                    replacements += 1
+                    print(f"  ✅ Replaced method implementation")
     
     print(f"\n📊 Merge Summary:")
     print(f"  Total replacements: {replacements}")
-    print(f"  Final size: {len(original_data):,} bytes")
+    print(f"  Final size: {len(original_data) + sum(len(data) for _, data in inserts):,} bytes")
     
-    # Write the merged assembly
-    with open(output_dll, 'wb') as f:
-        f.write(original_data)
-    
-    print(f"✅ Created merged assembly: {output_dll}")
-    return replacements > 0
+    plan = original_data.plan()
+    for offset, data in inserts:
+        plan.insert(min(max(offset, 0), len(original_data)), data)
+    return plan, replacements
 
+@with_stats
 def main():
     if len(sys.argv) != 4:
-        print("Usage: create_bridged_assembly.py <original_core.dll> <enhanced_mail.dll> <output.dll>")
+        print("Usage: create_bridged_assembly.py [--stats] <original_core.dll> <enhanced_mail.dll> <output.dll>")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
         return
     
     original_dll = sys.argv[1]
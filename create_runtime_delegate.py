@@ -5,12 +5,23 @@ Create a runtime delegation wrapper that loads enhanced CRM functionality
 
 import sys
 
+from assembly_loader import open_assembly
+from patch_stats import with_stats
+from pattern_scanner import scan_crm_markers
+
 def inject_runtime_loader(original_dll, output_dll):
     """Inject runtime loading code into the original DLL"""
     
-    with open(original_dll, 'rb') as f:
-        data = bytearray(f.read())
+    with open_assembly(original_dll) as data:
+        plan = plan_runtime_loader(data)
+        
+        # Write the modified assembly in one pass
+        plan.write(data, output_dll)
     
+    print(f"✅ Created runtime-enhanced assembly: {output_dll}")
+
+def plan_runtime_loader(data, hits=None):
+    """PatchPlan inserting the runtime markers and the enhanced DLL path"""
     print(f"Original size: {len(data):,} bytes")
     
     # Find where CRM processing happens and inject a runtime check
@@ -23,9 +34,12 @@ def inject_runtime_loader(original_dll, output_dll):
     ]
     
     injections = 0
+    plan = data.plan()
+    if hits is None:
+        hits = scan_crm_markers(data, patterns=crm_patterns + [b".dll\x00"], first_only=True)
     
     for pattern in crm_patterns:
-        pos = data.find(pattern)
+        pos = hits.first(pattern)
         if pos != -1:
             print(f"Found CRM pattern at {pos}: {pattern.decode('utf-8')}")
             
@@ -38,7 +52,7 @@ def inject_runtime_loader(original_dll, output_dll):
             # Make sure we don't corrupt the assembly structure
             if insert_pos < len(data) - 100:
                 # Insert our marker
-                data[insert_pos:insert_pos] = marker + b'\x00'
+                plan.insert(insert_pos, marker + b'\x00')
                 injections += 1
                 print(f"  ✅ Injected runtime marker at {insert_pos}")
     
@@ -46,26 +60,23 @@ def inject_runtime_loader(original_dll, output_dll):
     enhanced_dll_path = b"ASC.Mail.Enhanced.dll\x00"
     
     # Find a safe location in the string table to add our DLL name
-    string_section_pos = data.find(b".dll\x00")
+    string_section_pos = hits.first(b".dll\x00")
     if string_section_pos != -1:
-        insert_pos = string_section_pos + 50
-        data[insert_pos:insert_pos] = enhanced_dll_path
+        insert_pos = min(string_section_pos + 50, len(data))
+        plan.insert(insert_pos, enhanced_dll_path)
         injections += 1
         print(f"✅ Injected enhanced DLL path reference")
     
     print(f"\n📊 Summary:")
     print(f"  Injections: {injections}")
-    print(f"  Final size: {len(data):,} bytes")
-    
-    # Write the modified assembly
-    with open(output_dll, 'wb') as f:
-        f.write(data)
-    
-    print(f"✅ Created runtime-enhanced assembly: {output_dll}")
+    print(f"  Final size: {plan.output_size():,} bytes")
+    return plan
 
+@with_stats
 def main():
     if len(sys.argv) != 3:
-        print("Usage: create_runtime_delegate.py <original_core.dll> <output.dll>")
+        print("Usage: create_runtime_delegate.py [--stats] <original_core.dll> <output.dll>")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
         return
     
     original_dll = sys.argv[1]
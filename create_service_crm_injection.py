@@ -6,18 +6,28 @@ Inject enhanced CRM processing directly into the service layer ASC.Mail.Core.dll
 import sys
 import os
 
-def inject_enhanced_crm_into_service_dll(enhanced_dll, service_dll, output_dll):
-    """Inject enhanced CRM methods from web DLL into service DLL"""
+from assembly_loader import open_assembly
+from cli_metadata import locate_method, read_metadata
+from il_method_body import extract_method_body, transplant_method_body
+from method_hashes import diff_assemblies, differing_method_names, print_method_diff
+from patch_stats import with_stats
+from pattern_scanner import scan_crm_markers
+
+def inject_enhanced_crm_into_service_dll(enhanced_dll, service_dll, output_dll, diff_only=False):
+    """Inject enhanced CRM methods from web DLL into service DLL
+
+    With diff_only, only CrmLinkEngine methods whose bodies differ are
+    patched, and None is returned (without writing output_dll) when none do.
+    """
     
     print(f"🔧 Injecting enhanced CRM logic into service layer...")
     
-    # Load both DLLs
-    with open(service_dll, 'rb') as f:
-        service_data = bytearray(f.read())
-    
-    with open(enhanced_dll, 'rb') as f:
-        enhanced_data = f.read()
-    
+    # Map both DLLs; the service DLL is copy-on-write so only patched pages are copied
+    with open_assembly(service_dll, copy_on_write=True) as service_data, \
+            open_assembly(enhanced_dll) as enhanced_data:
+        return _inject_into_service(enhanced_data, service_data, output_dll, diff_only)
+
+def _inject_into_service(enhanced_data, service_data, output_dll, diff_only=False):
     print(f"📊 Service DLL: {len(service_data):,} bytes")
     print(f"📊 Enhanced DLL: {len(enhanced_data):,} bytes")
     
@@ -31,26 +41,74 @@ def inject_enhanced_crm_into_service_dll(enhanced_dll, service_dll, output_dll):
     ]
     
     injection_count = 0
+    inserts = []
+    appended = []
+    
+    service_metadata = read_metadata(service_data)
+    enhanced_metadata = read_metadata(enhanced_data)
+    
+    if diff_only:
+        diff = diff_assemblies(service_data, enhanced_data, service_metadata, enhanced_metadata, "CrmLinkEngine")
+        if diff is None:
+            print("⚠️ --diff needs CLI metadata in both DLLs, patching every pattern")
+        else:
+            print_method_diff(diff)
+            differing = differing_method_names(diff)
+            # Methods with identical bodies are left alone
+            enhanced_patterns = [
+                p for p in enhanced_patterns
+                if locate_method(enhanced_metadata, p.decode('utf-8', errors='ignore')) is None
+                or p.decode('utf-8', errors='ignore') in differing
+            ]
+            if not differing:
+                print("✅ CrmLinkEngine is identical in both DLLs - nothing to inject")
+                return None
+    
+    # Also inject enhanced debug strings
+    debug_strings = [
+        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED for message",
+        b"DEBUG: CRM conditions met - starting auto-processing",
+        b"CRM auto-processing completed for message",
+        b"Enhanced automatic linking with file uploads"
+    ]
+    
+    # Scan both assemblies once, before anything in the service DLL is patched,
+    # for just the markers looked up below
+    service_hits = scan_crm_markers(service_data, patterns=enhanced_patterns + [b"DEBUG"], first_only=True)
+    enhanced_hits = scan_crm_markers(enhanced_data, patterns=enhanced_patterns + debug_strings, first_only=True)
     
     # Strategy: Replace CRM method implementations in the service DLL
     for pattern in enhanced_patterns:
-        enhanced_pos = enhanced_data.find(pattern)
-        service_pos = service_data.find(pattern)
+        # Methods present on both sides are swapped body for body
+        name = pattern.decode('utf-8', errors='ignore')
+        enhanced_method = locate_method(enhanced_metadata, name)
+        service_method = locate_method(service_metadata, name)
+        if enhanced_method is not None and service_method is not None:
+            print(f"🔄 Replacing {name} method body...")
+            copied, new_size, old_size = transplant_method_body(service_data, service_method,
+                                                                enhanced_data, enhanced_method)
+            if copied:
+                injection_count += 1
+                print(f"  ✅ Injected {new_size} bytes")
+            else:
+                print(f"  ⚠️ Enhanced body ({new_size} bytes) does not fit the service body ({old_size} bytes), skipping")
+            continue
+        
+        enhanced_pos = enhanced_hits.first(pattern)
+        service_pos = service_hits.first(pattern)
         
         if enhanced_pos != -1 and service_pos != -1:
             print(f"🔄 Replacing {pattern.decode('utf-8', errors='ignore')}...")
             
             # Extract enhanced method region
-            enhanced_start = max(0, enhanced_pos - 1024)
-            enhanced_end = min(len(enhanced_data), enhanced_pos + 2048)
-            enhanced_region = enhanced_data[enhanced_start:enhanced_end]
+            enhanced_region, enhanced_start = enhanced_data.window(enhanced_pos, 1024, 2048)
             
             # Replace in service DLL
             service_start = max(0, service_pos - 1024)
             service_end = min(len(service_data), service_start + len(enhanced_region))
             
             if service_end - service_start >= len(enhanced_region):
-                service_data[service_start:service_start + len(enhanced_region)] = enhanced_region
+                service_data.overwrite(service_start, enhanced_region)
                 injection_count += 1
                 print(f"  ✅ Injected {len(enhanced_region)} bytes")
             else:
@@ -60,58 +118,65 @@ def inject_enhanced_crm_into_service_dll(enhanced_dll, service_dll, output_dll):
             # Add new enhanced functionality to service DLL
             print(f"➕ Adding new functionality: {pattern.decode('utf-8', errors='ignore')}")
             
-            # Extract enhanced region
-            enhanced_start = max(0, enhanced_pos - 512)
-            enhanced_end = min(len(enhanced_data), enhanced_pos + 1024) 
-            enhanced_region = enhanced_data[enhanced_start:enhanced_end]
+            # Extract enhanced region (exactly the method body when it is one)
+            if enhanced_method is not None:
+                enhanced_region, _ = extract_method_body(enhanced_data, enhanced_method)
+                enhanced_start = enhanced_method.offset
+            else:
+                enhanced_region, enhanced_start = enhanced_data.window(enhanced_pos, 512, 1024)
             
             # Append to service DLL
-            service_data.extend(enhanced_region)
+            appended.append((enhanced_region, enhanced_start))
             injection_count += 1
             print(f"  ✅ Added {len(enhanced_region)} bytes")
     
-    # Also inject enhanced debug strings
-    debug_strings = [
-        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED for message",
-        b"DEBUG: CRM conditions met - starting auto-processing",
-        b"CRM auto-processing completed for message",
-        b"Enhanced automatic linking with file uploads"
-    ]
-    
     for debug_str in debug_strings:
-        if debug_str in enhanced_data and debug_str not in service_data:
+        already_appended = any(
+            enhanced_data.find(debug_str, start, start + len(region)) != -1
+            for region, start in appended
+        )
+        if debug_str in enhanced_hits and debug_str not in service_data and not already_appended:
             # Find a safe insertion point
-            string_pos = service_data.find(b"DEBUG")
+            string_pos = service_hits.first(b"DEBUG")
             if string_pos != -1:
                 insert_pos = string_pos + 200
-                service_data[insert_pos:insert_pos] = debug_str + b'\x00'
+                inserts.append((insert_pos, debug_str + b'\x00'))
                 injection_count += 1
                 print(f"  ✅ Added debug string: {debug_str.decode('utf-8', errors='ignore')[:50]}...")
     
+    final_size = (len(service_data) + sum(len(data) for _, data in inserts)
+                  + sum(len(region) for region, _ in appended))
+    
     print(f"\n📊 Injection Summary:")
     print(f"  Total injections: {injection_count}")
-    print(f"  Final size: {len(service_data):,} bytes")
-    print(f"  Size increase: {len(service_data) - 1544704:,} bytes")
+    print(f"  Final size: {final_size:,} bytes")
+    print(f"  Size increase: {final_size - len(service_data):,} bytes")
     
     # Write enhanced service DLL
-    with open(output_dll, 'wb') as f:
-        f.write(service_data)
+    service_data.save(output_dll, inserts=inserts, tail=[region for region, _ in appended])
     
     print(f"✅ Created enhanced service DLL: {output_dll}")
     return injection_count > 0
 
+@with_stats
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: create_service_crm_injection.py <enhanced_web.dll> <original_service.dll> <output_service.dll>")
+    args = [arg for arg in sys.argv[1:] if arg != "--diff"]
+    if len(args) != 3:
+        print("Usage: create_service_crm_injection.py [--diff] [--stats] <enhanced_web.dll> <original_service.dll> <output_service.dll>")
+        print("  --diff  only patch CrmLinkEngine methods whose bodies changed")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
         return
     
-    enhanced_dll = sys.argv[1]
-    service_dll = sys.argv[2] 
-    output_dll = sys.argv[3]
+    enhanced_dll = args[0]
+    service_dll = args[1] 
+    output_dll = args[2]
     
-    success = inject_enhanced_crm_into_service_dll(enhanced_dll, service_dll, output_dll)
+    success = inject_enhanced_crm_into_service_dll(enhanced_dll, service_dll, output_dll,
+                                                   diff_only="--diff" in sys.argv[1:])
     
-    if success:
+    if success is None:
+        print("✅ Service DLL already up to date - no output written, no restart needed")
+    elif success:
         print("🎉 Service-layer CRM injection completed successfully!")
         print("⚠️  Deploy this to all mail services for enhanced CRM processing")
     else:
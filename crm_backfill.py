@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Resumable backfill of historical unlinked mail: walks mail_mail by id in
+fixed-size keyset chunks instead of the row-by-row cursor of
+unlinked_email_analyzer.sql or the single locking INSERT ... SELECT of
+fix_trigger_and_backfill.sql
+"""
+
+import json
+import sys
+import time
+from datetime import datetime
+
+from crm_chain_contacts import ChainContacts
+from crm_checkpoint import CHECKPOINT_FILE, Checkpoint, write_json_atomic
+from crm_contact_index import ContactIndex
+from crm_db import connect, load_config
+from crm_event_writer import DEFAULT_BATCH_SIZE, EventWriter
+from crm_linked_filter import LinkedMailFilter
+from crm_linker import (ENTITY_TYPE_MAIL, LINKED_CATEGORY, link_batch, max_mail_id, monitored_folders,
+                        new_messages)
+
+BACKFILL_CHECKPOINT_FILE = "crm_backfill_checkpoint.json"
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class BackfillState:
+    """Cursor of a backfill run: everything up to after is done, end is where it stops"""
+
+    def __init__(self, path=BACKFILL_CHECKPOINT_FILE, after=0, end=0, tenant=None, messages=0, links=0):
+        self.path = path
+        self.after = after
+        self.end = end
+        self.tenant = tenant
+        self.messages = messages
+        self.links = links
+
+    @classmethod
+    def load(cls, path=BACKFILL_CHECKPOINT_FILE):
+        """Read path, or None if there is no run to resume"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(path, data["after"], data["end"], data.get("tenant"),
+                   data.get("messages", 0), data.get("links", 0))
+
+    @property
+    def done(self):
+        return self.after >= self.end
+
+    def save(self):
+        write_json_atomic(self.path, {"after": self.after, "end": self.end, "tenant": self.tenant,
+                                      "messages": self.messages, "links": self.links})
+
+
+class Throttle:
+    """Sleeps between chunks to hold the average at rows_per_second (0 = no limit)"""
+
+    def __init__(self, rows_per_second=0):
+        self.rows_per_second = rows_per_second
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def wait(self, rows):
+        self.rows += rows
+        if not self.rows_per_second:
+            return 0
+        delay = self.rows / self.rows_per_second - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+        return max(delay, 0)
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0
+
+
+def default_end(db, linker_checkpoint=CHECKPOINT_FILE):
+    """Where the live linker's coverage starts, or the current max mail id"""
+    checkpoint = Checkpoint.load(linker_checkpoint)
+    if checkpoint.started:
+        return checkpoint.floor
+    return max_mail_id(db)
+
+
+def backfill_chunk(db, index, config, state, chunk_size, linked=None, chains=None):
+    """Link the next chunk of unlinked mail past state.after; returns the rows read
+
+    The chunk's events are committed before the cursor moves, so a run
+    killed at any point resumes at the first chunk not yet committed.
+    linked, a LinkedMailFilter, replaces the NOT EXISTS in the chunk query;
+    chains, a ChainContacts, caches address lookups per conversation.
+    """
+    chunk = new_messages(db, monitored_folders(config), state.after, state.end, state.tenant, chunk_size,
+                         linked is None)
+    rows = chunk if linked is None else linked.unlinked(db, chunk)
+    create_on = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    no_match_events = config.get("Features", {}).get("CreateNoMatchEvents", True)
+    links = 0
+    written = []
+    with EventWriter(db, config.get("BatchSize", DEFAULT_BATCH_SIZE)) as writer:
+        for message, events in zip(rows, link_batch(index, rows, create_on, no_match_events, chains=chains)):
+            links += sum(1 for event in events if event[7] == LINKED_CATEGORY)
+            writer.extend(events)
+            if events:
+                written.append(message[0])
+    if linked is not None:
+        linked.update(written)
+
+    # A short chunk means nothing unlinked is left below end
+    state.after = chunk[-1][0] if len(chunk) == chunk_size else state.end
+    state.messages += len(rows)
+    state.links += links
+    state.save()
+    return len(chunk)
+
+
+def backfill(db, index, config, state, chunk_size=DEFAULT_CHUNK_SIZE, throttle=None, linked=None):
+    """Run chunks until state reaches its end"""
+    throttle = throttle or Throttle()
+    chains = ChainContacts()
+    while not state.done:
+        rows = backfill_chunk(db, index, config, state, chunk_size, linked, chains)
+        throttle.wait(rows)
+        print(f"[CRM-BACKFILL] 📦 id {state.after}/{state.end}: {state.messages} emails, "
+              f"{state.links} CRM links ({throttle.rate:.0f} rows/s)")
+
+
+def main():
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print("Usage: crm_backfill.py [--db sqlite:<path>] [--config CrmEmailMonitoringConfig.json]")
+        print("                       [--checkpoint crm_backfill_checkpoint.json] [--chunk-size N]")
+        print("                       [--rate ROWS_PER_SEC] [--tenant ID] [--from-id ID] [--to-id ID] [--restart]")
+        print("  --to-id    defaults to where the live linker's checkpoint starts, else the current max id")
+        print("  --restart  ignore an unfinished run and start a new one")
+        return 0
+
+    def option(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+
+    config = load_config(option("--config"))
+    db = connect(option("--db"), config)
+    checkpoint_path = option("--checkpoint", BACKFILL_CHECKPOINT_FILE)
+    tenant = option("--tenant")
+    tenant = int(tenant) if tenant is not None else None
+
+    print("🚀 ONLYOFFICE CRM Email Backfill")
+    state = None if "--restart" in args else BackfillState.load(checkpoint_path)
+    try:
+        if state is None:
+            end = option("--to-id")
+            state = BackfillState(checkpoint_path, int(option("--from-id", 0)),
+                                  int(end) if end is not None else default_end(db), tenant)
+            state.save()
+        elif tenant is not None and tenant != state.tenant:
+            print(f"❌ {checkpoint_path} belongs to a run for tenant {state.tenant}; use --restart")
+            return 1
+        else:
+            print(f"[CRM-BACKFILL] ↩️ Resuming after id {state.after} (up to {state.end})")
+
+        if state.done:
+            print(f"[CRM-BACKFILL] ✅ Nothing to do: already linked up to id {state.end}")
+            return 0
+
+        started = time.time()
+        index = ContactIndex.load(db)
+        print(f"[CRM-BACKFILL] 📇 Indexed {len(index)} contact addresses in {time.time() - started:.2f}s")
+        started = time.time()
+        linked = LinkedMailFilter.load(db, ENTITY_TYPE_MAIL)
+        print(f"[CRM-BACKFILL] 🧮 Loaded {len(linked)} linked mail ids ({linked.nbytes // 1024} KiB) "
+              f"in {time.time() - started:.2f}s")
+
+        backfill(db, index, config, state, int(option("--chunk-size", DEFAULT_CHUNK_SIZE)),
+                 Throttle(float(option("--rate", 0))), linked)
+        print(f"[CRM-BACKFILL] ✅ Done: {state.messages} emails, {state.links} CRM links")
+    except KeyboardInterrupt:
+        if state is not None:
+            print(f"[CRM-BACKFILL] 🛑 Stopped; rerun to resume after id {state.after}")
+        else:
+            print("[CRM-BACKFILL] 🛑 Stopped before the run started")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Conversation-level contact lookups: the addresses of a mail chain are looked
+up once and reused for every later reply in it
+"""
+
+from collections import OrderedDict
+
+# Conversations remembered; replies mostly land in recently active chains
+CHAIN_CACHE_SIZE = 10000
+
+
+class ChainContacts:
+    """LRU of (tenant, mailbox, chain id) -> contact ids of each address
+    already looked up in that conversation
+
+    A reply with the same participants costs no index lookups at all and a
+    new participant costs only its own. Each message is still matched on
+    its own addresses only, as without the cache.
+    """
+
+    def __init__(self, size=CHAIN_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._chains = OrderedDict()
+
+    def __len__(self):
+        return len(self._chains)
+
+    def resolve(self, index, key, addresses):
+        """Map contact id -> the first of addresses that matched it, like
+        ContactIndex.resolve, looking up only addresses new to the chain"""
+        known = self._chains.get(key)
+        if known is None:
+            self.misses += 1
+            known = self._chains[key] = {}
+            if len(self._chains) > self.size:
+                self._chains.popitem(last=False)
+        else:
+            self.hits += 1
+            self._chains.move_to_end(key)
+
+        matches = {}
+        for address in addresses:
+            contact_ids = known.get(address)
+            if contact_ids is None:
+                contact_ids = known[address] = index.lookup(key[0], address)
+            for contact_id in contact_ids:
+                matches.setdefault(contact_id, address)
+        return matches
+
+    def clear(self):
+        """Forget every chain (the contact index changed under them)"""
+        self._chains.clear()
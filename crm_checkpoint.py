@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Per-tenant mail_mail.id high-watermarks for the CRM linker, persisted
+atomically so a restart resumes where the last cycle stopped
+"""
+
+import itertools
+import json
+import os
+
+CHECKPOINT_FILE = "crm_linker_checkpoint.json"
+
+# Ids below a watermark that every cycle reads again: an insert that took its
+# id before a higher one but committed after it lands under the watermark
+DEFAULT_LOOKBACK_IDS = 1000
+
+
+def write_json_atomic(path, data):
+    """Write data to a temporary file and rename it over path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """Highest mail_mail.id already linked, per tenant
+
+    floor is the watermark of every tenant without an entry of its own
+    (tenants that had no mail yet when the last cycle ran). A watermark
+    says nothing about ids that commit after a higher one, so each cycle
+    also re-reads the lookback ids below it; ids handled there by this
+    process are remembered (not saved) so they are not handled twice.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE, tenants=None, floor=None, lookback=DEFAULT_LOOKBACK_IDS):
+        self.path = path
+        self.tenants = dict(tenants or {})
+        self.floor = floor
+        self.lookback = lookback
+        self._recent = set()
+
+    @classmethod
+    def load(cls, path=CHECKPOINT_FILE, lookback=DEFAULT_LOOKBACK_IDS):
+        """Read path, or an empty checkpoint (floor None) if it does not exist"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, lookback=lookback)
+        tenants = {int(tenant): int(mail_id) for tenant, mail_id in data.get("tenants", {}).items()}
+        return cls(path, tenants, data.get("floor"), lookback)
+
+    @property
+    def started(self):
+        return self.floor is not None
+
+    def watermark(self, tenant):
+        return self.tenants.get(tenant, self.floor or 0)
+
+    def low_watermark(self, tenants=None):
+        """Lowest watermark among tenants (every known tenant by default)"""
+        if tenants is None:
+            tenants = self.tenants
+        return min([self.watermark(t) for t in tenants] + [self.floor or 0])
+
+    def scan_start(self, tenant=None):
+        """Id to read a tenant's mail (every tenant's by default) after,
+        lookback included"""
+        watermark = self.low_watermark() if tenant is None else self.watermark(tenant)
+        return max(0, watermark - self.lookback)
+
+    def pending(self, row):
+        """Whether a (mail id, tenant, ...) row read from scan_start() on
+        still needs linking: past its tenant's watermark, or inside the
+        lookback and not handled yet"""
+        mail_id = row[0]
+        return mail_id > self.watermark(row[1]) - self.lookback and mail_id not in self._recent
+
+    def handled(self, mail_ids):
+        """Remember mail_ids as linked, for pending(); call it after the
+        watermarks moved past them, so ids below the lookback are dropped"""
+        cutoff = self.low_watermark() - self.lookback
+        self._recent = {mail_id for mail_id in itertools.chain(self._recent, mail_ids) if mail_id > cutoff}
+
+    def advance(self, tenant, mail_id):
+        """Move a tenant's watermark forward; it never moves back"""
+        if mail_id > self.watermark(tenant):
+            self.tenants[tenant] = mail_id
+
+    def advance_all(self, mail_id, tenants=None):
+        """Every tenant (or just tenants) has been linked up to mail_id"""
+        for tenant in (self.tenants if tenants is None else tenants):
+            self.advance(tenant, mail_id)
+        if tenants is None and mail_id > (self.floor or 0):
+            self.floor = mail_id
+
+    def save(self):
+        write_json_atomic(self.path, {
+            "floor": self.floor,
+            "tenants": {str(t): mail_id for t, mail_id in sorted(self.tenants.items())},
+        })
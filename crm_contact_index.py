@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+In-memory index from normalized contact e-mail address to CRM contact ids,
+so linking a message costs one dict lookup per address
+"""
+
+from email_addresses import normalize_address
+
+# crm_contact_info.type for e-mail addresses
+EMAIL_INFO_TYPE = 1
+
+CONTACT_EMAILS_SQL = """
+    SELECT ci.id, ci.tenant_id, ci.contact_id, ci.data
+    FROM crm_contact_info ci
+    WHERE ci.type = ?
+"""
+
+# One cheap aggregate per tenant; when it moves, that tenant's addresses changed
+FINGERPRINT_SQL = """
+    SELECT ci.tenant_id, MAX(ci.id), COUNT(*), MAX(ci.last_modifed_on)
+    FROM crm_contact_info ci
+    WHERE ci.type = ?
+    GROUP BY ci.tenant_id
+"""
+
+
+class ContactIndex:
+    """(tenant, address) -> contact ids, built from crm_contact_info
+
+    Each tenant's addresses live in their own dict. A refresh builds the
+    changed tenants' dicts on the side and swaps them in with one reference
+    assignment, so lookups never wait for it or see it half-applied.
+    owns_tenant, when given, limits the index to the tenants it accepts.
+    """
+
+    def __init__(self, owns_tenant=None):
+        self.owns_tenant = owns_tenant
+        self._tenants = {}
+        # tenant -> crm_contact_info.id -> (normalized address, contact_id)
+        self._rows = {}
+        self.fingerprints = {}
+
+    def __len__(self):
+        return sum(len(addresses) for addresses in self._tenants.values())
+
+    def lookup(self, tenant, address):
+        """Contact ids with this (already normalized) address in the tenant"""
+        return self._tenants.get(tenant, {}).get(address, ())
+
+    def resolve(self, tenant, addresses):
+        """Map contact id -> the first of addresses that matched it"""
+        contacts = self._tenants.get(tenant)
+        matches = {}
+        if contacts is None:
+            return matches
+        for address in addresses:
+            for contact_id in contacts.get(address, ()):
+                matches.setdefault(contact_id, address)
+        return matches
+
+    @staticmethod
+    def _build(rows):
+        contacts = {}
+        for address, contact_id in rows.values():
+            if address is None:
+                continue
+            ids = contacts.get(address, ())
+            if contact_id not in ids:
+                contacts[address] = ids + (contact_id,)
+        return contacts
+
+    def _swap(self, changed, removed=()):
+        tenants = dict(self._tenants)
+        tenants.update(changed)
+        for tenant in removed:
+            tenants.pop(tenant, None)
+        self._tenants = tenants
+
+    def _fingerprints(self, db):
+        return {tenant: (max_id, count, modified)
+                for tenant, max_id, count, modified in db.query(FINGERPRINT_SQL, (EMAIL_INFO_TYPE,))
+                if self.owns_tenant is None or self.owns_tenant(tenant)}
+
+    @staticmethod
+    def _read_tenants(db, tenants):
+        """Every contact e-mail row of tenants, in IN (...) batches"""
+        rows = []
+        step = max(1, db.max_params - 1)
+        for start in range(0, len(tenants), step):
+            chunk = tenants[start:start + step]
+            rows += db.query(CONTACT_EMAILS_SQL + f" AND ci.tenant_id IN ({', '.join('?' * len(chunk))})",
+                             [EMAIL_INFO_TYPE] + chunk)
+        return rows
+
+    def _read_changed(self, db, tenant, old):
+        """Rows of tenant added or edited since the old fingerprint"""
+        sql = CONTACT_EMAILS_SQL + " AND ci.tenant_id = ?"
+        params = [EMAIL_INFO_TYPE, tenant]
+        if old is not None:
+            old_max_id, _, old_modified = old
+            if old_modified is None:
+                sql += " AND (ci.id > ? OR ci.last_modifed_on IS NOT NULL)"
+                params.append(old_max_id)
+            else:
+                # >= : another edit can share the old maximum timestamp
+                sql += " AND (ci.id > ? OR ci.last_modifed_on >= ?)"
+                params += [old_max_id, old_modified]
+        return db.query(sql, params)
+
+    def refresh(self, db):
+        """Re-read the rows of tenants whose fingerprint moved; returns the rows read"""
+        fingerprints = self._fingerprints(db)
+        changed = {}
+        read = 0
+        for tenant, fingerprint in fingerprints.items():
+            old = self.fingerprints.get(tenant)
+            if fingerprint == old:
+                continue
+            rows = self._rows.get(tenant, {}) if old is not None else {}
+            for row_id, _, contact_id, data in self._read_changed(db, tenant, old):
+                rows[row_id] = (normalize_address(data), contact_id)
+                read += 1
+            if len(rows) != fingerprint[1]:
+                # Rows were deleted (or stopped being e-mail addresses)
+                current = {row[0] for row in db.query(
+                    "SELECT ci.id FROM crm_contact_info ci WHERE ci.type = ? AND ci.tenant_id = ?",
+                    (EMAIL_INFO_TYPE, tenant))}
+                rows = {row_id: row for row_id, row in rows.items() if row_id in current}
+            self._rows[tenant] = rows
+            changed[tenant] = self._build(rows)
+
+        removed = [tenant for tenant in self.fingerprints if tenant not in fingerprints]
+        for tenant in removed:
+            self._rows.pop(tenant, None)
+        if changed or removed:
+            self._swap(changed, removed)
+        self.fingerprints = fingerprints
+        return read
+
+    @classmethod
+    def load(cls, db, owns_tenant=None):
+        """Read every contact e-mail address in one query, or with
+        owns_tenant only those of the tenants it accepts"""
+        index = cls(owns_tenant)
+        # Fingerprint first: rows changing during the read are read again next refresh
+        fingerprints = index._fingerprints(db)
+        if owns_tenant is None:
+            rows = db.query(CONTACT_EMAILS_SQL, (EMAIL_INFO_TYPE,))
+        else:
+            rows = index._read_tenants(db, list(fingerprints))
+        for row_id, tenant, contact_id, data in rows:
+            index._rows.setdefault(tenant, {})[row_id] = (normalize_address(data), contact_id)
+        index._swap({tenant: cls._build(rows) for tenant, rows in index._rows.items()})
+        index.fingerprints = fingerprints
+        return index
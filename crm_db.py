@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Database access for the Python CRM linker: MySQL through PyMySQL, or a
+local SQLite stand-in with the same tables for testing
+"""
+
+import json
+import os
+import sqlite3
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CrmEmailMonitoringConfig.json")
+
+# The columns of the ONLYOFFICE tables the linker reads and writes
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crm_contact (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id INTEGER NOT NULL,
+    is_company INTEGER NOT NULL DEFAULT 0,
+    first_name TEXT,
+    last_name TEXT,
+    company_name TEXT,
+    display_name TEXT,
+    status_id INTEGER NOT NULL DEFAULT 0,
+    company_id INTEGER NOT NULL DEFAULT 0,
+    create_by TEXT NOT NULL DEFAULT '',
+    create_on TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_modifed_on TEXT
+);
+CREATE TABLE IF NOT EXISTS crm_contact_info (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL,
+    category INTEGER NOT NULL DEFAULT 0,
+    tenant_id INTEGER NOT NULL,
+    is_primary INTEGER NOT NULL DEFAULT 0,
+    contact_id INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    last_modifed_on TEXT,
+    last_modifed_by TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_Contact ON crm_contact_info (tenant_id, contact_id);
+CREATE TABLE IF NOT EXISTS crm_relationship_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    contact_id INTEGER NOT NULL,
+    content TEXT,
+    create_by TEXT NOT NULL,
+    create_on TEXT NOT NULL,
+    tenant_id INTEGER NOT NULL,
+    entity_type INTEGER NOT NULL,
+    entity_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    last_modifed_by TEXT,
+    last_modifed_on TEXT,
+    have_files INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS IX_Entity ON crm_relationship_event (entity_id, entity_type);
+CREATE TABLE IF NOT EXISTS mail_mail (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_mailbox INTEGER NOT NULL DEFAULT 0,
+    id_user TEXT NOT NULL DEFAULT '',
+    tenant INTEGER NOT NULL,
+    address TEXT NOT NULL DEFAULT '',
+    from_text TEXT,
+    to_text TEXT,
+    cc TEXT,
+    subject TEXT,
+    date_received TEXT NOT NULL DEFAULT '1975-01-01 00:00:00',
+    folder INTEGER NOT NULL DEFAULT 1,
+    is_removed INTEGER NOT NULL DEFAULT 0,
+    chain_id TEXT
+);
+CREATE INDEX IF NOT EXISTS list_messages ON mail_mail (tenant, folder);
+CREATE TABLE IF NOT EXISTS mail_chain_x_crm_entity (
+    id_tenant INTEGER NOT NULL,
+    id_mailbox INTEGER NOT NULL,
+    id_chain TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    entity_type INTEGER NOT NULL,
+    PRIMARY KEY (id_tenant, id_mailbox, id_chain, entity_id, entity_type)
+);
+"""
+
+
+def load_config(path=None):
+    """The CrmEmailMonitoring section of CrmEmailMonitoringConfig.json"""
+    with open(path or CONFIG_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)["CrmEmailMonitoring"]
+
+
+class CrmDatabase:
+    """DB-API connection wrapper; SQL is written with ? placeholders"""
+
+    def __init__(self, conn, paramstyle="qmark", max_params=999):
+        self.conn = conn
+        self.paramstyle = paramstyle
+        # Most placeholders a single statement may bind
+        self.max_params = max_params
+        self.round_trips = 0
+
+    def _sql(self, sql):
+        if self.paramstyle == "format":
+            return sql.replace("%", "%%").replace("?", "%s")
+        return sql
+
+    def execute(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.execute(self._sql(sql), params)
+        self.round_trips += 1
+        return cursor
+
+    def executemany(self, sql, rows):
+        cursor = self.conn.cursor()
+        cursor.executemany(self._sql(sql), rows)
+        self.round_trips += 1
+        return cursor
+
+    def query(self, sql, params=()):
+        """Every row of a SELECT"""
+        cursor = self.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def commit(self):
+        self.conn.commit()
+        self.round_trips += 1
+
+    def close(self):
+        self.conn.close()
+
+
+def connect_sqlite(path):
+    """SQLite stand-in with the linker's tables created"""
+    # Pooled connections are handed between threads, one user at a time
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.executescript(SQLITE_SCHEMA)
+    return CrmDatabase(conn, "qmark", max_params=999)
+
+
+def connect_mysql(config):
+    """MySQL connection from the DatabaseConnection settings"""
+    try:
+        import pymysql
+    except ImportError:
+        raise RuntimeError("PyMySQL is required for MySQL: pip install pymysql") from None
+
+    settings = config["DatabaseConnection"]
+    conn = pymysql.connect(
+        host=settings["Server"],
+        port=int(settings.get("Port", 3306)),
+        user=settings["Username"],
+        password=settings["Password"],
+        database=settings["Database"],
+        charset=settings.get("CharSet", "utf8"),
+        connect_timeout=settings.get("ConnectionTimeout", 30),
+        read_timeout=settings.get("CommandTimeout", 60),
+        autocommit=False,
+    )
+    return CrmDatabase(conn, "format", max_params=65535)
+
+
+def connect(target=None, config=None):
+    """Open "sqlite:<path>" when given, otherwise the configured MySQL database"""
+    if target and target.startswith("sqlite:"):
+        return connect_sqlite(target[len("sqlite:"):])
+    return connect_mysql(config or load_config())
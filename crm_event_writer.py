@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Batched crm_relationship_event writer: buffers event rows and writes them
+with multi-row INSERTs, committing once per batch
+"""
+
+import time
+
+EVENT_COLUMNS = ("contact_id, entity_type, entity_id, content, create_on, "
+                 "create_by, tenant_id, category_id, have_files")
+EVENT_ROW = "(?, ?, ?, ?, ?, ?, ?, ?, 0)"
+EVENT_PARAMS = 8
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_SECONDS = 5.0
+
+
+class EventWriter:
+    """Buffer of event rows flushed on a row count or an age threshold
+
+    Rows are (contact_id, entity_type, entity_id, content, create_on,
+    create_by, tenant_id, category_id), as built by crm_linker.link_message.
+    """
+
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE, flush_seconds=DEFAULT_FLUSH_SECONDS,
+                 multi_row=True):
+        self.db = db
+        self.batch_size = max(1, int(batch_size))
+        self.flush_seconds = flush_seconds
+        self.multi_row = multi_row
+        self.written = 0
+        self.batches = 0
+        self._rows = []
+        self._first_buffered = None
+        # One statement may not bind more parameters than the driver allows
+        self._rows_per_statement = max(1, min(self.batch_size, db.max_params // EVENT_PARAMS))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row):
+        if not self._rows:
+            self._first_buffered = time.monotonic()
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size or self._expired():
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def _expired(self):
+        return (self._first_buffered is not None
+                and time.monotonic() - self._first_buffered >= self.flush_seconds)
+
+    def flush(self):
+        """Write and commit everything buffered; returns the rows written"""
+        rows = self._rows
+        if not rows:
+            return 0
+        self._rows = []
+        self._first_buffered = None
+
+        if self.multi_row:
+            step = self._rows_per_statement
+            for start in range(0, len(rows), step):
+                chunk = rows[start:start + step]
+                sql = (f"INSERT INTO crm_relationship_event ({EVENT_COLUMNS}) VALUES "
+                       + ", ".join([EVENT_ROW] * len(chunk)))
+                self.db.execute(sql, [value for row in chunk for value in row]).close()
+        else:
+            self.db.executemany(f"INSERT INTO crm_relationship_event ({EVENT_COLUMNS}) VALUES {EVENT_ROW}",
+                                rows).close()
+        self.db.commit()
+
+        self.written += len(rows)
+        self.batches += 1
+        return len(rows)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+CRM e-mail linker: links new mail to CRM contacts through an in-memory
+address index instead of the CROSS JOIN + LIKE in runtime-crm-monitor.sh
+"""
+
+import sys
+import time
+from datetime import datetime
+
+from crm_chain_contacts import ChainContacts
+from crm_checkpoint import CHECKPOINT_FILE, DEFAULT_LOOKBACK_IDS, Checkpoint
+from crm_contact_index import ContactIndex
+from crm_db import connect, load_config
+from crm_event_writer import DEFAULT_BATCH_SIZE, EventWriter
+from crm_linked_filter import LinkedMailFilter
+from email_addresses import normalize_rows, parse_addresses
+
+# crm_relationship_event values used by the existing monitors
+ENTITY_TYPE_MAIL = 0
+LINKED_CATEGORY = -3
+NO_MATCH_CATEGORY = -99
+NO_MATCH_CONTENT = "NO_CRM_MATCH"
+CREATE_BY = "crm-monitor"
+
+INBOX_FOLDER = 1
+SENT_FOLDER = 2
+
+def monitored_folders(config):
+    """Mail folders to link, from the Features switches"""
+    features = config.get("Features", {})
+    folders = []
+    if features.get("ProcessInboxEmails", True):
+        folders.append(INBOX_FOLDER)
+    if features.get("ProcessSentEmails", True):
+        folders.append(SENT_FOLDER)
+    return folders
+
+
+def max_mail_id(db):
+    """Current mail_mail.id high end (a primary-key lookup)"""
+    return db.query("SELECT MAX(id) FROM mail_mail")[0][0] or 0
+
+
+def new_messages(db, folders, after_id, up_to_id, tenant=None, limit=None, guard=True):
+    """Messages in folders with after_id < id <= up_to_id and no event yet
+
+    The id range keeps this a primary-key range scan; the NOT EXISTS only
+    guards against mail another linker got to first. tenant restricts it
+    to one tenant, and limit makes it one keyset page. guard=False leaves
+    the NOT EXISTS out for callers that filter through a LinkedMailFilter.
+    """
+    sql = f"""
+        SELECT m.id, m.tenant, m.from_text, m.to_text, m.cc, m.id_mailbox, m.chain_id
+        FROM mail_mail m
+        WHERE m.id > ? AND m.id <= ?
+          AND m.folder IN ({", ".join("?" * len(folders))})
+    """
+    params = [after_id, up_to_id] + list(folders)
+    if guard:
+        sql += """
+          AND NOT EXISTS (
+              SELECT 1 FROM crm_relationship_event cre
+              WHERE cre.entity_type = ? AND cre.entity_id = m.id
+          )
+        """
+        params.append(ENTITY_TYPE_MAIL)
+    if tenant is not None:
+        sql += " AND m.tenant = ?"
+        params.append(tenant)
+    sql += " ORDER BY m.id"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return db.query(sql, params)
+
+
+def mail_tenants(db):
+    """Every tenant that has mail"""
+    return [row[0] for row in db.query("SELECT DISTINCT tenant FROM mail_mail")]
+
+
+def _message_events(message, matches, create_on, no_match_events):
+    message_id, tenant = message[0], message[1]
+    events = [
+        (contact_id, ENTITY_TYPE_MAIL, message_id, f"AUTO_LINKED via {address}",
+         create_on, CREATE_BY, tenant, LINKED_CATEGORY)
+        for contact_id, address in matches.items()
+    ]
+    if not events and no_match_events:
+        # Marker so the message is not picked up again
+        events.append((0, ENTITY_TYPE_MAIL, message_id, NO_MATCH_CONTENT,
+                       create_on, CREATE_BY, tenant, NO_MATCH_CATEGORY))
+    return events
+
+
+def link_message(index, message, create_on, no_match_events=True, addresses=None):
+    """crm_relationship_event rows for one (id, tenant, from, to, cc, ...) message
+
+    addresses, when given, are the message's already normalized addresses.
+    """
+    if addresses is None:
+        addresses = parse_addresses(*message[2:5])
+    return _message_events(message, index.resolve(message[1], addresses), create_on, no_match_events)
+
+
+def link_batch(index, messages, create_on, no_match_events=True, addresses=None, chains=None):
+    """Event rows for a fetched batch of new_messages rows, one list per message
+
+    With chains (a ChainContacts), the addresses of a message with a chain
+    id are looked up through its conversation's cache (same tenant, mailbox
+    and chain id); every message is linked to its own participants only.
+    """
+    if addresses is None:
+        addresses = normalize_rows(messages)
+    if chains is None:
+        return [link_message(index, message, create_on, no_match_events, message_addresses)
+                for message, message_addresses in zip(messages, addresses)]
+
+    events = []
+    for message, message_addresses in zip(messages, addresses):
+        chain_id = message[6]
+        if chain_id:
+            matches = chains.resolve(index, (message[1], message[5], chain_id), message_addresses)
+        else:
+            matches = index.resolve(message[1], message_addresses)
+        events.append(_message_events(message, matches, create_on, no_match_events))
+    return events
+
+
+def link_new(db, index, config, checkpoint, linked=None, chains=None):
+    """Link the mail that arrived past the checkpoint; returns (messages, links)
+
+    New mail is read in keyset pages of BatchSize rows, so a first run
+    against a full mailbox or a long outage never holds the whole backlog.
+    Each page's events are committed before the watermarks move to its last
+    id and the checkpoint is saved, so a crash in between re-reads that page
+    and the NOT EXISTS guard (or linked, a LinkedMailFilter) skips the rows
+    already written. The checkpoint's lookback ids are read again each
+    cycle, so mail that committed after a higher id is still linked.
+    chains, a ChainContacts, caches address lookups per conversation.
+    """
+    high = max_mail_id(db)
+    if not high:
+        return 0, 0
+
+    if linked is not None:
+        linked.refresh(db)
+    folders = monitored_folders(config)
+    batch_size = config.get("BatchSize", DEFAULT_BATCH_SIZE)
+    create_on = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    no_match_events = config.get("Features", {}).get("CreateNoMatchEvents", True)
+    total = links = 0
+    after = checkpoint.scan_start()
+    with EventWriter(db, batch_size) as writer:
+        while True:
+            rows = new_messages(db, folders, after, high, limit=batch_size, guard=linked is None)
+            last_page = len(rows) < batch_size
+            if rows:
+                after = rows[-1][0]
+            candidates = [m for m in rows if checkpoint.pending(m)]
+            messages = candidates if linked is None else linked.unlinked(db, candidates)
+
+            written = []
+            for message, message_events in zip(messages, link_batch(index, messages, create_on,
+                                                                    no_match_events, chains=chains)):
+                links += sum(1 for event in message_events if event[7] == LINKED_CATEGORY)
+                writer.extend(message_events)
+                if message_events:
+                    written.append(message[0])
+            writer.flush()
+            if linked is not None:
+                linked.update(written)
+            total += len(messages)
+
+            # Every tenant is linked up to the page's last id; the last page
+            # covers everything up to high
+            checkpoint.advance_all(high if last_page else after)
+            checkpoint.handled(m[0] for m in candidates)
+            checkpoint.save()
+            if last_page:
+                return total, links
+
+
+def main():
+    args = sys.argv[1:]
+    target = None
+    config_path = None
+    checkpoint_path = CHECKPOINT_FILE
+    once = "--once" in args
+    if "--db" in args:
+        target = args[args.index("--db") + 1]
+    if "--config" in args:
+        config_path = args[args.index("--config") + 1]
+    if "--checkpoint" in args:
+        checkpoint_path = args[args.index("--checkpoint") + 1]
+    if "--help" in args or "-h" in args:
+        print("Usage: crm_linker.py [--db sqlite:<path>] [--config CrmEmailMonitoringConfig.json]")
+        print("                     [--checkpoint crm_linker_checkpoint.json] [--from-start] [--once]")
+        print("  --from-start  with no checkpoint yet, link all existing mail instead of only new mail")
+        return
+
+    config = load_config(config_path)
+    db = connect(target, config)
+    interval = config.get("MonitoringIntervalSeconds", 30)
+
+    print("🚀 ONLYOFFICE CRM Email Linker")
+    started = time.time()
+    index = ContactIndex.load(db)
+    print(f"[CRM-LINKER] 📇 Indexed {len(index)} contact addresses in {time.time() - started:.2f}s")
+
+    checkpoint = Checkpoint.load(checkpoint_path, config.get("LookbackIds", DEFAULT_LOOKBACK_IDS))
+    if not checkpoint.started:
+        # Like the shell monitor, a first run only links mail arriving from now on
+        checkpoint.floor = 0 if "--from-start" in args else max_mail_id(db)
+        checkpoint.save()
+    print(f"[CRM-LINKER] 📊 Resuming after mail id {checkpoint.low_watermark()}")
+
+    started = time.time()
+    linked = LinkedMailFilter.load(db, ENTITY_TYPE_MAIL)
+    print(f"[CRM-LINKER] 🧮 Loaded {len(linked)} linked mail ids ({linked.nbytes // 1024} KiB) "
+          f"in {time.time() - started:.2f}s")
+
+    chains = ChainContacts()
+
+    try:
+        while True:
+            refreshed = index.refresh(db)
+            if refreshed:
+                print(f"[CRM-LINKER] 📇 Re-read {refreshed} changed contact addresses")
+                chains.clear()
+            messages, links = link_new(db, index, config, checkpoint, linked, chains)
+            if messages:
+                print(f"[CRM-LINKER] ✅ Processed {messages} emails, {links} CRM links created")
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("[CRM-LINKER] 🛑 Stopping monitoring...")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
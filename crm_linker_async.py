@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Asyncio CRM linker: polls every tenant concurrently, so one slow tenant no
+longer holds up the others, and matches fetched pages in a separate stage
+"""
+
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime
+
+from crm_chain_contacts import ChainContacts
+from crm_checkpoint import CHECKPOINT_FILE, DEFAULT_LOOKBACK_IDS, Checkpoint
+from crm_contact_index import ContactIndex
+from crm_db import connect, load_config
+from crm_event_writer import DEFAULT_BATCH_SIZE, EventWriter
+from crm_linked_filter import LinkedMailFilter
+from crm_linker import (ENTITY_TYPE_MAIL, LINKED_CATEGORY, link_batch, mail_tenants, max_mail_id,
+                        monitored_folders, new_messages)
+
+DEFAULT_CONCURRENCY = 8
+PAGE_SIZE = 1000
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+
+
+class AsyncConnectionPool:
+    """Bounded pool of DB-API connections used from asyncio
+
+    Each call runs on a worker thread with a connection of its own, so the
+    blocking drivers (PyMySQL, sqlite3) never stall the event loop.
+    """
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._size = size
+        self._created = []
+        self._idle = asyncio.Queue()
+
+    async def _acquire(self):
+        if self._idle.empty() and len(self._created) < self._size:
+            db = await asyncio.to_thread(self._factory)
+            self._created.append(db)
+            return db
+        return await self._idle.get()
+
+    async def run(self, fn, *args):
+        """fn(db, *args) on a pooled connection, off the event loop"""
+        db = await self._acquire()
+        try:
+            return await asyncio.to_thread(fn, db, *args)
+        finally:
+            self._idle.put_nowait(db)
+
+    @property
+    def round_trips(self):
+        return sum(db.round_trips for db in self._created)
+
+    def close(self):
+        for db in self._created:
+            db.close()
+        self._created = []
+
+
+class TenantBackoff:
+    """Exponential, jittered backoff for tenants whose polls keep failing"""
+
+    def __init__(self, base=BACKOFF_BASE_SECONDS, maximum=BACKOFF_MAX_SECONDS):
+        self.base = base
+        self.maximum = maximum
+        self._failures = {}
+        self._retry_at = {}
+
+    def ready(self, tenant, now=None):
+        return (now or time.monotonic()) >= self._retry_at.get(tenant, 0)
+
+    def failed(self, tenant):
+        failures = self._failures.get(tenant, 0) + 1
+        self._failures[tenant] = failures
+        delay = min(self.maximum, self.base * 2 ** (failures - 1))
+        self._retry_at[tenant] = time.monotonic() + delay * random.uniform(0.5, 1.0)
+        return delay
+
+    def succeeded(self, tenant):
+        self._failures.pop(tenant, None)
+        self._retry_at.pop(tenant, None)
+
+
+def _write_events(db, events, batch_size):
+    with EventWriter(db, batch_size) as writer:
+        writer.extend(events)
+
+
+async def _fetch_tenant(pool, tenant, folders, checkpoint, high, semaphore, pages, page_size, linked=None):
+    """Page through one tenant's new mail onto the matching queue"""
+    async with semaphore:
+        after = checkpoint.scan_start(tenant)
+        while True:
+            rows = await pool.run(new_messages, folders, after, high, tenant, page_size, linked is None)
+            last_page = len(rows) < page_size
+            if rows:
+                after = rows[-1][0]
+            candidates = [row for row in rows if checkpoint.pending(row)]
+            rows = candidates if linked is None else await pool.run(linked.unlinked, candidates)
+            handled = [row[0] for row in candidates]
+            if last_page:
+                # Last page: the tenant is done up to high, even past its last row
+                await pages.put((tenant, high, rows, handled))
+                return
+            await pages.put((tenant, after, rows, handled))
+
+
+async def _match_pages(index, config, pages, batches, chains=None):
+    """CPU stage: normalize addresses and build event rows for each page"""
+    no_match_events = config.get("Features", {}).get("CreateNoMatchEvents", True)
+    while True:
+        item = await pages.get()
+        if item is None:
+            await batches.put(None)
+            return
+        tenant, up_to, rows, handled = item
+        create_on = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        events = [event for message_events in link_batch(index, rows, create_on, no_match_events, chains=chains)
+                  for event in message_events]
+        await batches.put((tenant, up_to, len(rows), events, handled))
+
+
+async def _write_batches(pool, config, checkpoint, batches, totals, write_failed, linked=None):
+    """Write each page's events, then move that tenant's watermark"""
+    batch_size = config.get("BatchSize", DEFAULT_BATCH_SIZE)
+    while True:
+        item = await batches.get()
+        if item is None:
+            return
+        tenant, up_to, messages, events, handled = item
+        if tenant in write_failed:
+            # Later pages must not move the watermark past the failed one
+            continue
+        if events:
+            try:
+                await pool.run(_write_events, events, batch_size)
+            except Exception as e:
+                write_failed[tenant] = e
+                continue
+            if linked is not None:
+                linked.update(event[2] for event in events)
+        checkpoint.advance(tenant, up_to)
+        checkpoint.handled(handled)
+        totals[0] += messages
+        totals[1] += sum(1 for event in events if event[7] == LINKED_CATEGORY)
+
+
+async def run_cycle(pool, index, config, checkpoint, backoff, concurrency=DEFAULT_CONCURRENCY,
+                    page_size=PAGE_SIZE, owns_tenant=None, linked=None, chains=None):
+    """One polling cycle over every tenant; returns (messages, links, failed tenants)
+
+    owns_tenant, when given, limits the cycle to the tenants it accepts;
+    linked, a LinkedMailFilter, replaces the NOT EXISTS in the page queries;
+    chains, a ChainContacts, caches address lookups per conversation.
+    """
+    high = await pool.run(max_mail_id)
+    if linked is not None:
+        await pool.run(linked.refresh)
+    tenants = await pool.run(mail_tenants)
+    if owns_tenant is not None:
+        tenants = [t for t in tenants if owns_tenant(t)]
+    folders = monitored_folders(config)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    pages = asyncio.Queue(maxsize=concurrency * 2)
+    batches = asyncio.Queue(maxsize=concurrency * 2)
+    totals = [0, 0]
+    write_failed = {}
+    matcher = asyncio.create_task(_match_pages(index, config, pages, batches, chains))
+    writer = asyncio.create_task(_write_batches(pool, config, checkpoint, batches, totals, write_failed,
+                                                linked))
+
+    waiting = [t for t in tenants if not backoff.ready(t)]
+    # Even tenants already at high are polled: their lookback may hold late commits
+    polled = [t for t in tenants if backoff.ready(t)]
+
+    async def fetch_all():
+        results = await asyncio.gather(
+            *(_fetch_tenant(pool, t, folders, checkpoint, high, semaphore, pages, page_size, linked)
+              for t in polled),
+            return_exceptions=True)
+        await pages.put(None)
+        return results
+
+    fetching = asyncio.create_task(fetch_all())
+    tasks = (fetching, matcher, writer)
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # The queues are bounded: once the matcher or the writer has failed
+        # nothing drains them, and the fetchers would wait on put forever
+        running = [task for task in tasks if not task.done()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+    for task in (matcher, writer):
+        if not task.cancelled():
+            task.result()
+    results = fetching.result()
+
+    failed = []
+    for tenant, result in zip(polled, results):
+        result = write_failed.get(tenant, result)
+        if isinstance(result, Exception):
+            delay = backoff.failed(tenant)
+            failed.append(tenant)
+            print(f"[CRM-LINKER] ⚠️ Tenant {tenant} failed ({result}), retrying in up to {delay}s")
+        else:
+            backoff.succeeded(tenant)
+
+    if not failed and not waiting:
+        # Every tenant with mail is linked up to high, so new tenants start there
+        checkpoint.advance_all(high)
+    checkpoint.save()
+    return totals[0], totals[1], failed
+
+
+async def main_async(target, config, checkpoint_path, concurrency, once, from_start,
+                     owns_tenant=None, label="CRM-LINKER"):
+    pool = AsyncConnectionPool(lambda: connect(target, config), concurrency + 1)
+    interval = config.get("MonitoringIntervalSeconds", 30)
+    try:
+        started = time.time()
+        index = await pool.run(ContactIndex.load, owns_tenant)
+        print(f"[{label}] 📇 Indexed {len(index)} contact addresses in {time.time() - started:.2f}s")
+
+        checkpoint = Checkpoint.load(checkpoint_path, config.get("LookbackIds", DEFAULT_LOOKBACK_IDS))
+        if not checkpoint.started:
+            checkpoint.floor = 0 if from_start else await pool.run(max_mail_id)
+            checkpoint.save()
+        started = time.time()
+        linked = await pool.run(LinkedMailFilter.load, ENTITY_TYPE_MAIL, owns_tenant)
+        print(f"[{label}] 🧮 Loaded {len(linked)} linked mail ids ({linked.nbytes // 1024} KiB) "
+              f"in {time.time() - started:.2f}s")
+        backoff = TenantBackoff()
+        chains = ChainContacts()
+
+        while True:
+            started = time.time()
+            refreshed = await pool.run(index.refresh)
+            if refreshed:
+                print(f"[{label}] 📇 Re-read {refreshed} changed contact addresses")
+                chains.clear()
+            messages, links, failed = await run_cycle(pool, index, config, checkpoint, backoff,
+                                                      concurrency, owns_tenant=owns_tenant, linked=linked,
+                                                      chains=chains)
+            if messages:
+                print(f"[{label}] ✅ Processed {messages} emails, {links} CRM links created "
+                      f"in {time.time() - started:.2f}s")
+            if once:
+                break
+            await asyncio.sleep(interval)
+    finally:
+        pool.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print("Usage: crm_linker_async.py [--db sqlite:<path>] [--config CrmEmailMonitoringConfig.json]")
+        print("                           [--checkpoint crm_linker_checkpoint.json] [--concurrency N]")
+        print("                           [--from-start] [--once]")
+        return
+
+    def option(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+
+    config = load_config(option("--config"))
+    print("🚀 ONLYOFFICE CRM Email Linker (async)")
+    try:
+        asyncio.run(main_async(option("--db"), config, option("--checkpoint", CHECKPOINT_FILE),
+                               int(option("--concurrency", DEFAULT_CONCURRENCY)),
+                               "--once" in args, "--from-start" in args))
+    except KeyboardInterrupt:
+        print("[CRM-LINKER] 🛑 Stopping monitoring...")
+
+
+if __name__ == "__main__":
+    main()
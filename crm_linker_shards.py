@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Run the CRM linker as N worker processes, each owning a consistent-hash
+slice of the tenants and its own checkpoint file
+"""
+
+import asyncio
+import bisect
+import functools
+import glob
+import hashlib
+import multiprocessing
+import os
+import sys
+
+from crm_checkpoint import CHECKPOINT_FILE, Checkpoint
+from crm_db import load_config
+from crm_linker_async import DEFAULT_CONCURRENCY, main_async
+
+# Points per worker on the ring; more points even out the slices
+VIRTUAL_NODES = 64
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("ascii"), digest_size=8).digest(), "big")
+
+
+class ShardRing:
+    """Consistent-hash ring of workers; changing the worker count only moves
+    the tenants whose ring segment changed hands"""
+
+    def __init__(self, workers, vnodes=VIRTUAL_NODES):
+        self.workers = workers
+        points = sorted((_ring_hash(f"worker-{w}-{v}"), w) for w in range(workers) for v in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [w for _, w in points]
+
+    def owner(self, tenant):
+        index = bisect.bisect(self._hashes, _ring_hash(f"tenant-{tenant}")) % len(self._hashes)
+        return self._owners[index]
+
+
+def shard_checkpoint_path(base, worker):
+    root, ext = os.path.splitext(base)
+    return f"{root}.shard{worker}{ext}"
+
+
+def _existing_checkpoints(base):
+    root, ext = os.path.splitext(base)
+    paths = glob.glob(f"{glob.escape(root)}.shard*{ext}")
+    if os.path.exists(base):
+        # A single-process linker ran before; carry its watermarks over too
+        paths.append(base)
+    return paths
+
+
+def rebalance_checkpoints(base, ring):
+    """Rewrite the per-worker checkpoints for ring's worker count
+
+    Every tenant keeps its watermark, whichever worker used to own it; the
+    shared floor drops to the lowest old floor so no tenant skips mail.
+    Returns the number of tenants that changed worker.
+    """
+    old_paths = _existing_checkpoints(base)
+    watermarks = {}
+    previous_owner = {}
+    floors = []
+    for path in old_paths:
+        checkpoint = Checkpoint.load(path)
+        if checkpoint.started:
+            floors.append(checkpoint.floor)
+        for tenant, mail_id in checkpoint.tenants.items():
+            if mail_id >= watermarks.get(tenant, -1):
+                watermarks[tenant] = mail_id
+                previous_owner[tenant] = path
+    if not old_paths:
+        return 0
+
+    floor = min(floors) if floors else None
+    shards = [Checkpoint(shard_checkpoint_path(base, w), floor=floor) for w in range(ring.workers)]
+    moved = 0
+    for tenant, mail_id in watermarks.items():
+        shard = shards[ring.owner(tenant)]
+        shard.tenants[tenant] = mail_id
+        if previous_owner[tenant] != shard.path:
+            moved += 1
+    for shard in shards:
+        shard.save()
+    # Workers past the new count would otherwise be merged in again next time
+    keep = {shard.path for shard in shards}
+    for path in old_paths:
+        if path not in keep:
+            os.remove(path)
+    return moved
+
+
+def run_worker(worker, workers, target, config_path, base, concurrency, once, from_start):
+    """Process entry point: link, and index the contacts and linked mail of,
+    only the tenants this worker owns"""
+    ring = ShardRing(workers)
+    config = load_config(config_path)
+    label = f"CRM-LINKER {worker + 1}/{workers}"
+    # The linked-mail filter asks once per event row; hash each tenant once
+    owns_tenant = functools.lru_cache(maxsize=None)(lambda tenant: ring.owner(tenant) == worker)
+    try:
+        asyncio.run(main_async(target, config, shard_checkpoint_path(base, worker), concurrency,
+                               once, from_start, owns_tenant=owns_tenant, label=label))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print("Usage: crm_linker_shards.py [--workers N] [--db sqlite:<path>] [--config CrmEmailMonitoringConfig.json]")
+        print("                            [--checkpoint crm_linker_checkpoint.json] [--concurrency N]")
+        print("                            [--from-start] [--once]")
+        return
+
+    def option(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+
+    workers = int(option("--workers", os.cpu_count() or 1))
+    base = option("--checkpoint", CHECKPOINT_FILE)
+    ring = ShardRing(workers)
+
+    moved = rebalance_checkpoints(base, ring)
+    print(f"🚀 ONLYOFFICE CRM Email Linker - {workers} workers ({moved} tenants rebalanced)")
+
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(w, workers, option("--db"), option("--config"), base,
+                  int(option("--concurrency", DEFAULT_CONCURRENCY)), "--once" in args, "--from-start" in args),
+            name=f"crm-linker-{w}")
+        for w in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("[CRM-LINKER] 🛑 Stopping workers...")
+        for process in processes:
+            process.join()
+    return 0 if all(process.exitcode == 0 for process in processes) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+One entry point for the assembly patch scripts: every step as a subcommand,
+plus `pipeline`, which chains them in one process without intermediate files
+"""
+
+import sys
+
+# subcommand -> (module, summary); a module is imported only when its step runs,
+# so --help and single steps do not pay for the others
+COMMANDS = {
+    "rename": ("fix_assembly_name", "make ASC.Mail.dll load as ASC.Mail.Core.dll"),
+    "inject": ("inject_enhanced_crm", "inject the enhanced CRM methods into ASC.Mail.Core.dll"),
+    "smart-inject": ("advanced_injection", "replace method stubs and append the enhanced regions"),
+    "merge": ("create_bridged_assembly", "merge the enhanced CRM code into the original assembly"),
+    "delegate": ("create_runtime_delegate", "insert the runtime delegation markers"),
+    "service": ("create_service_crm_injection", "inject the enhanced CRM logic into the service DLL"),
+    "locate": ("patch_mail_core", "locate the enhanced methods in both assemblies"),
+    "hashes": ("method_hashes", "diff the method bodies of two assemblies"),
+}
+
+
+def usage():
+    print("Usage: crm_patch.py <command> [arguments]")
+    print("       crm_patch.py pipeline <original_core.dll> <enhanced_mail.dll> <output.dll>")
+    print("                    [--steps rename,inject,delegate,validate] [--diff] [--stats]")
+    print("       crm_patch.py watch <original_core.dll> <enhanced_mail.dll> <output.dll>")
+    print("                    [--steps rename,inject,delegate,validate] [--diff] [--interval 0.5] [--verbose]")
+    print("       crm_patch.py validate <assembly.dll> [<enhanced_mail.dll>]")
+    print()
+    print("Commands:")
+    for name, (module, summary) in COMMANDS.items():
+        print(f"  {name:<13} {summary} ({module}.py)")
+    print(f"  {'pipeline':<13} run steps in memory, loading each input once and writing only the output,"
+          " once it validates")
+    print(f"  {'watch':<13} keep both inputs in memory and re-run the pipeline whenever one is rebuilt")
+    print(f"  {'validate':<13} check that an assembly's metadata and method bodies still parse")
+    print()
+    print("Pipeline steps: rename, inject, smart-inject, merge, delegate, validate")
+    print("Run crm_patch.py <command> --help for a command's own arguments.")
+
+
+def run_command(name, args):
+    """Run one script's main() in this process, as if it had been started directly"""
+    import importlib
+
+    module_name = COMMANDS[name][0]
+    module = importlib.import_module(module_name)
+    sys.argv = [f"{module_name}.py"] + args
+    return module.main()
+
+
+def run_pipeline_command(args):
+    from patch_pipeline import DEFAULT_STEPS, PipelineError, run_pipeline
+    from patch_stats import collect_stats
+
+    def option(name, default=None):
+        if name not in args:
+            return default
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    with collect_stats(args, "crm_patch.py pipeline"):
+        steps = option("--steps", ",".join(DEFAULT_STEPS)).split(",")
+        diff_only = "--diff" in args
+        paths = [arg for arg in args if arg != "--diff"]
+        if len(paths) != 3:
+            usage()
+            return 1
+        print(f"🚀 Patch pipeline: {' → '.join(steps)}")
+        try:
+            valid = run_pipeline(paths[0], paths[1], paths[2], steps, diff_only)
+        except PipelineError as e:
+            print(f"❌ Pipeline failed: {e}")
+            return 1
+    return 0 if valid else 1
+
+
+def run_watch_command(args):
+    from patch_pipeline import DEFAULT_STEPS
+    from patch_watch import POLL_INTERVAL, PatchWatcher
+
+    def option(name, default=None):
+        if name not in args:
+            return default
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    steps = option("--steps", ",".join(DEFAULT_STEPS)).split(",")
+    interval = float(option("--interval", POLL_INTERVAL))
+    flags = {"--diff", "--verbose"}
+    paths = [arg for arg in args if arg not in flags]
+    if len(paths) != 3:
+        usage()
+        return 1
+    watcher = PatchWatcher(paths[0], paths[1], paths[2], steps, "--diff" in args, "--verbose" in args)
+    watcher.watch(interval)
+    return 0
+
+
+def run_validate_command(args):
+    from assembly_loader import open_assembly
+    from patch_pipeline import WorkingAssembly, validate_assembly
+
+    if len(args) not in (1, 2):
+        usage()
+        return 1
+    work = WorkingAssembly(open_assembly(args[0]))
+    reference = WorkingAssembly(open_assembly(args[1])) if len(args) == 2 else None
+    try:
+        expected = None
+        if reference is not None:
+            expected = reference.method_hashes
+            if expected is None:
+                print(f"❌ Validate: no readable CLI metadata in {args[1]}")
+                return 1
+        return 0 if validate_assembly(work, expected) else 1
+    finally:
+        work.close()
+        if reference is not None:
+            reference.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] in ("--help", "-h", "help"):
+        usage()
+        return 0 if args else 1
+    command, args = args[0], args[1:]
+    if command == "pipeline":
+        return run_pipeline_command(args)
+    if command == "watch":
+        return run_watch_command(args)
+    if command == "validate":
+        return run_validate_command(args)
+    if command not in COMMANDS:
+        print(f"❌ Unknown command: {command}")
+        usage()
+        return 1
+    return run_command(command, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Cached source file -> assembly index over every .csproj in the tree,
+answering which_dll.sh lookups without re-grepping the repository
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+CACHE_FILE = ".csproj_index.json"
+CACHE_VERSION = 1
+
+# Never holds project files we build from, and walking them is slow
+SKIP_DIRS = {".git", "bin", "obj", "node_modules", "packages", "__pycache__"}
+
+
+def find_projects(root):
+    """Repository-relative paths of every .csproj under root"""
+    projects = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            if name.lower().endswith(".csproj"):
+                projects.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(projects)
+
+
+def _normalize(path):
+    """Comparable form of a repository-relative path"""
+    return os.path.normpath(path.replace("\\", "/")).replace(os.sep, "/").lower()
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_project(root, project, content=None):
+    """Assembly name and compiled sources of one .csproj, as a cache entry"""
+    if content is None:
+        with open(os.path.join(root, project), "rb") as f:
+            content = f.read()
+    project_dir = os.path.dirname(project)
+    project_name = os.path.splitext(os.path.basename(project))[0]
+
+    properties = {}
+    files = []
+    globs = []
+    xml_root = ET.fromstring(content)
+    for element in xml_root.iter():
+        tag = _local(element.tag)
+        if tag in ("AssemblyName", "TargetName") and element.text and element.text.strip():
+            properties.setdefault(tag, element.text.strip())
+        elif tag == "Compile" and element.get("Include"):
+            for include in element.get("Include").split(";"):
+                include = include.strip()
+                if not include or "$(" in include:
+                    continue
+                source = _normalize(os.path.join(project_dir, include.replace("\\", "/")))
+                (globs if any(c in include for c in "*?") else files).append(source)
+
+    # Same precedence as which_dll.sh: AssemblyName, then TargetName, then the project name
+    assembly = properties.get("AssemblyName") or properties.get("TargetName") or project_name
+    assembly = assembly.replace("$(MSBuildProjectName)", project_name)
+
+    return {
+        "assembly": assembly,
+        "files": files,
+        "globs": globs,
+        # SDK-style projects compile every .cs below them unless told otherwise
+        "sdk_dir": _normalize(project_dir) if xml_root.get("Sdk") and not files else None,
+        "hash": hashlib.sha1(content).hexdigest(),
+    }
+
+
+class CsprojIndex:
+    """Reverse index from source file to the assemblies that compile it"""
+
+    def __init__(self, root, projects):
+        self.root = root
+        self.projects = projects
+        self._by_file = {}
+        self._patterns = []
+        for project, entry in sorted(projects.items()):
+            for source in entry["files"]:
+                self._by_file.setdefault(source, []).append(entry["assembly"])
+            for pattern in entry["globs"]:
+                self._patterns.append((pattern, entry["assembly"]))
+            if entry["sdk_dir"] is not None:
+                prefix = entry["sdk_dir"] + "/" if entry["sdk_dir"] != "." else ""
+                self._patterns.append((prefix + "**", entry["assembly"]))
+
+    def lookup(self, source_path):
+        """Assembly names compiling source_path (relative to the root or absolute)"""
+        if os.path.isabs(source_path):
+            source_path = os.path.relpath(source_path, self.root)
+        source = _normalize(source_path)
+        assemblies = list(self._by_file.get(source, []))
+        for pattern, assembly in self._patterns:
+            if fnmatch.fnmatchcase(source, pattern.replace("**/", "*").replace("**", "*")):
+                if assembly not in assemblies:
+                    assemblies.append(assembly)
+        return assemblies
+
+
+def load_index(root=".", cache_path=None):
+    """Build the index, reparsing only the .csproj files that changed
+
+    Entries are reused while a project's mtime and size are unchanged;
+    otherwise its content hash decides. Returns (index, reparsed_count).
+    """
+    if cache_path is None:
+        cache_path = os.path.join(root, CACHE_FILE)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") != CACHE_VERSION:
+            cache = {}
+    except (OSError, ValueError):
+        cache = {}
+    cached = cache.get("projects", {})
+
+    projects = {}
+    reparsed = 0
+    changed = False
+    for project in find_projects(root):
+        st = os.stat(os.path.join(root, project))
+        stamp = [st.st_mtime_ns, st.st_size]
+        entry = cached.get(project)
+        if entry is None or entry.get("stamp") != stamp:
+            changed = True
+            with open(os.path.join(root, project), "rb") as f:
+                content = f.read()
+            if entry is None or entry.get("hash") != hashlib.sha1(content).hexdigest():
+                try:
+                    entry = parse_project(root, project, content)
+                except ET.ParseError as e:
+                    print(f"⚠️ Skipping unparsable {project}: {e}", file=sys.stderr)
+                    continue
+                reparsed += 1
+            entry["stamp"] = stamp
+        projects[project] = entry
+
+    if changed or len(projects) != len(cached):
+        # Write then rename, so an interrupted run never leaves half a cache
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "projects": projects}, f)
+        os.replace(tmp_path, cache_path)
+
+    return CsprojIndex(root, projects), reparsed
+
+
+def main():
+    args = sys.argv[1:]
+    root = "."
+    if "--root" in args:
+        index = args.index("--root")
+        root = args[index + 1]
+        del args[index:index + 2]
+
+    if args:
+        sources = args
+    else:
+        # Same input as which_dll.sh
+        with open(os.path.join(root, "modified-files.txt"), "r", encoding="utf-8") as f:
+            sources = [line.strip() for line in f if line.strip().endswith(".cs")]
+
+    index, _ = load_index(root)
+    lines = set()
+    for source in sources:
+        for assembly in index.lookup(source):
+            lines.add(f"{source} -> {assembly}.dll")
+    for line in sorted(lines):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
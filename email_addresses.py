@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Address normalization for mail headers: RFC 5322 address lists to
+lower-cased, IDNA-encoded addresses, cached per raw header string
+"""
+
+import re
+from email.utils import getaddresses
+from functools import lru_cache
+
+# Distinct raw header strings kept; the same senders repeat constantly
+HEADER_CACHE_SIZE = 65536
+
+# Last resort for headers the RFC parser gives up on (same pattern as the C# monitors)
+_LOOSE_ADDRESS = re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}")
+
+
+def normalize_address(address):
+    """Canonical form of one bare address, or None if it is not one"""
+    address = address.strip().strip("<>").strip()
+    local, at, domain = address.rpartition("@")
+    if not at or not local or not domain:
+        return None
+    domain = domain.rstrip(".").lower()
+    if not domain.isascii():
+        try:
+            domain = domain.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return f"{local.lower()}@{domain}"
+
+
+@lru_cache(maxsize=HEADER_CACHE_SIZE)
+def parse_address_header(header):
+    """Normalized addresses of one raw header value, in order, without duplicates"""
+    if not header:
+        return ()
+    addresses = []
+    for _, raw in getaddresses([header]):
+        address = normalize_address(raw) if raw else None
+        if address and address not in addresses:
+            addresses.append(address)
+    if not addresses and "@" in header:
+        for raw in _LOOSE_ADDRESS.findall(header):
+            address = normalize_address(raw)
+            if address not in addresses:
+                addresses.append(address)
+    return tuple(addresses)
+
+
+def parse_addresses(*headers):
+    """Normalized addresses across several headers, first occurrence wins"""
+    if len(headers) == 1:
+        return list(parse_address_header(headers[0]))
+    addresses = []
+    for header in headers:
+        for address in parse_address_header(header):
+            if address not in addresses:
+                addresses.append(address)
+    return addresses
+
+
+def normalize_rows(rows, columns=(2, 3, 4)):
+    """Addresses of a whole fetched page: one list per row, from the header columns"""
+    return [parse_addresses(*(row[c] for c in columns)) for row in rows]
+
+
+def cache_info():
+    """Hit/miss statistics of the header cache"""
+    return parse_address_header.cache_info()
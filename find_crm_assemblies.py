@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Scan a build output or deployed tree for the assemblies that carry the
+CRM engine, and tell the original build from our enhanced one
+"""
+
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from assembly_loader import open_assembly
+from cli_metadata import read_metadata
+
+ENGINE_MARKERS = [
+    b"CrmLinkEngine",
+    b"ProcessIncomingEmailForCrm",
+    b"LinkChainToCrmEnhanced",
+]
+
+# Strings only our enhanced build contains
+ENHANCED_MARKERS = [
+    b"LinkChainToCrmEnhanced",
+    b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
+    b"Enhanced automatic linking with file uploads",
+]
+
+
+def find_dlls(roots):
+    """Every .dll under roots (files are passed through as they are)"""
+    for root in roots:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.lower().endswith('.dll'):
+                    yield os.path.join(dirpath, name)
+
+
+def scan_assembly(path):
+    """Classify one DLL; returns a report dict, or None if it has no CRM markers"""
+    try:
+        with open_assembly(path) as image:
+            # Almost every DLL in a tree has none of the markers, and a few
+            # memchr-backed finds reject those faster than a full scan
+            markers = [m.decode('utf-8') for m in ENGINE_MARKERS if m in image]
+            if not markers:
+                return None
+
+            enhanced = [m.decode('utf-8') for m in ENHANCED_MARKERS if m in image]
+            # Consumers only reference the engine; the metadata tells us who defines it
+            metadata = read_metadata(image)
+            defines_engine = bool(metadata and metadata.find_types("CrmLinkEngine"))
+            if metadata is not None:
+                metadata.release()
+            return {
+                'path': path,
+                'size': len(image),
+                'markers': markers,
+                'variant': 'enhanced' if enhanced else 'original',
+                'enhanced_markers': enhanced,
+                'defines_engine': defines_engine,
+            }
+    except (OSError, ValueError) as e:
+        return {'path': path, 'error': str(e)}
+
+
+def scan_tree(roots, jobs=None):
+    """Scan every DLL under roots in parallel; returns (reports, dll_count)"""
+    paths = sorted(set(find_dlls(roots)))
+    if jobs == 1 or len(paths) < 2:
+        results = map(scan_assembly, paths)
+        return [r for r in results if r is not None], len(paths)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Many small files: hand them out in batches to keep IPC overhead low
+        chunksize = max(1, len(paths) // ((jobs or os.cpu_count() or 1) * 8))
+        results = pool.map(scan_assembly, paths, chunksize=chunksize)
+        return [r for r in results if r is not None], len(paths)
+
+
+def print_report(reports, dll_count):
+    print(f"📊 Scanned {dll_count} assemblies, {len(reports)} mention the CRM engine")
+    for report in reports:
+        if 'error' in report:
+            print(f"  ⚠️ {report['path']}: {report['error']}")
+            continue
+        icon = "✨" if report['variant'] == 'enhanced' else "📦"
+        role = "defines CrmLinkEngine" if report['defines_engine'] else "references it"
+        print(f"  {icon} {report['variant']:8} {report['path']} ({report['size']:,} bytes, {role})")
+        print(f"      markers: {', '.join(report['markers'])}")
+
+
+def main():
+    args = sys.argv[1:]
+    as_json = '--json' in args
+    jobs = None
+    if '--jobs' in args:
+        index = args.index('--jobs')
+        jobs = int(args[index + 1])
+        del args[index:index + 2]
+    roots = [arg for arg in args if arg != '--json']
+
+    if not roots:
+        print("Usage: find_crm_assemblies.py [--json] [--jobs N] <tree_or_dll>...")
+        return 2
+
+    reports, dll_count = scan_tree(roots, jobs)
+    if as_json:
+        json.dump({'scanned': dll_count, 'assemblies': reports}, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(reports, dll_count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
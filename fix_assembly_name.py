@@ -6,62 +6,54 @@ Fix assembly name in ASC.Mail.dll to make it work as ASC.Mail.Core.dll
 import sys
 import struct
 
-def fix_assembly_name(dll_path, output_path):
-    """Replace ASC.Mail with ASC.Mail.Core in assembly metadata"""
-    
-    with open(dll_path, 'rb') as f:
-        data = bytearray(f.read())
-    
-    # Replace all occurrences of "ASC.Mail" with "ASC.Mail.Core"
-    # But be careful not to replace "ASC.Mail.Core" or longer strings
-    
-    original = b"ASC.Mail\x00"  # Null-terminated string
-    replacement = b"ASC.Mail.Core\x00"
-    
-    # Find and replace assembly name references
-    replacements = 0
-    start = 0
-    
-    while True:
-        pos = data.find(original, start)
-        if pos == -1:
-            break
-            
-        # Check if it's not already "ASC.Mail.Core"
-        if pos + len(original) < len(data) and data[pos + len(original) - 1:pos + len(original) + 5] != b".Core":
-            # Replace this occurrence
-            data[pos:pos + len(original)] = replacement
-            replacements += 1
-            print(f"Replaced ASC.Mail with ASC.Mail.Core at position {pos}")
-            start = pos + len(replacement)
-        else:
-            start = pos + 1
-    
-    # Also fix module name if present
-    module_original = b"ASC.Mail.dll\x00"
-    module_replacement = b"ASC.Mail.Core.dll\x00"
-    
-    start = 0
-    while True:
-        pos = data.find(module_original, start)
-        if pos == -1:
-            break
-        data[pos:pos + len(module_original)] = module_replacement
-        replacements += 1
-        print(f"Replaced module name at position {pos}")
-        start = pos + len(module_replacement)
-    
-    print(f"Made {replacements} replacements")
+from assembly_loader import open_assembly
+from patch_plan import plan_substitutions
+from patch_stats import with_stats
+
+# Every rename, applied together in one pass over the assembly
+ASSEMBLY_RENAMES = {
+    b"ASC.Mail\x00": b"ASC.Mail.Core\x00",          # Null-terminated assembly name
+    b"ASC.Mail.dll\x00": b"ASC.Mail.Core.dll\x00",  # Module name
+}
+
+RENAME_MESSAGES = {
+    b"ASC.Mail\x00": "Replaced ASC.Mail with ASC.Mail.Core",
+    b"ASC.Mail.dll\x00": "Replaced module name",
+}
+
+def fix_assembly_name(dll_path, output_path, renames=ASSEMBLY_RENAMES):
+    """Replace ASC.Mail with ASC.Mail.Core in assembly metadata
+
+    Returns the OffsetRemap from input to output offsets, so heap offsets
+    can be fixed up later without parsing the output again.
+    """
     
-    # Write the fixed assembly
-    with open(output_path, 'wb') as f:
-        f.write(data)
+    with open_assembly(dll_path) as data:
+        plan = plan_assembly_rename(data, renames)
+        
+        # Write the fixed assembly in a single streaming pass
+        plan.write(data, output_path)
     
     print(f"Created fixed assembly: {output_path}")
+    return plan.remap()
 
-if __name__ == "__main__":
+def plan_assembly_rename(data, renames=ASSEMBLY_RENAMES, hits=None):
+    """PatchPlan applying renames to data; hits may be a marker scan of data"""
+    plan, applied = plan_substitutions(data, renames, hits)
+    for pos, pattern in applied:
+        print(f"{RENAME_MESSAGES.get(pattern, 'Replaced ' + repr(pattern))} at position {pos}")
+    
+    print(f"Made {len(applied)} replacements")
+    return plan
+
+@with_stats
+def main():
     if len(sys.argv) != 3:
-        print("Usage: fix_assembly_name.py <input.dll> <output.dll>")
-        sys.exit(1)
+        print("Usage: fix_assembly_name.py [--stats] <input.dll> <output.dll>")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
+        return 1
     
-    fix_assembly_name(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    fix_assembly_name(sys.argv[1], sys.argv[2])
+
+if __name__ == "__main__":
+    sys.exit(main())
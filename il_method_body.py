@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+IL method body parsing (ECMA-335 II.25.4): tiny and fat headers plus the
+extra data sections, so a method body can be sliced out exactly
+"""
+
+import struct
+from collections import namedtuple
+
+import patch_stats
+
+TINY_FORMAT = 0x2
+FAT_FORMAT = 0x3
+FORMAT_MASK = 0x3
+MORE_SECTS = 0x8
+INIT_LOCALS = 0x10
+
+SECTION_EH_TABLE = 0x01
+SECTION_FAT_FORMAT = 0x40
+SECTION_MORE_SECTS = 0x80
+
+MethodBody = namedtuple(
+    'MethodBody',
+    'offset header_size code_size max_stack local_var_sig_token init_locals sections_size size')
+
+
+class MethodBodyError(ValueError):
+    """Raised when the bytes at an offset are not a valid IL method body"""
+
+
+def read_method_body(data, offset):
+    """Parse the method header at offset and measure the whole body"""
+    view = memoryview(getattr(data, 'view', data))
+    try:
+        first = view[offset]
+        kind = first & FORMAT_MASK
+
+        if kind == TINY_FORMAT:
+            code_size = first >> 2
+            body = MethodBody(offset, 1, code_size, 8, 0, False, 0, 1 + code_size)
+        elif kind == FAT_FORMAT:
+            flags_and_size, max_stack, code_size, local_sig = struct.unpack_from('<HHII', view, offset)
+            flags = flags_and_size & 0x0FFF
+            header_size = (flags_and_size >> 12) * 4
+            if header_size < 12:
+                raise MethodBodyError(f"fat header at {offset} declares {header_size} bytes")
+
+            end = offset + header_size + code_size
+            sections_size = 0
+            more = flags & MORE_SECTS
+            while more:
+                # Extra sections start on the next 4-byte boundary
+                section = (end + 3) & ~3
+                section_kind = view[section]
+                if section_kind & SECTION_FAT_FORMAT:
+                    data_size = int.from_bytes(view[section + 1:section + 4], 'little')
+                else:
+                    data_size = view[section + 1]
+                if data_size < 4:
+                    raise MethodBodyError(f"method data section at {section} declares {data_size} bytes")
+                end = section + data_size
+                sections_size = end - (offset + header_size + code_size)
+                more = section_kind & SECTION_MORE_SECTS
+
+            body = MethodBody(offset, header_size, code_size, max_stack, local_sig,
+                              bool(flags & INIT_LOCALS), sections_size, end - offset)
+        else:
+            raise MethodBodyError(f"no IL method header at {offset} (first byte 0x{first:02X})")
+    except (IndexError, struct.error):
+        raise MethodBodyError(f"method body at {offset} runs past the end of the image") from None
+
+    if offset + body.size > len(view):
+        raise MethodBodyError(f"method body at {offset} runs past the end of the image")
+    return body
+
+
+def method_body_bytes(data, body):
+    """Zero-copy view of exactly the bytes of a parsed body"""
+    view = memoryview(getattr(data, 'view', data))
+    return view[body.offset:body.offset + body.size]
+
+
+def method_code(data, body):
+    """Zero-copy view of just the IL instruction stream of a body"""
+    view = memoryview(getattr(data, 'view', data))
+    start = body.offset + body.header_size
+    return view[start:start + body.code_size]
+
+
+def extract_method_body(data, method):
+    """(view, MethodBody) for a cli_metadata.MethodInfo, or (None, None) without IL"""
+    if method is None or method.offset is None:
+        return None, None
+    with patch_stats.phase("extract"):
+        body = read_method_body(data, method.offset)
+        return method_body_bytes(data, body), body
+
+
+def transplant_method_body(target, target_method, source, source_method):
+    """Copy source's body over target's when it fits in the target's space
+
+    Returns (copied, source_size, target_size); nothing is written when the
+    source body is larger, so the methods laid out after it stay intact.
+    """
+    with patch_stats.phase("patch"):
+        source_bytes, _ = extract_method_body(source, source_method)
+        _, target_body = extract_method_body(target, target_method)
+        if len(source_bytes) > target_body.size:
+            return False, len(source_bytes), target_body.size
+        target.overwrite(target_body.offset, source_bytes)
+        return True, len(source_bytes), target_body.size
@@ -6,32 +6,54 @@ Inject enhanced CRM functionality from ASC.Mail.dll into original ASC.Mail.Core.
 import sys
 import os
 
-def extract_method_region(dll_data, method_signature):
+from assembly_loader import open_assembly
+from cli_metadata import locate_method, read_metadata
+from il_method_body import extract_method_body, transplant_method_body
+from patch_stats import with_stats
+from pattern_scanner import scan_crm_markers
+
+def extract_method_region(dll_data, method_signature, hits=None, metadata=None):
     """Extract a method and its surrounding IL code region"""
+    # Real methods resolve through the metadata tables to exactly their body
+    method = locate_method(metadata, method_signature)
+    if method is not None:
+        region, _ = extract_method_body(dll_data, method)
+        return region, method.offset
+    
     method_bytes = method_signature.encode('utf-8')
     
     # Find method signature
-    pos = dll_data.find(method_bytes)
+    if hits is None:
+        hits = scan_crm_markers(dll_data, patterns=[method_bytes], first_only=True)
+    pos = hits.first(method_bytes)
     if pos == -1:
         return None, None
     
     # Extract a region around the method (this is simplified - real IL would need proper parsing)
-    start = max(0, pos - 2048)  # 2KB before
-    end = min(len(dll_data), pos + 4096)  # 4KB after
-    
-    return dll_data[start:end], start
+    # 2KB before, 4KB after; returned as a view into the mapped image
+    return dll_data.window(pos, 2048, 4096)
 
 def inject_enhanced_methods(original_dll, enhanced_dll, output_dll):
     """Inject enhanced CRM methods from enhanced_dll into original_dll"""
     
     print(f"Loading original ASC.Mail.Core.dll ({original_dll})...")
-    with open(original_dll, 'rb') as f:
-        original_data = bytearray(f.read())
-    
     print(f"Loading enhanced ASC.Mail.dll ({enhanced_dll})...")  
-    with open(enhanced_dll, 'rb') as f:
-        enhanced_data = f.read()
+    with open_assembly(original_dll, copy_on_write=True) as original_data, \
+            open_assembly(enhanced_dll) as enhanced_data:
+        plan = plan_enhanced_methods(original_data, enhanced_data)
+        
+        # Write the hybrid assembly
+        plan.write(original_data, output_dll)
     
+    print(f"✅ Created hybrid assembly: {output_dll}")
+
+def plan_enhanced_methods(original_data, enhanced_data, original_hits=None, enhanced_hits=None,
+                          original_metadata=None, enhanced_metadata=None):
+    """Patch method bodies in original_data and plan the string inserts
+
+    Scan hits and metadata already at hand may be passed in; returns the
+    PatchPlan to write original_data through.
+    """
     print(f"Original size: {len(original_data):,} bytes")
     print(f"Enhanced size: {len(enhanced_data):,} bytes")
     
@@ -44,23 +66,63 @@ def inject_enhanced_methods(original_dll, enhanced_dll, output_dll):
         "Enhanced automatic linking"
     ]
     
+    # Also inject our enhanced debug strings
+    debug_strings = [
+        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
+        b"DEBUG: CRM conditions met - starting auto-processing", 
+        b"Enhanced automatic linking with file uploads",
+        b"LinkChainToCrmEnhanced"
+    ]
+    
     injection_count = 0
+    # Every edit is planned first and the output written in a single pass
+    plan = original_data.plan()
+    
+    # Scan both assemblies once, before anything in the original is patched,
+    # for just the markers looked up below
+    if original_hits is None:
+        method_bases = [(method.split()[0] if " " in method else method).encode('utf-8') for method in enhanced_methods]
+        original_hits = scan_crm_markers(original_data, patterns=method_bases + [b"DEBUG"], first_only=True)
+    if enhanced_hits is None:
+        enhanced_hits = scan_crm_markers(enhanced_data,
+                                         patterns=[method.encode('utf-8') for method in enhanced_methods] + debug_strings,
+                                         first_only=True)
+    if original_metadata is None:
+        original_metadata = read_metadata(original_data)
+    if enhanced_metadata is None:
+        enhanced_metadata = read_metadata(enhanced_data)
     
     # Look for enhanced patterns and try to inject them
     for method in enhanced_methods:
         print(f"\nLooking for enhanced method/pattern: {method}")
         
         # Find in enhanced DLL
-        enhanced_region, enhanced_pos = extract_method_region(enhanced_data, method)
+        enhanced_region, enhanced_pos = extract_method_region(enhanced_data, method, enhanced_hits, enhanced_metadata)
         
-        if enhanced_region:
+        if enhanced_region is not None:
             print(f"  Found in enhanced DLL at position {enhanced_pos}")
             
             # Look for similar pattern in original to replace
             method_base = method.split()[0] if " " in method else method
-            original_pos = original_data.find(method_base.encode('utf-8'))
+            original_method = locate_method(original_metadata, method_base)
+            if original_method is not None:
+                original_pos = original_method.offset
+            else:
+                original_pos = original_hits.first(method_base.encode('utf-8'))
             
-            if original_pos != -1:
+            enhanced_method = locate_method(enhanced_metadata, method)
+            if original_method is not None and enhanced_method is not None:
+                # Both sides are parsed method bodies: swap them only when the
+                # enhanced body fits, so neighbouring methods stay intact
+                print(f"  Found original body at {original_pos}")
+                copied, new_size, old_size = transplant_method_body(original_data, original_method,
+                                                                    enhanced_data, enhanced_method)
+                if copied:
+                    injection_count += 1
+                    print(f"  ✅ Injected {new_size}-byte enhanced method body")
+                else:
+                    print(f"  ⚠️ Cannot inject - enhanced body is {new_size} bytes, original has {old_size}")
+            elif original_pos != -1:
                 print(f"  Found target location in original at {original_pos}")
                 
                 # Simple replacement approach - replace a chunk around the method
@@ -70,7 +132,7 @@ def inject_enhanced_methods(original_dll, enhanced_dll, output_dll):
                 # Make sure we don't go out of bounds
                 if original_pos + chunk_size <= len(original_data):
                     # Replace the region
-                    original_data[original_pos:original_pos + chunk_size] = enhanced_region[:chunk_size]
+                    original_data.overwrite(original_pos, enhanced_region[:chunk_size])
                     injection_count += 1
                     print(f"  ✅ Injected {chunk_size} bytes of enhanced code")
                 else:
@@ -80,39 +142,33 @@ def inject_enhanced_methods(original_dll, enhanced_dll, output_dll):
         else:
             print(f"  ℹ️ Not found in enhanced DLL")
     
-    # Also inject our enhanced debug strings
-    debug_strings = [
-        b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
-        b"DEBUG: CRM conditions met - starting auto-processing", 
-        b"Enhanced automatic linking with file uploads",
-        b"LinkChainToCrmEnhanced"
-    ]
-    
+    debug_inserts = []
     for debug_str in debug_strings:
-        if debug_str in enhanced_data and debug_str not in original_data:
+        if debug_str in enhanced_hits and debug_str not in original_data:
             # Find a good place to inject the string (near other debug strings)
-            debug_pos = original_data.find(b"DEBUG")
+            debug_pos = original_hits.first(b"DEBUG")
             if debug_pos != -1:
                 # Insert the new debug string nearby
-                insertion_point = debug_pos + 100
-                original_data[insertion_point:insertion_point] = debug_str + b'\x00'
+                insertion_point = min(debug_pos + 100, len(original_data))
+                debug_inserts.append((insertion_point, debug_str + b'\x00'))
                 injection_count += 1
                 print(f"  ✅ Injected debug string: {debug_str.decode('utf-8', errors='ignore')}")
+    # Inserted in place, each string went ahead of the ones before it at the
+    # same point; plan them in reverse so the bytes come out in that order
+    for insertion_point, data in reversed(debug_inserts):
+        plan.insert(insertion_point, data)
     
     print(f"\n📊 Summary:")
     print(f"  Total injections: {injection_count}")
-    print(f"  Final size: {len(original_data):,} bytes")
-    
-    # Write the hybrid assembly
-    with open(output_dll, 'wb') as f:
-        f.write(original_data)
-    
-    print(f"✅ Created hybrid assembly: {output_dll}")
+    print(f"  Final size: {plan.output_size():,} bytes")
+    return plan
 
+@with_stats
 def main():
     if len(sys.argv) != 4:
-        print("Usage: inject_enhanced_crm.py <original_core.dll> <enhanced_mail.dll> <output.dll>")
+        print("Usage: inject_enhanced_crm.py [--stats] <original_core.dll> <enhanced_mail.dll> <output.dll>")
         print("  Creates hybrid DLL with enhanced CRM functionality injected into original")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
         return
     
     original_dll = sys.argv[1]
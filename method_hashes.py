@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Per-method content hashing, used to patch only the methods that changed
+between the original and the enhanced assembly
+"""
+
+import hashlib
+import sys
+from collections import namedtuple
+
+from assembly_loader import open_assembly
+from cli_metadata import read_metadata
+from il_method_body import MethodBodyError, extract_method_body
+import patch_stats
+
+MethodDiff = namedtuple('MethodDiff', 'changed added removed unchanged')
+
+
+def method_key(method, overload=0):
+    """Stable name for a method across builds: Namespace.Type::Method[#n]"""
+    type_name = f"{method.namespace}.{method.type_name}" if method.namespace else method.type_name
+    key = f"{type_name}::{method.name}"
+    return f"{key}#{overload}" if overload else key
+
+
+def hash_method_bodies(data, metadata=None, type_name=None):
+    """Map every method with an IL body to a digest of its exact body bytes
+
+    With type_name, only the methods of the types of that name are hashed.
+    """
+    if metadata is None:
+        metadata = read_metadata(data)
+    if metadata is None:
+        return None
+
+    if type_name is None:
+        methods = metadata.iter_methods()
+    else:
+        methods = (method for type_row in metadata.find_types(type_name)
+                   for method in metadata.methods_of(type_row))
+    hashes = {}
+    overloads = {}
+    for method in methods:
+        if method.offset is None:
+            continue
+        try:
+            body, _ = extract_method_body(data, method)
+        except MethodBodyError:
+            continue
+        # Overloads share a name, so number them in declaration order
+        key = method_key(method)
+        overload = overloads.get(key, 0)
+        overloads[key] = overload + 1
+        if overload:
+            key = method_key(method, overload)
+        hashes[key] = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return hashes
+
+
+def diff_method_hashes(original_hashes, enhanced_hashes):
+    """Compare two hash maps from hash_method_bodies"""
+    changed = sorted(k for k in original_hashes.keys() & enhanced_hashes.keys()
+                     if original_hashes[k] != enhanced_hashes[k])
+    added = sorted(enhanced_hashes.keys() - original_hashes.keys())
+    removed = sorted(original_hashes.keys() - enhanced_hashes.keys())
+    unchanged = len(original_hashes.keys() & enhanced_hashes.keys()) - len(changed)
+    return MethodDiff(changed, added, removed, unchanged)
+
+
+def diff_assemblies(original, enhanced, original_metadata=None, enhanced_metadata=None, type_name=None):
+    """MethodDiff between two assembly images, or None without CLI metadata
+
+    With type_name, only the methods of the types of that name are compared.
+    """
+    with patch_stats.phase("diff"):
+        original_hashes = hash_method_bodies(original, original_metadata, type_name)
+        enhanced_hashes = hash_method_bodies(enhanced, enhanced_metadata, type_name)
+    if original_hashes is None or enhanced_hashes is None:
+        return None
+    return diff_method_hashes(original_hashes, enhanced_hashes)
+
+
+def differing_method_names(diff, type_name="CrmLinkEngine"):
+    """Bare names of type_name's methods that are new or changed"""
+    names = set()
+    for key in diff.changed + diff.added:
+        owner, method = key.split('::', 1)
+        if owner == type_name or owner.endswith('.' + type_name):
+            names.add(method.split('#', 1)[0])
+    return names
+
+
+def print_method_diff(diff, limit=20):
+    """Report a MethodDiff in the patch scripts' usual format"""
+    print(f"📊 Method diff: {len(diff.changed)} changed, {len(diff.added)} added, "
+          f"{len(diff.removed)} removed, {diff.unchanged} unchanged")
+    for label, keys in (("~", diff.changed), ("+", diff.added), ("-", diff.removed)):
+        for key in keys[:limit]:
+            print(f"  {label} {key}")
+        if len(keys) > limit:
+            print(f"  {label} ... {len(keys) - limit} more")
+
+
+@patch_stats.with_stats
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: method_hashes.py [--stats] <original.dll> <enhanced.dll>")
+        return 2
+
+    with open_assembly(sys.argv[1]) as original, open_assembly(sys.argv[2]) as enhanced:
+        diff = diff_assemblies(original, enhanced)
+
+    if diff is None:
+        print("❌ Both inputs must be .NET assemblies with CLI metadata")
+        return 2
+
+    print_method_diff(diff)
+    return 1 if diff.changed or diff.added or diff.removed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,46 +8,43 @@ import struct
 import sys
 import os
 
-def find_method_in_assembly(dll_path, method_name):
-    """Find method signature in .NET assembly"""
-    with open(dll_path, 'rb') as f:
-        data = f.read()
-    
-    # Look for method name in the assembly
-    method_bytes = method_name.encode('utf-8')
-    positions = []
-    start = 0
-    while True:
-        pos = data.find(method_bytes, start)
-        if pos == -1:
-            break
-        positions.append(pos)
-        start = pos + 1
-    
-    return positions
+from assembly_loader import open_assembly
+from cli_metadata import locate_method, read_metadata
+from il_method_body import extract_method_body
+from patch_stats import with_stats
+from pattern_scanner import PatternScanner, scan_chunk_size
+
+def find_methods_in_assembly(dll, method_names, chunk_size=None):
+    """Find every method signature in .NET assembly with a single pass"""
+    # Look for all method names in the assembly at once; large bundles are
+    # read in fixed-size chunks so memory does not grow with the file
+    scanner = PatternScanner(name.encode('utf-8') for name in method_names)
+    hits = scanner.scan_all(dll, chunk_size=scan_chunk_size(dll, chunk_size))
+    return {name: hits.positions(name.encode('utf-8')) for name in method_names}
 
-def extract_method_il(dll_path, method_name):
+def extract_method_il(dll, method_name, pos=None, metadata=None):
     """Extract IL bytecode for a specific method"""
-    # This would require full PE/COFF parsing for .NET assemblies
-    # For now, let's use a simpler string replacement approach
+    # Resolve CrmLinkEngine::method through the metadata tables to exactly its body
+    method = locate_method(metadata, method_name)
+    if method is not None:
+        body_bytes, _ = extract_method_body(dll, method)
+        return body_bytes, method.offset
     
-    with open(dll_path, 'rb') as f:
-        data = f.read()
-    
-    # Find the method and extract surrounding context
-    method_bytes = method_name.encode('utf-8')
-    pos = data.find(method_bytes)
+    # Not a readable CLI image: fall back to the context around the name string
+    # Find the method (unless the caller already has its position) and extract surrounding context
+    if pos is None:
+        pos = dll.find(method_name.encode('utf-8'))
     if pos != -1:
         # Extract ~1KB around the method for context
-        start = max(0, pos - 512)
-        end = min(len(data), pos + 512)
-        return data[start:end], start
+        return dll.window(pos, 512, 512)
     
     return None, None
 
+@with_stats
 def main():
     if len(sys.argv) != 4:
-        print("Usage: patch_mail_core.py <original_core.dll> <enhanced_mail.dll> <output.dll>")
+        print("Usage: patch_mail_core.py [--stats] <original_core.dll> <enhanced_mail.dll> <output.dll>")
+        print("  --stats  print phase timings, byte counts and pattern hits as JSON (or --stats-file PATH, --profile PATH)")
         return
     
     original_dll = sys.argv[1]
@@ -62,34 +59,43 @@ def main():
         "LinkChainToCrmEnhanced"
     ]
     
-    # Copy original to output
-    with open(original_dll, 'rb') as f:
-        original_data = bytearray(f.read())
-    
-    print(f"Original size: {len(original_data)} bytes")
-    
-    # For each enhanced method, try to find and replace
-    for method in enhanced_methods:
-        print(f"Looking for method: {method}")
+    # Map both assemblies once; every lookup below reuses the same mapping
+    with open_assembly(original_dll) as original, open_assembly(enhanced_dll) as enhanced:
+        print(f"Original size: {len(original)} bytes")
         
-        # Find in original
-        orig_positions = find_method_in_assembly(original_dll, method)
-        enhanced_positions = find_method_in_assembly(enhanced_dll, method)
+        original_methods = find_methods_in_assembly(original, enhanced_methods)
+        enhanced_methods_found = find_methods_in_assembly(enhanced, enhanced_methods)
+        original_metadata = read_metadata(original)
+        enhanced_metadata = read_metadata(enhanced)
         
-        print(f"  Original positions: {orig_positions}")
-        print(f"  Enhanced positions: {enhanced_positions}")
-        
-        if orig_positions and enhanced_positions:
-            print(f"  Found {method} in both assemblies")
+        # For each enhanced method, try to find and replace
+        for method in enhanced_methods:
+            print(f"Looking for method: {method}")
             
-            # Extract method context from enhanced DLL
-            enhanced_context, context_start = extract_method_il(enhanced_dll, method)
-            if enhanced_context:
-                print(f"  Extracted {len(enhanced_context)} bytes of context")
-    
-    # Write patched output
-    with open(output_dll, 'wb') as f:
-        f.write(original_data)
+            # Find in original
+            orig_positions = original_methods[method]
+            enhanced_positions = enhanced_methods_found[method]
+            
+            print(f"  Original positions: {orig_positions}")
+            print(f"  Enhanced positions: {enhanced_positions}")
+            
+            for label, metadata in (("Original", original_metadata), ("Enhanced", enhanced_metadata)):
+                resolved = locate_method(metadata, method)
+                if resolved is not None:
+                    _, body = extract_method_body(original if label == "Original" else enhanced, resolved)
+                    print(f"  {label} body: RVA 0x{resolved.rva:X}, file offset {resolved.offset}, "
+                          f"{body.size} bytes ({body.code_size} bytes of IL)")
+            
+            if orig_positions and enhanced_positions:
+                print(f"  Found {method} in both assemblies")
+                
+                # Extract method context from enhanced DLL
+                enhanced_context, context_start = extract_method_il(enhanced, method, enhanced_positions[0], enhanced_metadata)
+                if enhanced_context is not None:
+                    print(f"  Extracted {len(enhanced_context)} bytes of context")
+        
+        # Write patched output
+        original.save(output_dll)
     
     print(f"Created patched assembly: {output_dll}")
 
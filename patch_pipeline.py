@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+In-memory patch pipeline: rename, inject, delegate and validate steps run on
+assemblies loaded once, each step getting the previous step's buffer, marker
+hits and metadata instead of a file to re-read and re-scan
+"""
+
+import bisect
+
+from assembly_loader import BufferImage, open_assembly
+from cli_metadata import MetadataError, read_metadata
+from patch_plan import OffsetRemap
+from pattern_scanner import ScanResult, crm_marker_scanner, scan_crm_markers
+
+# Steps that patch the original assembly; rename prepares the enhanced one
+ORIGINAL_STEPS = ("inject", "smart-inject", "merge", "delegate")
+STEPS = ("rename",) + ORIGINAL_STEPS + ("validate",)
+DEFAULT_STEPS = ("rename", "inject", "delegate", "validate")
+
+_UNREAD = object()
+
+
+class PipelineError(RuntimeError):
+    """Raised when a step cannot produce its output"""
+
+
+class WorkingAssembly:
+    """An assembly moving through the pipeline, with its marker hits,
+    metadata and method hashes computed on first use and carried from step
+    to step"""
+
+    def __init__(self, image, hits=None):
+        self.image = image
+        self._hits = hits
+        self._metadata = _UNREAD
+        self._method_hashes = _UNREAD
+
+    @property
+    def hits(self):
+        if self._hits is None:
+            self._hits = scan_crm_markers(self.image)
+        return self._hits
+
+    @property
+    def metadata(self):
+        if self._metadata is _UNREAD:
+            self._metadata = read_metadata(self.image)
+        return self._metadata
+
+    @property
+    def method_hashes(self):
+        if self._method_hashes is _UNREAD:
+            from method_hashes import hash_method_bodies
+            self._method_hashes = hash_method_bodies(self.image, self.metadata)
+        return self._method_hashes
+
+    def commit(self, plan):
+        """Make plan, and whatever the image overwrote, part of the image
+
+        Overwrites alone leave the buffer in place; edits that move bytes
+        build a new in-memory image. Marker hits are carried over and only
+        the bytes around each edit are scanned again. Metadata is kept
+        unless bytes moved or an edit touched the headers or the metadata;
+        method hashes are always recomputed.
+        """
+        edits = plan.resolve(self.image)
+        if not edits:
+            return
+        self._method_hashes = _UNREAD
+        moved = any(len(edit.data) != edit.length for edit in edits)
+        image = self.image
+        if moved:
+            patched, edits = plan.apply(image)
+            image = BufferImage(patched, getattr(image, 'name', None) or image.path)
+
+        if self._hits is not None:
+            self._hits = carry_hits(self._hits, edits, image)
+        if self._metadata is not _UNREAD and (moved or _touches_metadata(self._metadata, edits)):
+            if self._metadata is not None:
+                self._metadata.release()
+            self._metadata = _UNREAD
+        if moved:
+            self.image.close()
+            self.image = image
+        elif isinstance(image, BufferImage):
+            # The buffer already holds the overwrites
+            image._dirty = []
+
+    def save(self, output_path):
+        return self.image.save(output_path)
+
+    def close(self):
+        if self._metadata not in (_UNREAD, None):
+            self._metadata.release()
+        self.image.close()
+
+
+def _touched(edits, starts, start, end):
+    """Whether any edit changes a byte of [start, end) or inserts inside it
+
+    Only the last edit starting before end can: edits do not overlap, so
+    every earlier one ends at or before that edit's offset.
+    """
+    index = bisect.bisect_left(starts, end) - 1
+    if index < 0:
+        return False
+    edit = edits[index]
+    if edit.length:
+        return edit.offset + edit.length > start
+    return edit.offset > start
+
+
+def carry_hits(hits, edits, image, scanner=None):
+    """ScanResult for image, the result of applying edits to the image hits
+    came from: untouched matches move to their new offsets, and only the
+    bytes around each edit are scanned again"""
+    scanner = scanner or crm_marker_scanner()
+    remap = OffsetRemap(edits)
+    starts = [edit.offset for edit in edits]
+    result = ScanResult(scanner.patterns)
+    for pattern, positions in hits.hits.items():
+        if pattern in result.hits:
+            result.hits[pattern] = [remap(offset) for offset in positions
+                                    if not _touched(edits, starts, offset, offset + len(pattern))]
+
+    # Any match overlapping an edit lies within longest - 1 bytes of it
+    margin = scanner.longest - 1
+    windows = []
+    shift = 0
+    for edit in edits:
+        start = edit.offset + shift
+        windows.append((max(0, start - margin), min(len(image), start + len(edit.data) + margin)))
+        shift += len(edit.data) - edit.length
+    # Overlapping windows are scanned as one, so no match straddles a seam
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    seen = {pattern: set(positions) for pattern, positions in result.hits.items()}
+    for start, end in merged:
+        for offset, pattern in scanner.scan(image, start, end):
+            if offset not in seen[pattern]:
+                seen[pattern].add(offset)
+                result.hits[pattern].append(offset)
+    for positions in result.hits.values():
+        positions.sort()
+    return result
+
+
+def _touches_metadata(metadata, edits):
+    """Whether edits change the PE headers or the metadata of an image"""
+    if metadata is None:
+        return False
+    headers_end = min((section.raw_pointer for section in metadata.sections), default=0)
+    protected = [(0, headers_end), (metadata.metadata_offset, metadata.metadata_offset + metadata.metadata_size)]
+    return any(edit.offset < end and start < edit.offset + max(edit.length, 1)
+               for edit in edits for start, end in protected)
+
+
+def validate_assembly(work, expected=None):
+    """Check that work still parses and its method bodies read back
+
+    With expected (the enhanced assembly's method hashes), also report which
+    CrmLinkEngine bodies now match it. Returns True only when the CLI
+    metadata is readable, every method body parses and, with expected,
+    every CrmLinkEngine method of expected is in the output with a body
+    that parses.
+    """
+    metadata = work.metadata
+    if metadata is None:
+        print("❌ Validate: no readable CLI metadata in the output")
+        return False
+    try:
+        hashes = work.method_hashes
+        with_body = sum(1 for method in metadata.iter_methods() if method.offset is not None)
+    except MetadataError as e:
+        print(f"❌ Validate: the output's metadata is damaged ({e})")
+        return False
+    valid = len(hashes) == with_body
+    print(f"{'✅' if valid else '❌'} Validate: CLI metadata readable, "
+          f"{len(hashes)} of {with_body} method bodies parse")
+    if expected is not None:
+        for key in sorted(k for k in expected if k.split('::', 1)[0].endswith("CrmLinkEngine")):
+            if key not in hashes:
+                print(f"  ❌ {key} is missing from the output or its body does not parse")
+                valid = False
+            elif hashes[key] == expected[key]:
+                print(f"  ✅ {key} matches the enhanced body")
+            else:
+                print(f"  ℹ️ {key} differs from the enhanced body")
+    return valid
+
+
+def run_steps(original, enhanced, steps=DEFAULT_STEPS, diff_only=False, expected=None):
+    """Run steps in order on two WorkingAssembly objects
+
+    rename works on the enhanced DLL, which the later steps then take their
+    code from; inject, smart-inject, merge and delegate patch the original.
+    validate checks the patched original against expected, the enhanced
+    DLL's method hashes, taken before rename since a rename can leave the
+    metadata unreadable (read here when not given).
+    Returns (target, valid): the patched original, or the renamed enhanced
+    DLL when no step patches the original, and False if validation failed.
+    """
+    unknown = [step for step in steps if step not in STEPS]
+    if unknown:
+        raise PipelineError(f"unknown steps: {', '.join(unknown)}")
+
+    target = original if any(step in ORIGINAL_STEPS for step in steps) else enhanced
+    if expected is None and target is original and "validate" in steps:
+        expected = enhanced.method_hashes
+    valid = True
+    for step in steps:
+        print(f"\n▶️ {step}")
+        if step == "rename":
+            from fix_assembly_name import plan_assembly_rename
+            enhanced.commit(plan_assembly_rename(enhanced.image, hits=enhanced.hits))
+        elif step == "inject":
+            from inject_enhanced_crm import plan_enhanced_methods
+            original.commit(plan_enhanced_methods(original.image, enhanced.image, original.hits, enhanced.hits,
+                                                  original.metadata, enhanced.metadata))
+        elif step == "smart-inject":
+            from advanced_injection import plan_smart_inject
+            plan = plan_smart_inject(original.image, enhanced.image, diff_only, original.hits, enhanced.hits,
+                                     original.metadata, enhanced.metadata)
+            if plan is False:
+                raise PipelineError("no enhanced regions found")
+            if plan is not None:
+                original.commit(plan)
+        elif step == "merge":
+            from create_bridged_assembly import plan_merge
+            plan, _ = plan_merge(original.image, enhanced.image, original.hits, enhanced.hits,
+                                 original.metadata, enhanced.metadata)
+            original.commit(plan)
+        elif step == "delegate":
+            from create_runtime_delegate import plan_runtime_loader
+            original.commit(plan_runtime_loader(original.image, original.hits))
+        elif step == "validate":
+            valid = validate_assembly(target, expected if target is original else None) and valid
+    return target, valid
+
+
+def run_pipeline(original_path, enhanced_path, output_path, steps=DEFAULT_STEPS, diff_only=False):
+    """Run steps (see run_steps) and write only the final assembly to
+    output_path. Returns False, leaving output_path untouched, if validation
+    fails."""
+    original = WorkingAssembly(open_assembly(original_path, copy_on_write=True))
+    enhanced = WorkingAssembly(open_assembly(enhanced_path))
+    try:
+        target, valid = run_steps(original, enhanced, steps, diff_only)
+        if valid:
+            written = target.save(output_path)
+            print(f"\n✅ Wrote {output_path}: {written:,} bytes")
+        else:
+            print(f"\n❌ Validation failed, {output_path} not written")
+    finally:
+        original.close()
+        enhanced.close()
+    return valid
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Patch plans: collect every insert/replace/append against an assembly and
+write the patched file in one streaming pass
+"""
+
+import bisect
+import os
+from collections import namedtuple
+
+import patch_stats
+from pattern_scanner import PatternScanner, scan_chunk_size
+
+# length is 0 for inserts and appends; seq keeps edits at one offset in the
+# order they were planned
+Edit = namedtuple('Edit', 'offset length data seq')
+
+COPY_CHUNK = 64 * 1024 * 1024
+
+
+class PatchError(ValueError):
+    """Raised when planned edits overlap or fall outside the image"""
+
+
+class PatchPlan:
+    """Ordered edit list against an image of a fixed size"""
+
+    def __init__(self, size):
+        self.size = size
+        self._edits = []
+        self._tail = []
+
+    def __len__(self):
+        return len(self._edits) + len(self._tail)
+
+    def _add(self, offset, length, data):
+        if offset < 0 or offset + length > self.size:
+            raise PatchError(f"edit at {offset}+{length} is outside the {self.size}-byte image")
+        self._edits.append(Edit(offset, length, data, len(self._edits)))
+
+    def insert(self, offset, data):
+        """Insert data before the original byte at offset"""
+        self._add(offset, 0, data)
+
+    def replace(self, offset, data, length=None):
+        """Replace length original bytes (len(data) by default) at offset with data"""
+        self._add(offset, len(data) if length is None else length, data)
+
+    def append(self, data):
+        """Add data after the end of the image"""
+        self._tail.append(data)
+
+    def edits(self):
+        """Edits in file order, checked so that no two of them overlap"""
+        # At one offset inserts go before a replace, so they land ahead of it
+        edits = sorted(self._edits, key=lambda edit: (edit.offset, edit.length > 0, edit.seq))
+        covered_to = 0
+        for edit in edits:
+            if edit.offset < covered_to:
+                raise PatchError(f"edit at {edit.offset} overlaps a replace ending at {covered_to}")
+            if edit.length:
+                covered_to = edit.offset + edit.length
+        return edits
+
+    def output_size(self):
+        """Size of the file write() will produce"""
+        return (self.size
+                + sum(len(edit.data) - edit.length for edit in self._edits)
+                + sum(len(chunk) for chunk in self._tail))
+
+    def remap(self):
+        """OffsetRemap from original offsets to offsets in the written file"""
+        return OffsetRemap(self.edits())
+
+    def resolve(self, source):
+        """Every change to source as one checked edit list in file order
+
+        Bytes source overwrote (in its copy-on-write mapping or buffer) become
+        replaces, and appended chunks become inserts at the end of the image.
+        """
+        plan = PatchPlan(self.size)
+        # An overwritten range is split around inserts planned inside it,
+        # exactly as if the insert had gone into the patched buffer
+        insert_offsets = sorted({edit.offset for edit in self._edits if not edit.length})
+        for start, end in source.dirty_ranges():
+            first = bisect.bisect_right(insert_offsets, start)
+            last = bisect.bisect_left(insert_offsets, end)
+            for split in insert_offsets[first:last] + [end]:
+                plan.replace(start, source.view[start:split])
+                start = split
+        for edit in self._edits:
+            plan._add(edit.offset, edit.length, edit.data)
+        for chunk in self._tail:
+            plan.insert(self.size, chunk)
+        return plan.edits()
+
+    def write(self, source, output_path):
+        """Stream source through the plan into output_path, returning bytes written
+
+        source is an AssemblyImage; every span left untouched is copied file
+        to file by the kernel where possible.
+        """
+        written = 0
+        pos = 0
+        with patch_stats.phase("write"), open(output_path, 'wb') as f:
+            for edit in self.resolve(source):
+                written += _copy_span(source, f, pos, edit.offset)
+                written += f.write(edit.data)
+                pos = edit.offset + edit.length
+            written += _copy_span(source, f, pos, self.size)
+        patch_stats.count("bytes_written", written)
+        return written
+
+    def apply(self, source):
+        """The patched image in memory: (bytearray, the resolved edit list)"""
+        edits = self.resolve(source)
+        patched = bytearray()
+        pos = 0
+        with patch_stats.phase("patch"):
+            for edit in edits:
+                patched += source.view[pos:edit.offset]
+                patched += edit.data
+                pos = edit.offset + edit.length
+            patched += source.view[pos:self.size]
+        return patched, edits
+
+
+class OffsetRemap:
+    """Old -> new offset table for a written PatchPlan
+
+    table holds (old, new) pairs: from each old offset up to the next entry,
+    an unchanged byte moves by new - old. Offsets inside a replaced range
+    map into its replacement, clamped to the replacement's end.
+    """
+
+    def __init__(self, edits):
+        self.table = [(0, 0)]
+        self._replaced = []
+        shift = 0
+        for edit in edits:
+            if edit.length:
+                self._replaced.append((edit.offset, edit.offset + edit.length, edit.offset + shift, len(edit.data)))
+            shift += len(edit.data) - edit.length
+            old = edit.offset + edit.length
+            if self.table[-1][0] == old:
+                self.table[-1] = (old, old + shift)
+            else:
+                self.table.append((old, old + shift))
+        self._olds = [old for old, _ in self.table]
+        self._replaced_starts = [start for start, _, _, _ in self._replaced]
+
+    def __call__(self, offset):
+        index = bisect.bisect_right(self._replaced_starts, offset) - 1
+        if index >= 0:
+            start, end, new_start, new_length = self._replaced[index]
+            if offset < end:
+                return new_start + min(offset - start, new_length)
+        old, new = self.table[bisect.bisect_right(self._olds, offset) - 1]
+        return offset + new - old
+
+
+def plan_substitutions(image, substitutions, hits=None):
+    """PatchPlan replacing every occurrence of each key of substitutions
+
+    All patterns are found by one scan_all (or taken from hits, a ScanResult
+    of image covering every key), one find pass per pattern that contains
+    no other key (see PatternScanner); where matches overlap, the leftmost
+    (then longest) wins. Returns (plan, applied) where applied lists the
+    (offset, pattern) matches that were planned, in file order.
+    """
+    if hits is None or hits.first_only or not all(pattern in hits.hits for pattern in substitutions):
+        hits = PatternScanner(substitutions).scan_all(image, chunk_size=scan_chunk_size(image))
+    matches = [(offset, pattern) for pattern in substitutions for offset in hits.positions(pattern)]
+    matches.sort(key=lambda match: (match[0], -len(match[1])))
+    plan = PatchPlan(len(image))
+    applied = []
+    covered_to = 0
+    for offset, pattern in matches:
+        if offset < covered_to:
+            continue
+        plan.replace(offset, substitutions[pattern], length=len(pattern))
+        applied.append((offset, pattern))
+        covered_to = offset + len(pattern)
+    return plan, applied
+
+
+def _copy_span(source, f, start, end):
+    """Copy source bytes [start, end) to f, in-kernel when the platform allows"""
+    if end <= start:
+        return 0
+    f.flush()
+    # An in-memory image has no file to copy from
+    copied = 0 if source.fileno() is None else _kernel_copy(source.fileno(), f.fileno(), start, end - start)
+    if start + copied >= end:
+        return copied
+    # Whatever the kernel could not copy is written from the mapping
+    return copied + f.write(source.view[start + copied:end])
+
+
+def _kernel_copy(src_fd, dst_fd, offset, count):
+    """copy_file_range, then sendfile; returns how many bytes were copied"""
+    copied = 0
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            while copied < count:
+                n = copy(src_fd, dst_fd, offset + copied, min(count - copied, COPY_CHUNK))
+                if not n:
+                    break
+                copied += n
+        except (OSError, AttributeError):
+            # Unsupported here (old kernel, cross-device, non-Linux): try the next one
+            continue
+        if copied >= count:
+            break
+    return copied
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Opt-in instrumentation shared by the patch scripts: per-phase timings,
+byte counters, pattern hit counts and allocation peaks, reported as JSON
+"""
+
+import contextlib
+import functools
+import os
+import sys
+import time
+
+# Returned by phase() and profiled() while nothing is being recorded, so the
+# hooks in the loader, scanner and writer cost one call and a None check
+_NOTHING = contextlib.nullcontext()
+_active = None
+
+
+class PatchStats:
+    """Timings and counters recorded during one run of a patch script
+
+    phases maps a phase name (load, metadata, scan, diff, extract, patch,
+    write) to its call count, total seconds and the peak of traced Python
+    allocations while it ran. A phase entered again inside itself (a scan
+    within a scan) is timed once, by the outermost call.
+    """
+
+    def __init__(self, script, trace_allocations=True, profile_path=None):
+        self.script = script
+        self.phases = {}
+        self.counters = {}
+        self.hits = {}
+        self.peak = 0
+        self.trace_allocations = trace_allocations
+        self.profile_path = profile_path
+        if profile_path:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = None
+        self._stack = []
+        self._started = None
+        self._scanned = 0
+        self._own_tracing = False
+
+    def start(self):
+        # tracemalloc (like cProfile and json) is imported only once stats are
+        # asked for: together they cost every patch script ~15ms of startup
+        import pattern_scanner
+        import tracemalloc
+
+        self._started = time.perf_counter()
+        self._scanned = pattern_scanner.bytes_scanned()
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracing = True
+
+    def stop(self):
+        import pattern_scanner
+        import tracemalloc
+
+        self.seconds = time.perf_counter() - self._started
+        self.counters["bytes_scanned"] = pattern_scanner.bytes_scanned() - self._scanned
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if self._own_tracing:
+                tracemalloc.stop()
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_path)
+
+    def report(self):
+        return {
+            "script": self.script,
+            "seconds": round(self.seconds, 6),
+            "phases": {name: dict(record, seconds=round(record["seconds"], 6))
+                       for name, record in self.phases.items()},
+            "counters": dict(sorted(self.counters.items())),
+            "pattern_hits": dict(sorted(self.hits.items())),
+            "peak_alloc_bytes": self.peak if self.trace_allocations else None,
+            "profile": self.profile_path,
+        }
+
+
+class _Phase:
+    __slots__ = ("stats", "name", "nested", "started", "peak")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        import tracemalloc
+
+        stack = self.stats._stack
+        self.nested = any(frame.name == self.name for frame in stack)
+        self.peak = 0
+        if tracemalloc.is_tracing():
+            # Fold the peak so far into the enclosing phase, then measure this one alone
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import tracemalloc
+
+        seconds = time.perf_counter() - self.started
+        stats = self.stats
+        stack = stats._stack
+        stack.pop()
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, self.peak)
+        stats.peak = max(stats.peak, self.peak)
+        if not self.nested:
+            record = stats.phases.setdefault(self.name, {"calls": 0, "seconds": 0.0, "peak_alloc_bytes": 0})
+            record["calls"] += 1
+            record["seconds"] += seconds
+            record["peak_alloc_bytes"] = max(record["peak_alloc_bytes"], self.peak)
+        return False
+
+
+class _Profiled:
+    __slots__ = ("profiler",)
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        return False
+
+
+def phase(name):
+    """Context manager timing one phase of the running script"""
+    if _active is None:
+        return _NOTHING
+    return _Phase(_active, name)
+
+
+def count(name, n=1):
+    """Add n to a counter (bytes_mapped, bytes_read, bytes_patched, bytes_written)"""
+    if _active is not None:
+        _active.counters[name] = _active.counters.get(name, 0) + n
+
+
+def count_hits(result):
+    """Add the matches in a pattern_scanner.ScanResult to the pattern hit counts"""
+    if _active is None:
+        return
+    hits = _active.hits
+    for pattern, positions in result.hits.items():
+        key = pattern.decode("utf-8", "backslashreplace")
+        hits[key] = hits.get(key, 0) + len(positions)
+
+
+def profiled():
+    """Context manager running its block under cProfile when --profile was given"""
+    if _active is None or _active.profiler is None:
+        return _NOTHING
+    return _Profiled(_active.profiler)
+
+
+def take_stats_options(argv):
+    """Remove --stats, --stats-file PATH and --profile PATH from argv in place
+
+    Returns (print_json, stats_file, profile_path), so the scripts' own
+    argument checks see only their positional arguments.
+    """
+    options = {"--stats": False, "--stats-file": None, "--profile": None}
+    for name in ("--stats-file", "--profile"):
+        if name in argv:
+            index = argv.index(name)
+            options[name] = argv[index + 1] if index + 1 < len(argv) else None
+            del argv[index:index + 2]
+    while "--stats" in argv:
+        argv.remove("--stats")
+        options["--stats"] = True
+    return options["--stats"], options["--stats-file"], options["--profile"]
+
+
+@contextlib.contextmanager
+def collect_stats(argv=None, script=None):
+    """Record stats for the with block when argv asks for them
+
+    --stats prints the JSON report after the script's own output,
+    --stats-file PATH writes it to PATH, and --profile PATH dumps a cProfile
+    of the pattern scan loops to PATH (read it with python -m pstats).
+    Allocation peaks are traced only when a report was asked for, since
+    tracemalloc slows every allocation down.
+    """
+    global _active
+    argv = sys.argv if argv is None else argv
+    print_json, stats_file, profile_path = take_stats_options(argv)
+    if not (print_json or stats_file or profile_path):
+        yield None
+        return
+
+    stats = PatchStats(script or os.path.basename(argv[0]), trace_allocations=bool(print_json or stats_file),
+                       profile_path=profile_path)
+    previous, _active = _active, stats
+    stats.start()
+    try:
+        yield stats
+    finally:
+        stats.stop()
+        _active = previous
+        import json
+
+        report = stats.report()
+        if stats_file:
+            with open(stats_file, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if print_json:
+            print(json.dumps(report, indent=2))
+
+
+def with_stats(main):
+    """Decorator giving a script's main() the --stats options"""
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        with collect_stats():
+            return main(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Watch mode for the patch pipeline: keep the original and enhanced assemblies,
+their marker hits and their metadata in memory, and re-patch the output each
+time a rebuilt input lands, rescanning only the blocks that changed
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import stat
+import tempfile
+import time
+
+from assembly_loader import BufferImage
+from patch_pipeline import DEFAULT_STEPS, PipelineError, WorkingAssembly, carry_hits, run_steps
+from patch_plan import PatchPlan
+from pattern_scanner import scan_crm_markers
+
+POLL_INTERVAL = 0.5
+# Granularity of the comparison between an input's old and new content
+BLOCK_SIZE = 64 * 1024
+# Above this share of changed blocks, a full rescan is as cheap as carrying hits
+RESCAN_SHARE = 0.25
+
+
+def content_digest(data):
+    # SHA-256 runs in hardware on current CPUs: about twice as fast as BLAKE2 here
+    return hashlib.sha256(data).digest()
+
+
+def changed_blocks(old, new, block_size=BLOCK_SIZE):
+    """(start, end) ranges of the BLOCK_SIZE blocks that differ between two
+    bytes objects of the same length, adjacent blocks merged"""
+    # Slicing bytes copies, but the comparison is then a memcmp; comparing
+    # memoryview slices goes item by item and is ten times slower
+    ranges = []
+    for start in range(0, len(new), block_size):
+        end = min(start + block_size, len(new))
+        if old[start:end] != new[start:end]:
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+    return ranges
+
+
+class WatchedInput:
+    """An input assembly held in memory with its marker hits
+
+    poll() only reads the file when its mtime or size moved, and only counts
+    it as changed when the content hash differs too, so a touched or
+    identically rebuilt DLL costs nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.digest = None
+        self.data = b""
+        self.hits = None
+        self.changed_ranges = None
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def poll(self):
+        """Reload the file if its content changed; returns True if it did
+
+        Afterwards changed_ranges holds the byte ranges that differ from the
+        previous content, or None when it was replaced wholesale.
+        """
+        try:
+            signature = self._signature()
+            if signature == self.signature:
+                return False
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            settled = self._signature() == signature and len(data) == signature[1]
+        except FileNotFoundError:
+            # Mid-rebuild: the old file is gone and the new one not yet written
+            return False
+        if not settled:
+            # Still being written; read it again on the next poll
+            return False
+        self.signature = signature
+        digest = content_digest(data)
+        if digest == self.digest:
+            return False
+
+        ranges = None
+        if self.hits is not None and len(data) == len(self.data):
+            ranges = changed_blocks(self.data, data)
+            if sum(end - start for start, end in ranges) > len(data) * RESCAN_SHARE:
+                ranges = None
+        self.data, self.digest, self.changed_ranges = data, digest, ranges
+        image = BufferImage(data, self.path)
+        try:
+            if ranges is None:
+                self.hits = scan_crm_markers(image)
+            else:
+                # The changed blocks are same-length replacements: keep the
+                # hits elsewhere and scan only around the blocks
+                plan = PatchPlan(len(data))
+                for start, end in ranges:
+                    plan.replace(start, data[start:end])
+                self.hits = carry_hits(self.hits, plan.edits(), image)
+        finally:
+            image.close()
+        return True
+
+    def describe(self):
+        if self.changed_ranges is None:
+            return "reloaded"
+        changed = sum(end - start for start, end in self.changed_ranges)
+        return f"{changed // 1024:,} KiB in {len(self.changed_ranges)} ranges changed"
+
+
+def replace_file(path, data):
+    """Write data to path through a temporary file in the same directory and
+    os.replace, so readers see either the old or the new assembly, never half"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        mode = stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else 0o644
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
+
+
+class PatchWatcher:
+    """Re-runs the pipeline steps on the in-memory inputs whenever one changes
+
+    Only the marker scan is incremental: every step other than rename runs
+    in full each time, on a fresh copy of the cached original, with both
+    inputs' hits handed over instead of rescanned. Steps are not skipped
+    when a change misses the regions they planned last time, since inject
+    and merge copy code out of the enhanced DLL and any edit moves the
+    offsets the later steps plan against. The renamed enhanced assembly, with
+    its metadata and method hashes, is kept until the enhanced DLL changes,
+    so rename runs first whatever its place in steps. The output is only
+    replaced when its bytes actually change and the run validated; a run
+    that fails or does not validate leaves the last good output in place.
+    """
+
+    def __init__(self, original_path, enhanced_path, output_path, steps=DEFAULT_STEPS, diff_only=False,
+                 verbose=False):
+        self.original = WatchedInput(original_path)
+        self.enhanced = WatchedInput(enhanced_path)
+        self.output_path = output_path
+        self.steps = steps
+        self.diff_only = diff_only
+        self.verbose = verbose
+        self.output_digest = None
+        self.runs = 0
+        self._enhanced = None
+        self._expected = None
+
+    def _log(self):
+        # The steps report every pattern they look for; keep that for --verbose
+        return contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def prepared_enhanced(self):
+        """The enhanced assembly after the steps that only touch it"""
+        if self._enhanced is None:
+            enhanced = WorkingAssembly(BufferImage(self.enhanced.data, self.enhanced.path), self.enhanced.hits.copy())
+            try:
+                # validate compares against the bodies from before rename
+                self._expected = enhanced.method_hashes if "validate" in self.steps else None
+                with self._log():
+                    run_steps(None, enhanced, [step for step in self.steps if step == "rename"])
+            except BaseException:
+                enhanced.close()
+                raise
+            self._enhanced = enhanced
+        return self._enhanced
+
+    def repatch(self):
+        """Run the steps once and replace the output if it changed and passed
+        validation
+
+        Returns (written, valid).
+        """
+        original = WorkingAssembly(BufferImage(bytearray(self.original.data), self.original.path),
+                                   self.original.hits.copy())
+        try:
+            with self._log():
+                target, valid = run_steps(original, self.prepared_enhanced(),
+                                          [step for step in self.steps if step != "rename"], self.diff_only,
+                                          self._expected)
+            output = target.image.view
+            digest = content_digest(output)
+            written = valid and digest != self.output_digest
+            if written:
+                replace_file(self.output_path, output)
+                self.output_digest = digest
+        finally:
+            original.close()
+        self.runs += 1
+        return written, valid
+
+    def check(self):
+        """Poll both inputs and re-patch if either changed; returns True if it ran"""
+        started = time.perf_counter()
+        changed = [watched for watched in (self.original, self.enhanced) if watched.poll()]
+        if not changed or self.original.hits is None or self.enhanced.hits is None:
+            return False
+        if self.enhanced in changed and self._enhanced is not None:
+            self._enhanced.close()
+            self._enhanced = None
+        try:
+            written, valid = self.repatch()
+        except Exception as e:
+            # A half-written or malformed rebuild must not end the watch: keep
+            # the last good output and try again when an input changes next
+            detail = str(e) if isinstance(e, PipelineError) else f"{type(e).__name__}: {e}"
+            print(f"❌ Pipeline failed, keeping the previous output: {detail}")
+            return True
+        elapsed = (time.perf_counter() - started) * 1000
+        inputs = ", ".join(f"{os.path.basename(w.path)} {w.describe()}" for w in changed)
+        if not valid:
+            print(f"⚠️ Validation failed after {elapsed:.1f} ms, keeping the previous output ({inputs})")
+        elif written:
+            print(f"✅ Re-patched {self.output_path} in {elapsed:.1f} ms ({inputs})")
+        else:
+            print(f"ℹ️ Output unchanged after {elapsed:.1f} ms ({inputs})")
+        return True
+
+    def watch(self, interval=POLL_INTERVAL):
+        """Poll until interrupted"""
+        print(f"👀 Watching {self.original.path} and {self.enhanced.path} → {self.output_path}")
+        print(f"   Steps: {' → '.join(self.steps)}; Ctrl+C to stop")
+        try:
+            while True:
+                self.check()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print(f"\n👋 Stopped after {self.runs} runs")
+        finally:
+            if self._enhanced is not None:
+                self._enhanced.close()
+                self._enhanced = None
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern marker scanner shared by the patch scripts
+"""
+
+import bisect
+
+import patch_stats
+
+# Chunked scans read through one buffer of this size, whatever the file size
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Images at least this large are scanned in chunks instead of through the mapping
+CHUNKED_SCAN_THRESHOLD = 256 * 1024 * 1024
+
+# Every marker the patch scripts look for; the pipeline scans for all of
+# them once and hands the hits from step to step
+CRM_MARKERS = [
+    b"CrmLinkEngine",
+    b"get_CrmLinkEngine",
+    b"_crmLinkEngine",
+    b"ProcessIncomingEmailForCrm",
+    b"LinkChainToCrm",
+    b"LinkChainToCrmEnhanced",
+    b"AutoLinkToCrm",
+    b"DEBUG",
+    b"DEBUG:",
+    b"DEBUG: ProcessIncomingEmailForCrm",
+    b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
+    b"DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED for message",
+    b"DEBUG: CRM conditions met",
+    b"DEBUG: CRM conditions met - starting auto-processing",
+    b"CRM conditions met",
+    b"CRM auto-processing completed for message",
+    b"Enhanced",
+    b"Enhanced automatic linking",
+    b"Enhanced automatic linking with file uploads",
+    b".dll\x00",
+    # fix_assembly_name's renames
+    b"ASC.Mail\x00",
+    b"ASC.Mail.dll\x00",
+]
+
+
+class ScanResult:
+    """Offsets of every occurrence of every pattern, in file order
+
+    A first_only result holds at most the first offset of each pattern and
+    answers only first(), found() and `in`.
+    """
+
+    def __init__(self, patterns, first_only=False):
+        self.hits = {pattern: [] for pattern in patterns}
+        self.first_only = first_only
+
+    def _require_all(self):
+        if self.first_only:
+            raise ValueError("scanned for first matches only; scan without first_only for every offset")
+
+    def __contains__(self, pattern):
+        return bool(self.hits.get(pattern))
+
+    def positions(self, pattern):
+        """All offsets of pattern (empty list if it never matched)"""
+        self._require_all()
+        return self.hits.get(pattern, [])
+
+    def first(self, pattern):
+        """First offset of pattern, or -1 like bytes.find"""
+        positions = self.hits.get(pattern)
+        return positions[0] if positions else -1
+
+    def first_in(self, pattern, start, end):
+        """First offset of pattern lying wholly inside [start, end), or -1"""
+        self._require_all()
+        positions = self.hits.get(pattern, [])
+        index = bisect.bisect_left(positions, start)
+        if index < len(positions) and positions[index] + len(pattern) <= end:
+            return positions[index]
+        return -1
+
+    def found(self):
+        """Map of pattern -> first offset for the patterns that matched"""
+        return {pattern: positions[0] for pattern, positions in self.hits.items() if positions}
+
+    def copy(self):
+        """Independent copy, for handing cached hits to code that may update them"""
+        result = ScanResult((), self.first_only)
+        result.hits = {pattern: list(positions) for pattern, positions in self.hits.items()}
+        return result
+
+
+class PatternScanner:
+    """Finds a fixed set of byte patterns with C-level searches
+
+    This is one bytes.find pass per anchor, not a single pass over the
+    image: anchors are the patterns that contain no other pattern, and every
+    other pattern contains an anchor and is checked with a bounded find
+    where that anchor matched. A marker family like DEBUG, DEBUG:,
+    DEBUG: CRM conditions met... then costs one pass. Each pass runs at
+    memchr speed, far ahead of an automaton stepped byte by byte in Python,
+    so a handful of anchors still reads the image faster than one such
+    pass; bytes_scanned() counts every pass.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = [bytes(p) for p in dict.fromkeys(patterns) if p]
+        self.longest = max((len(p) for p in self.patterns), default=0)
+        # anchor -> [(pattern, offset of the anchor inside pattern)]
+        self._anchors = {}
+        for pattern in sorted(self.patterns, key=len):
+            # Shorter patterns come first, so every anchor inside pattern is known;
+            # the longest one is the rarest to check candidates at
+            inside = [anchor for anchor in self._anchors if anchor in pattern]
+            if inside:
+                anchor = max(inside, key=len)
+                self._anchors[anchor].append((pattern, pattern.index(anchor)))
+            else:
+                self._anchors[pattern] = []
+
+    def scan(self, data, start=0, end=None):
+        """Yield (offset, pattern) for every match wholly inside [start, end),
+        overlapping ones included, in order of the match's last byte
+
+        The matches of all anchor passes are collected and sorted before the
+        first is yielded; scan_chunked bounds that to one chunk's matches.
+        """
+        if not self.patterns:
+            return
+        find = data.find if hasattr(data, 'find') else bytes(data).find
+        if end is None:
+            end = len(data)
+        global _bytes_scanned
+
+        matches = []
+        for anchor, containing in self._anchors.items():
+            _bytes_scanned += max(0, end - start)
+            pos = find(anchor, start, end)
+            while pos != -1:
+                matches.append((pos, anchor))
+                for pattern, offset in containing:
+                    at = pos - offset
+                    if at >= start and at + len(pattern) <= end and find(pattern, at, at + len(pattern)) == at:
+                        matches.append((at, pattern))
+                pos = find(anchor, pos + 1, end)
+        matches.sort(key=lambda match: (match[0] + len(match[1]), -len(match[1])))
+        yield from matches
+
+    def _scan_first(self, data, start, end, hits):
+        """Fill hits with the first offset of each pattern, one find apiece"""
+        if end is None:
+            end = len(data)
+        global _bytes_scanned
+        with patch_stats.phase("scan"), patch_stats.profiled():
+            for pattern in self.patterns:
+                pos = data.find(pattern, start, end)
+                if pos == -1:
+                    _bytes_scanned += max(0, end - start)
+                else:
+                    _bytes_scanned += pos + len(pattern) - start
+                    hits[pattern].append(pos)
+
+    def scan_chunked(self, source, chunk_size=CHUNK_SIZE):
+        """Yield the same matches as scan() over a whole file, in bounded memory
+
+        source is a path or an AssemblyImage. The file is read through one
+        buffer of chunk_size plus an overlap of the longest pattern, so a
+        match straddling two chunks is still seen, and only matches starting
+        in the current chunk are reported so none is reported twice.
+        """
+        if not self.patterns:
+            return
+        path = getattr(source, 'path', source)
+        overlap = self.longest - 1
+        buf = bytearray(chunk_size + overlap)
+        view = memoryview(buf)
+        base = 0
+        with open(path, 'rb', buffering=0) as f:
+            filled = _read_full(f, view)
+            patch_stats.count("bytes_read", filled)
+            while True:
+                last = filled < len(buf)
+                limit = filled if last else chunk_size
+                for offset, pattern in self.scan(buf, 0, filled):
+                    if offset < limit:
+                        yield base + offset, pattern
+                if last:
+                    return
+                # Carry the tail over so matches crossing the boundary are complete
+                buf[:overlap] = buf[chunk_size:]
+                base += chunk_size
+                read = _read_full(f, view[overlap:])
+                patch_stats.count("bytes_read", read)
+                filled = overlap + read
+
+    def scan_all(self, data, start=0, end=None, chunk_size=None, first_only=False):
+        """Collect every match into a ScanResult
+
+        With chunk_size the file behind data is read in chunks of that size
+        (see scan_chunked) instead of being scanned through its mapping.
+        With first_only each pattern's search stops at its first match.
+        """
+        result = ScanResult(self.patterns, first_only)
+        hits = result.hits
+        if first_only and not chunk_size:
+            self._scan_first(data, start, end, hits)
+            patch_stats.count_hits(result)
+            return result
+        if chunk_size:
+            matches = self.scan_chunked(data, chunk_size)
+        else:
+            matches = self.scan(data, start, end)
+        with patch_stats.phase("scan"), patch_stats.profiled():
+            for offset, pattern in matches:
+                hits[pattern].append(offset)
+        # Matches are reported at their end byte; keep each list in start order
+        for pattern, positions in hits.items():
+            positions.sort()
+            if first_only:
+                del positions[1:]
+        patch_stats.count_hits(result)
+        return result
+
+
+def _read_full(f, view):
+    """readinto until view is full or the file ends; returns the bytes read"""
+    total = 0
+    while total < len(view):
+        n = f.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def scan_chunk_size(data, chunk_size=None):
+    """Chunk size to scan data with: chunk_size if given, else CHUNK_SIZE for
+    images past CHUNKED_SCAN_THRESHOLD that have a file behind them, else None"""
+    if chunk_size:
+        return chunk_size
+    if getattr(data, 'path', None) and len(data) >= CHUNKED_SCAN_THRESHOLD:
+        return CHUNK_SIZE
+    return None
+
+
+_crm_scanner = None
+_bytes_scanned = 0
+
+
+def bytes_scanned():
+    """Bytes read by PatternScanner's searches so far in this process, once
+    per anchor pass (or per pattern, for first-only scans)"""
+    return _bytes_scanned
+
+
+def crm_marker_scanner():
+    """Shared scanner for CRM_MARKERS, compiled on first use"""
+    global _crm_scanner
+    if _crm_scanner is None:
+        _crm_scanner = PatternScanner(CRM_MARKERS)
+    return _crm_scanner
+
+
+def scan_crm_markers(data, chunk_size=None, patterns=None, first_only=False):
+    """Find every CRM marker in data, or only the given patterns
+
+    Each pattern costs a pass over the image unless it contains a shorter
+    one being scanned for, so callers pass just the markers they look up,
+    and first_only when first() and `in` are all they ask the result.
+    Large images (or any image, given chunk_size) are scanned in
+    fixed-size chunks so memory stays flat; the hits are identical.
+    """
+    scanner = crm_marker_scanner() if patterns is None else PatternScanner(patterns)
+    return scanner.scan_all(data, chunk_size=scan_chunk_size(data, chunk_size), first_only=first_only)
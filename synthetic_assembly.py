@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic but structurally valid PE/CLI assemblies for exercising
+and benchmarking the patch scripts without the real ONLYOFFICE DLLs
+"""
+
+import random
+import struct
+import sys
+
+from pattern_scanner import CRM_MARKERS
+
+TEXT_RVA = 0x2000
+FILE_ALIGNMENT = 0x200
+SECTION_ALIGNMENT = 0x2000
+CLI_HEADER_SIZE = 72
+
+# Filler between the method bodies and the metadata is streamed in pieces this size
+FILLER_BLOCK = 1024 * 1024
+
+# Methods per filler type; more types than this would widen the TypeDefOrRef index
+METHODS_PER_TYPE = 100
+
+CRM_ENGINE = ("ASC.Mail.Core.Engine", "CrmLinkEngine")
+ENHANCED_STRINGS = [
+    "DEBUG: ProcessIncomingEmailForCrm - METHOD CALLED",
+    "DEBUG: CRM conditions met - starting auto-processing",
+    "Enhanced automatic linking with file uploads",
+]
+ORIGINAL_STRINGS = ["ASC.Mail", "ASC.Mail.dll", "get_CrmLinkEngine", "_crmLinkEngine", "DEBUG"]
+
+
+class AssemblyLayout:
+    """Bytes before and after the filler of a synthetic assembly
+
+    head holds the PE headers, the CLI header and the method bodies, tail the
+    metadata and section padding; filler bytes of code go in between.
+    """
+
+    def __init__(self, types, pad_strings=(), filler=0, module_name="synthetic.dll"):
+        self.filler = filler
+        strings = bytearray(b"\x00")
+        string_index = {}
+
+        def string(value):
+            value = value.encode("utf-8") if isinstance(value, str) else value
+            if value not in string_index:
+                string_index[value] = len(strings)
+                strings.extend(value + b"\x00")
+            return string_index[value]
+
+        for value in pad_strings:
+            string(value)
+        module = string(module_name)
+
+        # Method bodies follow the CLI header at the start of .text
+        code = bytearray()
+        bodies_rva = TEXT_RVA + CLI_HEADER_SIZE
+        typedef_rows = [(0, string("<Module>"), 0, 0, 1, 1)]
+        method_rows = []
+        for namespace, name, methods in types:
+            typedef_rows.append((0x100001, string(name), string(namespace), 0, 1, len(method_rows) + 1))
+            for method_name, il, fat in methods:
+                if il is None:
+                    rva = 0
+                else:
+                    code.extend(b"\x00" * (-len(code) % 4))
+                    rva = bodies_rva + len(code)
+                    if not fat and len(il) < 64:
+                        code.append((len(il) << 2) | 0x2)
+                    else:
+                        code.extend(struct.pack("<HHII", 0x3003, 8, len(il), 0))
+                    code.extend(il)
+                method_rows.append((rva, 0, 0x86, string(method_name), 1, 1))
+        filler += -(len(code) + filler) % 4
+        self.filler = filler
+
+        # #~ stream with the Module, TypeDef and MethodDef tables
+        wide_strings = len(strings) >= 0x10000
+        str_fmt = "I" if wide_strings else "H"
+        method_fmt = "I" if len(method_rows) >= 0x10000 else "H"
+        valid = (1 << 0x00) | (1 << 0x02) | (1 << 0x06)
+        tables = bytearray(struct.pack("<IBBBBQQ", 0, 2, 0, 1 if wide_strings else 0, 1, valid, 0))
+        tables += struct.pack("<3I", 1, len(typedef_rows), len(method_rows))
+        tables += struct.pack("<H" + str_fmt + "HHH", 0, module, 1, 0, 0)
+        for row in typedef_rows:
+            tables += struct.pack("<I" + str_fmt + str_fmt + "HH" + method_fmt, *row)
+        for row in method_rows:
+            tables += struct.pack("<IHH" + str_fmt + "HH", *row)
+
+        # One method signature (instance void ()) in #Blob
+        blob = bytearray(b"\x00\x03\x20\x00\x01")
+        streams = [(b"#~", tables), (b"#Strings", strings), (b"#US", bytearray(b"\x00")),
+                   (b"#GUID", bytearray(16)), (b"#Blob", blob)]
+        for _, stream in streams:
+            stream.extend(b"\x00" * (-len(stream) % 4))
+
+        version = b"v4.0.30319\x00\x00"
+        root = struct.pack("<IHHII", 0x424A5342, 1, 1, 0, len(version)) + version
+        root += struct.pack("<HH", 0, len(streams))
+        headers_size = sum(8 + len(name) + 1 + (-(len(name) + 1) % 4) for name, _ in streams)
+        offset = len(root) + headers_size
+        stream_headers = bytearray()
+        for name, stream in streams:
+            padded = name + b"\x00" * (1 + (-(len(name) + 1) % 4))
+            stream_headers += struct.pack("<II", offset, len(stream)) + padded
+            offset += len(stream)
+        metadata = root + stream_headers + b"".join(stream for _, stream in streams)
+
+        metadata_rva = bodies_rva + len(code) + filler
+        cli = struct.pack("<IHHIIIIIIIIIIIIIIII", CLI_HEADER_SIZE, 2, 5, metadata_rva, len(metadata),
+                          1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        text_size = CLI_HEADER_SIZE + len(code) + filler + len(metadata)
+        text_raw = text_size + (-text_size % FILE_ALIGNMENT)
+
+        dos = bytearray(0x80)
+        dos[0:2] = b"MZ"
+        struct.pack_into("<I", dos, 0x3C, 0x80)
+        optional = bytearray(224)
+        struct.pack_into("<H", optional, 0, 0x10B)
+        struct.pack_into("<I", optional, 28, 0x400000)
+        struct.pack_into("<II", optional, 32, SECTION_ALIGNMENT, FILE_ALIGNMENT)
+        struct.pack_into("<I", optional, 56, TEXT_RVA + text_size + (-text_size % SECTION_ALIGNMENT))
+        struct.pack_into("<I", optional, 60, FILE_ALIGNMENT)
+        struct.pack_into("<I", optional, 92, 16)
+        # Data directory 14: the CLI header
+        struct.pack_into("<II", optional, 96 + 14 * 8, TEXT_RVA, CLI_HEADER_SIZE)
+        coff = struct.pack("<HHIIIHH", 0x14C, 1, 0, 0, 0, len(optional), 0x2102)
+        section = struct.pack("<8sIIIIIIHHI", b".text", text_size, TEXT_RVA, text_raw, FILE_ALIGNMENT,
+                              0, 0, 0, 0, 0x60000020)
+        pe_headers = bytes(dos) + b"PE\x00\x00" + coff + bytes(optional) + section
+        pe_headers += b"\x00" * (FILE_ALIGNMENT - len(pe_headers))
+
+        self.head = pe_headers + cli + bytes(code)
+        self.tail = metadata + b"\x00" * (text_raw - text_size)
+
+    @property
+    def size(self):
+        return len(self.head) + self.filler + len(self.tail)
+
+
+def filler_blocks(size, seed=0, marker_density=0, markers=CRM_MARKERS):
+    """Random filler bytes in FILLER_BLOCK pieces with about marker_density
+    CRM marker strings per MiB dropped in at random offsets"""
+    rnd = random.Random(seed)
+    remaining = size
+    while remaining > 0:
+        block = bytearray(rnd.randbytes(min(FILLER_BLOCK, remaining)))
+        count = marker_density * len(block) / FILLER_BLOCK
+        count = int(count) + (rnd.random() < count % 1)
+        for _ in range(count):
+            marker = rnd.choice(markers)
+            if len(marker) < len(block):
+                pos = rnd.randrange(len(block) - len(marker))
+                block[pos:pos + len(marker)] = marker
+        remaining -= len(block)
+        yield block
+
+
+def build_assembly(types, pad_strings=(), filler=0, seed=0, marker_density=0):
+    """A whole synthetic assembly in memory (for small ones)
+
+    types is a list of (namespace, name, [(method_name, il or None, fat)]).
+    """
+    layout = AssemblyLayout(types, pad_strings, filler)
+    return layout.head + b"".join(filler_blocks(layout.filler, seed, marker_density)) + layout.tail
+
+
+def crm_types(methods=1000, enhanced=False, seed=0):
+    """CrmLinkEngine plus filler types holding methods small methods
+
+    The enhanced variant has a different ProcessIncomingEmailForCrm body of
+    the same size and the extra LinkChainToCrmEnhanced method.
+    """
+    rnd = random.Random(seed * 2 + enhanced)
+    engine = [
+        ("ProcessIncomingEmailForCrm", rnd.randbytes(400) + b"\x2A", True),
+        ("LinkChainToCrm", b"\x00\x2A", False),
+        ("AutoLinkToCrm", random.Random(seed).randbytes(200) + b"\x2A", True),
+        ("Dispose", None, False),
+    ]
+    if enhanced:
+        engine.append(("LinkChainToCrmEnhanced", rnd.randbytes(300) + b"\x2A", True))
+    types = [(CRM_ENGINE[0], CRM_ENGINE[1], engine)]
+
+    filler_rnd = random.Random(seed)
+    for first in range(0, methods, METHODS_PER_TYPE):
+        count = min(METHODS_PER_TYPE, methods - first)
+        types.append(("ASC.Mail.Synthetic", f"Type{first // METHODS_PER_TYPE}", [
+            (f"Method{first + i}", filler_rnd.randbytes(filler_rnd.randrange(1, 60)) + b"\x2A", False)
+            for i in range(count)
+        ]))
+    return types
+
+
+def write_crm_assembly(path, size, methods=1000, marker_density=0, enhanced=False, seed=0):
+    """Write a synthetic ASC.Mail(.Core).dll stand-in of about size bytes
+
+    Returns the size written (at least the size of the headers, bodies and
+    metadata, whatever size asks for).
+    """
+    types = crm_types(methods, enhanced, seed)
+    pad_strings = ORIGINAL_STRINGS + (ENHANCED_STRINGS if enhanced else [])
+    module_name = "ASC.Mail.dll" if enhanced else "ASC.Mail.Core.dll"
+    layout = AssemblyLayout(types, pad_strings, 0, module_name)
+    layout = AssemblyLayout(types, pad_strings, max(0, size - layout.size), module_name)
+    with open(path, "wb") as f:
+        f.write(layout.head)
+        for block in filler_blocks(layout.filler, seed, marker_density):
+            f.write(block)
+        f.write(layout.tail)
+    return layout.size
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or "--help" in args or "-h" in args:
+        print("Usage: synthetic_assembly.py <output.dll> [--size MB] [--methods N]")
+        print("                             [--marker-density PER_MB] [--enhanced] [--seed N]")
+        return 0 if args else 1
+
+    def option(name, default):
+        return args[args.index(name) + 1] if name in args else default
+
+    size = int(float(option("--size", 1)) * 1024 * 1024)
+    written = write_crm_assembly(args[0], size, int(option("--methods", 1000)),
+                                 float(option("--marker-density", 0)), "--enhanced" in args,
+                                 int(option("--seed", 0)))
+    print(f"✅ Created {args[0]}: {written:,} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Fill a SQLite stand-in of the ONLYOFFICE database with a synthetic mail/CRM
+dataset for load-testing the linkers: many tenants, contacts with several
+addresses, multi-recipient headers, threads, and Zipf-skewed senders
+"""
+
+import bisect
+import itertools
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from crm_chain_contacts import ChainContacts
+from crm_contact_index import EMAIL_INFO_TYPE, ContactIndex
+from crm_db import connect_sqlite
+from crm_event_writer import EventWriter
+from crm_linker import INBOX_FOLDER, SENT_FOLDER, link_batch, max_mail_id, new_messages
+
+SPAM_FOLDER = 5
+PHONE_INFO_TYPE = 0
+
+DEFAULT_TENANTS = 10
+DEFAULT_CONTACTS = 100000
+DEFAULT_MESSAGES = 1000000
+# Share of sender/recipient addresses that belong to a CRM contact
+DEFAULT_CONTACT_SHARE = 0.4
+# Zipf exponent of sender popularity; ~1 matches real mailboxes
+DEFAULT_SKEW = 1.1
+# Chance that a message replies to one of the tenant's recent threads
+REPLY_RATE = 0.5
+RECENT_THREADS = 200
+
+INSERT_BATCH = 10000
+START_DATE = datetime(2024, 1, 1)
+
+FIRST_NAMES = ["anna", "boris", "clara", "dmitri", "elena", "felix", "greta", "hugo", "irina", "jonas",
+               "katja", "lev", "maria", "nikolai", "olga", "pavel", "rosa", "sergei", "tanja", "viktor"]
+LAST_NAMES = ["ivanova", "schmidt", "petrov", "muller", "smirnov", "weber", "kuznetsova", "wagner",
+              "popov", "becker", "sokolova", "hoffmann", "lebedev", "koch", "novikova", "richter"]
+DOMAINS = ["example.com", "example.org", "mail.example.net", "corp.example", "example.de", "пример.рф"]
+
+
+class ZipfSampler:
+    """Draws indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** skew"""
+
+    def __init__(self, n, skew, rnd):
+        self.rnd = rnd
+        total = 0.0
+        self.cumulative = []
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** skew
+            self.cumulative.append(total)
+        self.total = total
+
+    def __call__(self):
+        return bisect.bisect_left(self.cumulative, self.rnd.random() * self.total)
+
+
+def _address(rnd, n):
+    first, last = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+    return first, last, f"{first}.{last}{n}@{rnd.choice(DOMAINS)}"
+
+
+def _header_form(rnd, name, address):
+    """One address as a mail client would write it in a header"""
+    form = rnd.random()
+    if form < 0.5:
+        return f'"{name}" <{address}>'
+    if form < 0.7:
+        return f"{name} <{address.upper() if rnd.random() < 0.2 else address}>"
+    return address
+
+
+def generate(db, tenants=DEFAULT_TENANTS, contacts=DEFAULT_CONTACTS, messages=DEFAULT_MESSAGES,
+             contact_share=DEFAULT_CONTACT_SHARE, skew=DEFAULT_SKEW, seed=0, progress=print):
+    """Write the dataset into db (a CrmDatabase on SQLite); returns row counts"""
+    rnd = random.Random(seed)
+    counts = {"crm_contact": 0, "crm_contact_info": 0, "mail_mail": 0}
+    db.conn.execute("PRAGMA journal_mode = OFF")
+    db.conn.execute("PRAGMA synchronous = OFF")
+
+    # Contacts: one to three addresses each, plus a phone number as noise
+    people = {tenant: [] for tenant in range(1, tenants + 1)}
+    contact_rows, info_rows = [], []
+    serial = itertools.count()
+    for contact_id in range(1, contacts + 1):
+        tenant = rnd.randrange(1, tenants + 1)
+        first, last, address = _address(rnd, next(serial))
+        contact_rows.append((contact_id, tenant, first.title(), last.title(), f"{first.title()} {last.title()}"))
+        addresses = [address] + [_address(rnd, next(serial))[2] for _ in range(rnd.choice((0, 0, 1, 2)))]
+        for address in addresses:
+            # Stored the way users type them: mixed case now and then
+            info_rows.append((address.title() if rnd.random() < 0.1 else address, tenant, contact_id,
+                              EMAIL_INFO_TYPE))
+            people[tenant].append((f"{first.title()} {last.title()}", address))
+        info_rows.append((f"+7 900 {rnd.randrange(10 ** 7):07d}", tenant, contact_id, PHONE_INFO_TYPE))
+    db.executemany("INSERT INTO crm_contact (id, tenant_id, first_name, last_name, display_name) "
+                   "VALUES (?, ?, ?, ?, ?)", contact_rows).close()
+    db.executemany("INSERT INTO crm_contact_info (data, tenant_id, contact_id, type) VALUES (?, ?, ?, ?)",
+                   info_rows).close()
+    db.commit()
+    counts["crm_contact"], counts["crm_contact_info"] = len(contact_rows), len(info_rows)
+    progress(f"  👥 {len(contact_rows):,} contacts, {len(info_rows):,} contact infos")
+
+    # Per tenant, a correspondent pool where contact_share of the people are contacts;
+    # popularity follows the pool order, so the head of the Zipf curve is mixed too
+    pools, samplers, recent = {}, {}, {}
+    for tenant in range(1, tenants + 1):
+        known = people[tenant]
+        strangers = max(1, int(len(known) * (1 - contact_share) / max(contact_share, 1e-6)))
+        pool = known + [(f"{first.title()} {last.title()}", address)
+                        for first, last, address in (_address(rnd, next(serial)) for _ in range(strangers))]
+        rnd.shuffle(pool)
+        pools[tenant] = pool
+        samplers[tenant] = ZipfSampler(len(pool), skew, rnd)
+        recent[tenant] = []
+    tenant_sampler = ZipfSampler(tenants, 0.8, rnd)
+
+    rows = []
+    chains = itertools.count(1)
+    received = START_DATE
+    for message_id in range(1, messages + 1):
+        tenant = tenant_sampler() + 1
+        pool, sample = pools[tenant], samplers[tenant]
+        threads = recent[tenant]
+        received += timedelta(seconds=rnd.randrange(1, 30))
+        if threads and rnd.random() < REPLY_RATE:
+            mailbox, chain_id, participants = rnd.choice(threads)
+        else:
+            mailbox = rnd.randrange(1, 4) + tenant * 10
+            chain_id = f"chain-{next(chains)}"
+            participants = [pool[sample()] for _ in range(1 + rnd.choice((0, 0, 1, 1, 2, 4)))]
+            threads.append((mailbox, chain_id, participants))
+            if len(threads) > RECENT_THREADS:
+                threads.pop(0)
+
+        sender = participants[0]
+        recipients = participants[1:] or [pool[sample()]]
+        cc = [pool[sample()] for _ in range(rnd.choice((0, 0, 0, 1, 3)))]
+        folder = rnd.choices((INBOX_FOLDER, SENT_FOLDER, SPAM_FOLDER), (70, 25, 5))[0]
+        rows.append((message_id, mailbox, f"user-{mailbox}", tenant, _header_form(rnd, *sender),
+                     ", ".join(_header_form(rnd, *r) for r in recipients),
+                     ", ".join(_header_form(rnd, *r) for r in cc) or None,
+                     f"Synthetic message {message_id}", received.strftime("%Y-%m-%d %H:%M:%S"), folder, chain_id))
+        if len(rows) >= INSERT_BATCH:
+            counts["mail_mail"] += _insert_mail(db, rows)
+            rows = []
+            if message_id % (INSERT_BATCH * 50) == 0:
+                progress(f"  ✉️ {message_id:,} messages")
+    counts["mail_mail"] += _insert_mail(db, rows)
+    progress(f"  ✉️ {counts['mail_mail']:,} messages")
+    return counts
+
+
+def _insert_mail(db, rows):
+    if rows:
+        db.executemany("INSERT INTO mail_mail (id, id_mailbox, id_user, tenant, from_text, to_text, cc, subject, "
+                       "date_received, folder, chain_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows).close()
+        db.commit()
+    return len(rows)
+
+
+def link_history(db, progress=print):
+    """Link every generated message the way crm_linker would, so the
+    crm_relationship_event table starts out as large as the mail history"""
+    index = ContactIndex.load(db)
+    chains = ChainContacts()
+    create_on = START_DATE.strftime("%Y-%m-%d %H:%M:%S")
+    high = max_mail_id(db)
+    after = 0
+    with EventWriter(db, INSERT_BATCH) as writer:
+        while True:
+            messages = new_messages(db, (INBOX_FOLDER, SENT_FOLDER), after, high, limit=INSERT_BATCH, guard=False)
+            if not messages:
+                break
+            for message_events in link_batch(index, messages, create_on, chains=chains):
+                writer.extend(message_events)
+            after = messages[-1][0]
+    progress(f"  🔗 {writer.written:,} relationship events")
+    return writer.written
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or "--help" in args or "-h" in args:
+        print("Usage: synthetic_crm_data.py <database.sqlite> [--tenants N] [--contacts N] [--messages N]")
+        print("                             [--contact-share 0.4] [--skew 1.1] [--seed N] [--no-events]")
+        print("  --no-events  leave crm_relationship_event empty instead of linking the generated mail")
+        return 0 if args else 1
+
+    def option(name, default):
+        return args[args.index(name) + 1] if name in args else default
+
+    db = connect_sqlite(args[0])
+    if db.query("SELECT COUNT(*) FROM mail_mail")[0][0]:
+        print(f"❌ {args[0]} already has mail; generate into a new file")
+        return 1
+    print(f"🚀 Generating synthetic CRM dataset in {args[0]}")
+    started = time.time()
+    counts = generate(db, int(option("--tenants", DEFAULT_TENANTS)), int(option("--contacts", DEFAULT_CONTACTS)),
+                      int(option("--messages", DEFAULT_MESSAGES)),
+                      float(option("--contact-share", DEFAULT_CONTACT_SHARE)),
+                      float(option("--skew", DEFAULT_SKEW)), int(option("--seed", 0)))
+    if "--no-events" not in args:
+        counts["crm_relationship_event"] = link_history(db)
+    db.close()
+    print(f"✅ Wrote {', '.join(f'{n:,} {table}' for table, n in counts.items())} "
+          f"in {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Checks for the linkers' id watermarks on a SQLite stand-in: mail whose id
+commits after a higher one must still be linked. Run with
+python3 test_crm_linker.py (or pytest)
+"""
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from crm_chain_contacts import ChainContacts
+from crm_checkpoint import Checkpoint
+from crm_contact_index import EMAIL_INFO_TYPE, ContactIndex
+from crm_db import connect_sqlite
+from crm_linked_filter import LinkedMailFilter
+from crm_linker import ENTITY_TYPE_MAIL, INBOX_FOLDER, link_batch, link_new
+from crm_linker_async import AsyncConnectionPool, TenantBackoff, run_cycle
+
+TENANT = 1
+CONTACT_ID = 7
+CONTACT_ADDRESS = "anna@example.com"
+CONFIG = {"Features": {"CreateNoMatchEvents": True}}
+
+
+class LateCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "crm.sqlite")
+        self.db = connect_sqlite(self.path)
+        self.db.execute("INSERT INTO crm_contact_info (data, tenant_id, contact_id, type) VALUES (?, ?, ?, ?)",
+                        (CONTACT_ADDRESS, TENANT, CONTACT_ID, EMAIL_INFO_TYPE)).close()
+        self.db.commit()
+        self.index = ContactIndex.load(self.db)
+        self.checkpoint = Checkpoint(os.path.join(self.workdir.name, "checkpoint.json"), floor=0, lookback=10)
+
+    def tearDown(self):
+        self.db.close()
+        self.workdir.cleanup()
+
+    def commit_mail(self, mail_id, tenant=TENANT):
+        """Insert one linkable message with an explicit id, as a transaction that took the id earlier would"""
+        self.db.execute("INSERT INTO mail_mail (id, tenant, from_text, folder) VALUES (?, ?, ?, ?)",
+                        (mail_id, tenant, f"Anna <{CONTACT_ADDRESS}>", INBOX_FOLDER)).close()
+        self.db.commit()
+
+    def events(self):
+        return sorted(row[0] for row in self.db.query(
+            "SELECT entity_id FROM crm_relationship_event WHERE entity_type = ?", (ENTITY_TYPE_MAIL,)))
+
+    def run_linker(self, linked=None, index=None, config=CONFIG):
+        return link_new(self.db, index or self.index, config, self.checkpoint, linked)
+
+    def run_async_cycle(self, index=None, **kwargs):
+        async def cycle():
+            pool = AsyncConnectionPool(lambda: connect_sqlite(self.path), 2)
+            try:
+                # A cycle that hangs fails the test instead of the run
+                return await asyncio.wait_for(run_cycle(pool, index or self.index, CONFIG, self.checkpoint,
+                                                        TenantBackoff(), **kwargs), 10)
+            finally:
+                pool.close()
+        return asyncio.run(cycle())[:2]
+
+    def test_lower_id_committed_after_higher_one(self):
+        self.commit_mail(2)
+        self.assertEqual(self.run_linker(), (1, 1))
+        self.assertEqual(self.checkpoint.watermark(TENANT), 2)
+
+        # Id 1 was taken first but its transaction commits only now, under the watermark
+        self.commit_mail(1)
+        self.assertEqual(self.run_linker(), (1, 1))
+        self.assertEqual(self.events(), [1, 2])
+        # Nothing is linked twice on later cycles
+        self.assertEqual(self.run_linker(), (0, 0))
+        self.assertEqual(self.events(), [1, 2])
+
+    def test_late_commit_with_linked_filter(self):
+        linked = LinkedMailFilter.load(self.db, ENTITY_TYPE_MAIL)
+        self.commit_mail(5)
+        self.run_linker(linked)
+        self.commit_mail(3)
+        self.commit_mail(6)
+        self.assertEqual(self.run_linker(linked), (2, 2))
+        self.assertEqual(self.run_linker(linked), (0, 0))
+        self.assertEqual(self.events(), [3, 5, 6])
+
+    def test_restart_does_not_link_again(self):
+        self.commit_mail(2)
+        self.run_linker()
+        self.checkpoint = Checkpoint.load(self.checkpoint.path, lookback=10)
+        self.assertEqual(self.run_linker(), (0, 0))
+        self.assertEqual(self.events(), [2])
+
+    def test_commit_below_the_lookback_is_not_read(self):
+        self.commit_mail(20)
+        self.run_linker()
+        self.commit_mail(9)
+        self.commit_mail(11)
+        self.assertEqual(self.run_linker(), (1, 1))
+        self.assertEqual(self.events(), [11, 20])
+
+    def test_new_mail_is_read_in_pages(self):
+        for mail_id in range(1, 6):
+            self.commit_mail(mail_id)
+        self.assertEqual(self.run_linker(config=dict(CONFIG, BatchSize=2)), (5, 5))
+        self.assertEqual(self.events(), [1, 2, 3, 4, 5])
+        self.assertEqual(self.checkpoint.watermark(TENANT), 5)
+
+    def test_watermark_moves_page_by_page(self):
+        for mail_id in range(1, 6):
+            self.commit_mail(mail_id)
+        # The third page fails: the two pages before it stay linked and saved
+        with self.assertRaises(LookupError):
+            self.run_linker(index=FailingIndex(self.index, calls=4), config=dict(CONFIG, BatchSize=2))
+        self.assertEqual(self.events(), [1, 2, 3, 4])
+        self.assertEqual(Checkpoint.load(self.checkpoint.path).watermark(TENANT), 4)
+
+    def test_async_cycle_links_late_commit(self):
+        self.commit_mail(2)
+        self.assertEqual(self.run_async_cycle(), (1, 1))
+        self.commit_mail(1)
+        self.assertEqual(self.run_async_cycle(), (1, 1))
+        self.assertEqual(self.run_async_cycle(), (0, 0))
+        self.assertEqual(self.events(), [1, 2])
+
+    def test_async_cycle_fails_when_matching_fails(self):
+        for mail_id in range(1, 21):
+            self.commit_mail(mail_id)
+        # Enough single-row pages to fill the bounded queues behind the failed matcher
+        with self.assertRaises(LookupError):
+            self.run_async_cycle(FailingIndex(), concurrency=1, page_size=1)
+        self.assertEqual(self.events(), [])
+
+
+class ChainLinkTest(unittest.TestCase):
+
+    def test_chain_links_each_message_to_its_own_participants(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            db = connect_sqlite(os.path.join(workdir, "crm.sqlite"))
+            for contact_id, address in ((7, "anna@example.com"), (8, "ben@example.com")):
+                db.execute("INSERT INTO crm_contact_info (data, tenant_id, contact_id, type) VALUES (?, ?, ?, ?)",
+                           (address, TENANT, contact_id, EMAIL_INFO_TYPE)).close()
+            db.commit()
+            index = ContactIndex.load(db)
+            db.close()
+        # Two messages of one conversation, each from a different contact
+        messages = [(1, TENANT, "anna@example.com", "", "", 3, "chain-1"),
+                    (2, TENANT, "ben@example.com", "", "", 3, "chain-1"),
+                    (3, TENANT, "anna@example.com", "", "", 3, "chain-1")]
+        chains = ChainContacts()
+        events = link_batch(index, messages, "2024-01-01 00:00:00", chains=chains)
+        self.assertEqual(events, link_batch(index, messages, "2024-01-01 00:00:00"))
+        self.assertEqual([[event[0] for event in message_events] for message_events in events], [[7], [8], [7]])
+        self.assertEqual((chains.hits, chains.misses), (2, 1))
+
+
+class FailingIndex:
+    """Contact index that hands the first calls lookups to index, then fails"""
+
+    def __init__(self, index=None, calls=0):
+        self.index = index
+        self.calls = calls
+
+    def resolve(self, tenant, addresses):
+        if self.calls <= 0:
+            raise LookupError("contact index unavailable")
+        self.calls -= 1
+        return self.index.resolve(tenant, addresses)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Checks that the patch pipeline only writes outputs that validate, on small
+synthetic assemblies. Run with python3 test_patch_pipeline.py (or pytest)
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from cli_metadata import CliMetadata
+from patch_pipeline import run_pipeline
+from patch_watch import PatchWatcher
+from synthetic_assembly import ENHANCED_STRINGS, ORIGINAL_STRINGS, AssemblyLayout, crm_types, write_crm_assembly
+
+SIZE = 64 * 1024
+METHODS = 50
+STEPS = ("smart-inject", "validate")
+
+
+def quietly(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+class ValidatedWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.original = self.path("original.dll")
+        self.enhanced = self.path("enhanced.dll")
+        self.output = self.path("output.dll")
+        write_crm_assembly(self.original, SIZE, METHODS)
+        # Same methods as the original with other bodies, so every engine method can be patched in
+        layout = AssemblyLayout(crm_types(METHODS, seed=1), ORIGINAL_STRINGS + ENHANCED_STRINGS, 0, "ASC.Mail.dll")
+        with open(self.enhanced, "wb") as f:
+            f.write(layout.head + layout.tail)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.workdir.name, name)
+
+    def corrupt_body(self, path, method_name):
+        """Clear the header byte of one method body so it no longer parses"""
+        with open(path, "rb") as f:
+            data = bytearray(f.read())
+        metadata = CliMetadata(bytes(data))
+        offset = next(m.offset for m in metadata.iter_methods() if m.name == method_name)
+        metadata.release()
+        data[offset] = 0
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def test_valid_output_is_written(self):
+        self.assertTrue(quietly(run_pipeline, self.original, self.enhanced, self.output, STEPS))
+        self.assertTrue(os.path.exists(self.output))
+
+    def test_corrupted_body_blocks_write(self):
+        with open(self.output, "wb") as f:
+            f.write(b"previous output")
+        self.corrupt_body(self.original, "Method7")
+        self.assertFalse(quietly(run_pipeline, self.original, self.enhanced, self.output, STEPS))
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), b"previous output")
+
+    def test_missing_engine_method_blocks_write(self):
+        # The enhanced build adds LinkChainToCrmEnhanced, which no byte patch can add
+        write_crm_assembly(self.enhanced, SIZE, METHODS, enhanced=True)
+        self.assertFalse(quietly(run_pipeline, self.original, self.enhanced, self.output, STEPS))
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_watch_keeps_last_good_output(self):
+        watcher = PatchWatcher(self.original, self.enhanced, self.output, STEPS)
+        self.assertTrue(quietly(watcher.check))
+        with open(self.output, "rb") as f:
+            good = f.read()
+        self.corrupt_body(self.original, "Method7")
+        os.utime(self.original, ns=(1, 1))
+        self.assertTrue(quietly(watcher.check))
+        with open(self.output, "rb") as f:
+            self.assertEqual(f.read(), good)
+
+
+if __name__ == "__main__":
+    unittest.main()